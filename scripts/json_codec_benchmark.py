@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+This script compares the time taken to load and dump a line-delimited snapshot with the standard
+library json module and with orjson, if it is installed. The datasets in the
+2024-08-24-hdx-snapshot-filtered.json test fixture are repeated to make a snapshot of roughly the
+size of a full HDX snapshot. The scale can be given as the first argument:
+
+python scripts/json_codec_benchmark.py 200
+"""
+import json
+import os
+import sys
+import time
+
+from hdx_cli_toolkit import codec_utilities
+
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "fixtures", "2024-08-24-hdx-snapshot-filtered.json"
+)
+DEFAULT_SCALE = 200
+N_REPEATS = 3
+
+
+def main():
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SCALE
+    with open(FIXTURE_PATH, encoding="utf-8") as fixture_file:
+        datasets = json.load(fixture_file)["result"]["results"] * scale
+    lines = [codec_utilities.dumps(x) for x in datasets]
+    size_mb = sum(len(x) + 1 for x in lines) / 1e6
+    print(f"{len(datasets)} datasets, {size_mb:.1f} MB of line-delimited JSON", flush=True)
+
+    codecs = {
+        "json": (
+            lambda x: json.dumps(x).encode("utf-8"),
+            json.loads,
+        )
+    }
+    if codec_utilities.orjson is not None:
+        codecs["orjson"] = (codec_utilities.orjson.dumps, codec_utilities.orjson.loads)
+    else:
+        print("orjson is not installed, install it with pip install orjson", flush=True)
+
+    print(f"{'codec':<10} {'load (s)':>10} {'dump (s)':>10}", flush=True)
+    for name, (dump_function, load_function) in codecs.items():
+        load_time = min(_time_function(load_function, lines) for _ in range(N_REPEATS))
+        dump_time = min(_time_function(dump_function, datasets) for _ in range(N_REPEATS))
+        print(f"{name:<10} {load_time:>10.3f} {dump_time:>10.3f}", flush=True)
+    print(f"The toolkit is using {codec_utilities.get_codec_name()}", flush=True)
+
+
+def _time_function(function, values) -> float:
+    t0 = time.perf_counter()
+    for value in values:
+        function(value)
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    main()
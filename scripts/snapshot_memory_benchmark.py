@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+This script compares the peak resident memory (RSS) of loading a snapshot in three ways:
+
+1. json.load - the whole legacy JSON snapshot decoded into dictionaries, as scan did before
+snapshots could be read one dataset at a time using their offset index.
+
+2. read_snapshot - the datasets read one at a time, as scan does, and held in a list.
+
+3. CompactSnapshot - the datasets read one at a time into a CompactSnapshot.
+
+Each is run in a separate process so that memory freed by one does not flatter the next. The
+datasets in the 2024-08-24-hdx-snapshot-filtered.json test fixture are repeated to make the
+snapshot, the scale can be given as the first argument:
+
+python scripts/snapshot_memory_benchmark.py 200
+
+RSS is measured with the resource module, so this script does not run on Windows.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from hdx_cli_toolkit.snapshot_utilities import load_compact_snapshot, read_snapshot, write_snapshot
+
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "fixtures", "2024-08-24-hdx-snapshot-filtered.json"
+)
+DEFAULT_SCALE = 200
+LOADERS = ["json.load", "read_snapshot", "CompactSnapshot"]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        if len(sys.argv) != 4 or sys.argv[2] not in LOADERS:
+            print(
+                f"Usage: {sys.argv[0]} --measure {{{','.join(LOADERS)}}} SNAPSHOT_PATH", flush=True
+            )
+            sys.exit(2)
+        measure_loader(sys.argv[2], sys.argv[3])
+        return
+
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SCALE
+    with open(FIXTURE_PATH, encoding="utf-8") as fixture_file:
+        datasets = json.load(fixture_file)["result"]["results"] * scale
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        snapshot_path = os.path.join(temporary_directory, "hdx-snapshot.json")
+        write_snapshot(datasets, snapshot_path)
+        del datasets
+        size_mb = os.path.getsize(snapshot_path) / 1e6
+        print(f"{size_mb:.1f} MB JSON snapshot", flush=True)
+        print(f"{'loader':<16} {'datasets':>9} {'load (s)':>9} {'peak RSS (MB)':>14}", flush=True)
+        for loader in LOADERS:
+            subprocess.run(
+                [sys.executable, __file__, "--measure", loader, snapshot_path], check=True
+            )
+
+
+def measure_loader(loader: str, snapshot_path: str):
+    t0 = time.perf_counter()
+    if loader == "json.load":
+        with open(snapshot_path, encoding="utf-8") as snapshot_file:
+            datasets = json.load(snapshot_file)["result"]["results"]
+    elif loader == "read_snapshot":
+        datasets = list(read_snapshot(snapshot_path))
+    else:
+        datasets = load_compact_snapshot(snapshot_path)
+    load_time = time.perf_counter() - t0
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1e3
+    print(f"{loader:<16} {len(datasets):>9} {load_time:>9.2f} {peak_rss_mb:>14.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,361 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import dataclasses
+import functools
+import itertools
 import json
+import os
+import statistics
+import threading
+import time
 import urllib3
 
-from collections import Counter
+from collections import Counter, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import urllib3.exceptions
 
 import ckanapi
 
-from hdx_cli_toolkit.hdx_utilities import get_hdx_url_and_key, configure_hdx_connection
-from hdx_cli_toolkit.utilities import query_dict
+from hdx_cli_toolkit.codec_utilities import dumps, loads
+from hdx_cli_toolkit.duplicate_utilities import DuplicateIndex
+from hdx_cli_toolkit.filter_utilities import compile_where
+from hdx_cli_toolkit.hdx_utilities import (
+    get_hdx_url_and_key,
+)
+from hdx_cli_toolkit.sketch_utilities import NumericDistribution
+from hdx_cli_toolkit.snapshot_utilities import read_snapshot
+from hdx_cli_toolkit.storage_utilities import add_dataset_storage
+from hdx_cli_toolkit.utilities import compile_query
 
 DEFAULT_ROW_LIMIT = 100
+DEFAULT_FETCH_WORKERS = 1
+MAX_ROW_LIMIT = 1000
+CHECKPOINT_MANIFEST = "manifest.json"
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+DEFAULT_SHARD_SIZE = 1000
+PARALLEL_ACTIONS = ["survey", "distribution", "list", "storage", "duplicates"]
+# Actions which need whole datasets, so cannot be run over resource records
+DATASET_ACTIONS = ["storage", "duplicates"]
+DEFAULT_DELETE_WORKERS = 1
+DEFAULT_DELETE_RATE = 10.0
+CURSOR_KEY = "id"
+
+# When the package_search "fl" parameter is supplied CKAN returns fields stored in its Solr index
+# rather than package dictionaries. These keys of the package dictionary can be rebuilt from the
+# listed Solr fields, resource fields are stored as lists with one entry per resource.
+PROJECTABLE_KEYS = {
+    "id": "id",
+    "name": "name",
+    "title": "title",
+    "notes": "notes",
+    "url": "url",
+    "version": "version",
+    "author": "author",
+    "maintainer": "maintainer",
+    "license_id": "license_id",
+    "owner_org": "owner_org",
+    "state": "state",
+    "metadata_created": "metadata_created",
+    "metadata_modified": "metadata_modified",
+    "num_resources": "num_resources",
+    "num_tags": "num_tags",
+    "private": "capacity",
+    "organization.name": "organization",
+    "resources.name": "res_name",
+    "resources.description": "res_description",
+    "resources.format": "res_format",
+    "resources.url": "res_url",
+}
+# Solr fields always requested with --fields, so that each record can be identified
+REQUIRED_FIELDS = ["id", "name", "owner_org"]
+
+
+class RetryableFetchError(Exception):
+    """Raised for package_search responses which should be retried"""
+
+
+@dataclasses.dataclass
+class FetchPolicy:
+    """A policy for making package_search requests. Failed requests are retried with exponential
+    backoff, the number of rows requested is halved when a request times out and doubled again
+    after a request completes in less than fast_request_seconds. The latency of every request is
+    recorded. A single policy may be shared between concurrent workers.
+    """
+
+    timeout: float = 20
+    max_retries: int = 5
+    backoff_factor: float = 1.0
+    min_rows: int = 50
+    max_rows: int = MAX_ROW_LIMIT
+    fast_request_seconds: float = 5.0
+    verbose: bool = False
+    rows: int = dataclasses.field(init=False)
+    latencies: list[dict] = dataclasses.field(init=False, repr=False)
+    _lock: threading.Lock = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.rows = self.max_rows
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def fetch(self, http, query_url: str, headers: dict, query: dict, offset: int) -> dict:
+        """Fetch the page of query["rows"] results starting at offset, in one or more requests
+        depending on the current number of rows per request.
+
+        Arguments:
+            http {urllib3.PoolManager} -- a PoolManager, or the urllib3 module
+            query_url {str} -- the package_search endpoint
+            headers {dict} -- request headers, including Authorization
+            query {dict} -- the package_search query
+            offset {int} -- the offset of the first result
+
+        Returns:
+            dict -- the decoded package_search response for the page
+        """
+        response_json = None
+        for request_json in self._request_page(http, query_url, headers, query, offset, True):
+            if response_json is None:
+                response_json = request_json
+            else:
+                response_json["result"]["results"].extend(request_json["result"]["results"])
+
+        return response_json
+
+    def fetch_raw(
+        self, http, query_url: str, headers: dict, query: dict, offset: int
+    ) -> list[bytes]:
+        """Fetch a page as fetch does but without decoding it, so that it can be decoded elsewhere.
+        Since the number of results in each response is not known, requests continue to the end
+        of the page even if the results run out.
+
+        Arguments:
+            http {urllib3.PoolManager} -- a PoolManager, or the urllib3 module
+            query_url {str} -- the package_search endpoint
+            headers {dict} -- request headers, including Authorization
+            query {dict} -- the package_search query
+            offset {int} -- the offset of the first result
+
+        Returns:
+            list[bytes] -- the body of each package_search response making up the page
+        """
+        return list(self._request_page(http, query_url, headers, query, offset, False))
+
+    def _request_page(
+        self, http, query_url: str, headers: dict, query: dict, offset: int, decode: bool
+    ) -> Iterator[dict | bytes]:
+        end = offset + query["rows"]
+        position = offset
+        attempt = 0
+        while position < end:
+            rows = min(self.rows, end - position)
+            request_query = query.copy()
+            request_query["start"] = position
+            request_query["rows"] = rows
+            t0 = time.time()
+            try:
+                response = http.request(
+                    "POST", query_url, headers=headers, json=request_query, timeout=self.timeout
+                )
+                if response.status in RETRYABLE_STATUSES:
+                    raise RetryableFetchError(f"HTTP status {response.status}")
+            except (
+                RetryableFetchError,
+                urllib3.exceptions.TimeoutError,
+                urllib3.exceptions.MaxRetryError,
+                urllib3.exceptions.ProtocolError,
+            ) as error:
+                attempt += 1
+                self._record(position, rows, None, time.time() - t0, error)
+                if attempt > self.max_retries:
+                    raise
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+                continue
+
+            attempt = 0
+            position += rows
+            if not decode:
+                self._record(request_query["start"], rows, None, time.time() - t0, None)
+                yield response.data
+                continue
+            request_json = loads(response.data)
+            n_results = len(request_json["result"]["results"])
+            self._record(request_query["start"], rows, n_results, time.time() - t0, None)
+            yield request_json
+            if n_results < rows:
+                break
+
+    def _record(
+        self, start: int, rows: int, n_results: int | None, latency: float, error: Exception | None
+    ):
+        timed_out = isinstance(error, urllib3.exceptions.TimeoutError) or (
+            isinstance(error, urllib3.exceptions.MaxRetryError)
+            and isinstance(error.reason, urllib3.exceptions.TimeoutError)
+        )
+        with self._lock:
+            if timed_out:
+                self.rows = max(self.min_rows, self.rows // 2)
+            elif error is None and latency < self.fast_request_seconds:
+                self.rows = min(self.max_rows, self.rows * 2)
+            self.latencies.append(
+                {
+                    "start": start,
+                    "rows": rows,
+                    "n_results": n_results,
+                    "latency": round(latency, 3),
+                    "error": "" if error is None else repr(error),
+                }
+            )
+        if self.verbose:
+            status = "ok" if error is None else f"failed with {error!r}"
+            print(f"Request for {rows} rows at {start} took {latency:0.2f}s, {status}", flush=True)
+
+    def summarise(self) -> dict:
+        """Summarise the requests made using this policy
+
+        Returns:
+            dict -- the number of requests and failures with latency statistics in seconds
+        """
+        latencies = [x["latency"] for x in self.latencies if x["error"] == ""]
+        summary = {
+            "n_requests": len(self.latencies),
+            "n_failures": len(self.latencies) - len(latencies),
+            "final_rows": self.rows,
+        }
+        summary.update(summarise_latencies(latencies))
+        return summary
+
+
+@dataclasses.dataclass
+class RateLimiter:
+    """A token bucket rate limiter which may be shared between threads. Tokens are added at rate
+    per second, up to capacity, and each call to acquire takes a token, waiting for one if none
+    are available. A rate of zero or less disables limiting.
+    """
+
+    rate: float = DEFAULT_DELETE_RATE
+    capacity: float = 1.0
+    _tokens: float = dataclasses.field(init=False, repr=False)
+    _updated: float = dataclasses.field(init=False, repr=False)
+    _lock: threading.Lock = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting until one is available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def summarise_latencies(latencies: list[float]) -> dict:
+    """Calculate summary statistics for a list of request latencies
+
+    Arguments:
+        latencies {list[float]} -- latencies in seconds
+
+    Returns:
+        dict -- mean, maximum, median and 90th percentile latencies where there are enough values
+    """
+    summary = {}
+    if len(latencies) != 0:
+        summary["mean_latency"] = round(statistics.mean(latencies), 3)
+        summary["max_latency"] = max(latencies)
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=10)
+        summary["p50_latency"] = round(quantiles[4], 3)
+        summary["p90_latency"] = round(quantiles[8], 3)
+    return summary
 
 
 def fetch_data_from_ckan_package_search(
-    query_url: str, query: dict, hdx_api_key: str, fetch_all: bool = False
+    query_url: str,
+    query: dict,
+    hdx_api_key: str,
+    fetch_all: bool = False,
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
 ) -> dict:
+    full_response_json = None
+    for new_response_json in fetch_pages_from_ckan_package_search(
+        query_url, query, hdx_api_key, fetch_all=fetch_all, workers=workers, policy=policy
+    ):
+        if full_response_json is None:
+            full_response_json = new_response_json
+        else:
+            full_response_json["result"]["results"].extend(new_response_json["result"]["results"])
+
+    return full_response_json
+
+
+def fetch_datasets_from_ckan_package_search(
+    query_url: str,
+    query: dict,
+    hdx_api_key: str,
+    fetch_all: bool = False,
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
+    cursor: bool = False,
+) -> Iterator[dict]:
+    """Stream the datasets returned by package_search, holding no more than the pages in flight in
+    memory.
+
+    Arguments:
+        query_url {str} -- the package_search endpoint
+        query {dict} -- the package_search query
+        hdx_api_key {str} -- an API key for the HDX site
+
+    Keyword Arguments:
+        fetch_all {bool} -- if True all pages are fetched (default: {False})
+        workers {int} -- the number of concurrent requests (default: {DEFAULT_FETCH_WORKERS})
+        policy {FetchPolicy | None} -- a retry and page size policy (default: {None})
+        cursor {bool} -- if True and fetch_all is True, pages are fetched one after another using
+        fetch_pages_with_cursor, workers is ignored (default: {False})
+
+    Yields:
+        Iterator[dict] -- package_search dataset dictionaries in query order, or in id order if
+        cursor is True
+    """
+    for page in fetch_pages_from_ckan_package_search(
+        query_url,
+        query,
+        hdx_api_key,
+        fetch_all=fetch_all,
+        workers=workers,
+        policy=policy,
+        cursor=cursor,
+    ):
+        yield from page["result"]["results"]
+
+
+def fetch_pages_from_ckan_package_search(
+    query_url: str,
+    query: dict,
+    hdx_api_key: str,
+    fetch_all: bool = False,
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
+    cursor: bool = False,
+) -> Iterator[dict]:
+    if fetch_all and cursor:
+        yield from fetch_pages_with_cursor(query_url, query, hdx_api_key, policy=policy)
+        return
+    if policy is None:
+        policy = FetchPolicy()
     headers = {
         "Authorization": hdx_api_key,
         "Content-Type": "application/json",
@@ -30,113 +369,902 @@ def fetch_data_from_ckan_package_search(
     payload = json.dumps(query)
     i = 1
     # print(f"{i}. Querying {query_url} with {payload}", flush=True)
-    response = urllib3.request("POST", query_url, headers=headers, json=query, timeout=20)
-    full_response_json = json.loads(response.data)
-    n_expected_result = full_response_json["result"]["count"]
+    response_json = policy.fetch(urllib3, query_url, headers, query, query["start"])
+    n_expected_result = response_json["result"]["count"]
 
-    result_length = len(full_response_json["result"]["results"])
+    result_length = len(response_json["result"]["results"])
+    n_fetched = result_length
+    yield response_json
 
     if fetch_all:
-        if result_length != n_expected_result:
+        if result_length != n_expected_result and workers > 1:
+            offsets = range(query["start"] + query["rows"], n_expected_result, query["rows"])
+            print(
+                f"Fetching {len(offsets)} further pages using {workers} concurrent workers",
+                flush=True,
+            )
+            for i, (offset, new_response_json) in enumerate(
+                fetch_pages_concurrently(
+                    query_url, headers, query, offsets, workers=workers, policy=policy
+                ),
+                start=2,
+            ):
+                print(f"{i}. Received page at offset {offset} from {query_url}", flush=True)
+                n_fetched += len(new_response_json["result"]["results"])
+                yield new_response_json
+        elif result_length != n_expected_result:
             while result_length != 0:
                 i += 1
                 start += query["rows"]
                 query["start"] = start
                 payload = json.dumps(query)
                 print(f"{i}. Querying {query_url} with {payload}", flush=True)
-                new_response = urllib3.request(
-                    "POST", query_url, headers=headers, json=query, timeout=20
-                )
-                new_response_json = json.loads(new_response.data)
+                new_response_json = policy.fetch(urllib3, query_url, headers, query, start)
                 result_length = len(new_response_json["result"]["results"])
-                full_response_json["result"]["results"].extend(
-                    new_response_json["result"]["results"]
-                )
+                n_fetched += result_length
+                yield new_response_json
         else:
             print(
                 f"CKAN API returned all results ({result_length}) on first page of 100", flush=True
             )
-        assert n_expected_result == len(full_response_json["result"]["results"])
+        assert n_expected_result == n_fetched
 
-    return full_response_json
 
+def fetch_pages_with_cursor(
+    query_url: str,
+    query: dict,
+    hdx_api_key: str,
+    policy: FetchPolicy | None = None,
+) -> Iterator[dict]:
+    """Fetch every page of a package_search query using keyset pagination. Results are sorted by id
+    and each page after the first is requested from the start of the results with a filter for ids
+    after the last id of the previous page, so Solr never skips over deep offsets and the time per
+    page does not grow through the fetch. Datasets added or deleted during the fetch cannot cause
+    others to be repeated or missed, as they can when paging by offset.
 
-def scan_survey(response: dict, key: str, verbose: bool = False) -> Counter:
-    key_occurence_counter = Counter()
-    list_of_keys = key.split(",")
+    Arguments:
+        query_url {str} -- the package_search endpoint
+        query {dict} -- the package_search query, its start and sort are ignored
+        hdx_api_key {str} -- an API key for the HDX site
 
-    for dataset in response["result"]["results"]:
-        output_row = {"dataset_name": dataset["name"]}
-        for key_ in list_of_keys:
-            output_row[key_] = f"{key_} key absent"
-        output_rows = query_dict(list_of_keys, dataset, output_row)
-
-        for row in output_rows:
-            for key_ in list_of_keys:
-                if "key absent" not in str(row[key_]):
-                    key_occurence_counter[key_] += 1
-                    if verbose:
-                        if key_ != "resources.name":
-                            comment = f"has {key_}"
-                            if key_.startswith("resources.") and "resources.name" in row.keys():
-                                print(
-                                    f"{dataset['name']} Resource:{row['resources.name']} {comment}",
-                                    flush=True,
-                                )
-                            else:
-                                print(f"{dataset['name']} {comment}", flush=True)
+    Keyword Arguments:
+        policy {FetchPolicy | None} -- a retry and page size policy (default: {None})
+
+    Yields:
+        Iterator[dict] -- package_search responses, one per page, in id order
+    """
+    if policy is None:
+        policy = FetchPolicy()
+    headers = {
+        "Authorization": hdx_api_key,
+        "Content-Type": "application/json",
+    }
+    page_query = query.copy()
+    page_query["sort"] = f"{CURSOR_KEY} asc"
+    page_query["start"] = 0
+    page_query.setdefault("rows", MAX_ROW_LIMIT)
+    if "fl" in page_query and CURSOR_KEY not in page_query["fl"]:
+        page_query["fl"] = list(page_query["fl"]) + [CURSOR_KEY]
+    base_filter = query.get("fq", "*:*")
+
+    n_expected_result = None
+    n_fetched = 0
+    last_key = None
+    for i in itertools.count(start=1):
+        if last_key is not None:
+            page_query["fq"] = f'({base_filter}) AND {CURSOR_KEY}:{{"{last_key}" TO *]'
+        response_json = policy.fetch(urllib3, query_url, headers, page_query, 0)
+        results = response_json["result"]["results"]
+        if n_expected_result is None:
+            n_expected_result = response_json["result"]["count"]
+        n_fetched += len(results)
+        if len(results) != 0:
+            print(f"{i}. Received {len(results)} results after {CURSOR_KEY} {last_key}", flush=True)
+            yield response_json
+        if len(results) < page_query["rows"]:
+            break
+        last_key = results[-1][CURSOR_KEY]
+
+    if n_fetched != n_expected_result:
+        print(
+            f"Fetched {n_fetched} datasets, CKAN reported {n_expected_result} at the start of the "
+            "fetch",
+            flush=True,
+        )
+
+
+def fetch_page_bodies_from_ckan_package_search(
+    query_url: str,
+    query: dict,
+    hdx_api_key: str,
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
+) -> Iterator[bytes]:
+    """Fetch every page of a package_search query without decoding the responses, so that they
+    can be passed to the worker processes of scan_in_parallel, which decode and scan one page while
+    further pages download. Only the first response is decoded here, to find the number of results,
+    and scan_in_parallel checks the number of datasets in all of the pages against it.
+    Pages are fetched by fetch_pages_concurrently, so up to 2 * workers pages are requested ahead
+    of the page being consumed.
+
+    Arguments:
+        query_url {str} -- the package_search endpoint
+        query {dict} -- the package_search query
+        hdx_api_key {str} -- an API key for the HDX site
+
+    Keyword Arguments:
+        workers {int} -- the number of concurrent requests (default: {DEFAULT_FETCH_WORKERS})
+        policy {FetchPolicy | None} -- a retry and page size policy (default: {None})
+
+    Yields:
+        Iterator[bytes] -- package_search response bodies in query order
+    """
+    if policy is None:
+        policy = FetchPolicy()
+    headers = {
+        "Authorization": hdx_api_key,
+        "Content-Type": "application/json",
+    }
+    page_query = query.copy()
+    page_query.setdefault("start", 0)
+    page_query.setdefault("rows", DEFAULT_ROW_LIMIT)
+    first_page = policy.fetch_raw(urllib3, query_url, headers, page_query, page_query["start"])
+    n_expected_result = loads(first_page[0])["result"]["count"]
+    yield from first_page
+
+    offsets = range(page_query["start"] + page_query["rows"], n_expected_result, page_query["rows"])
+    if len(offsets) != 0:
+        print(
+            f"Fetching {len(offsets)} further pages using {workers} concurrent workers, "
+            "decoding them in the scan worker processes",
+            flush=True,
+        )
+    for i, (offset, bodies) in enumerate(
+        fetch_pages_concurrently(
+            query_url, headers, page_query, offsets, workers=workers, policy=policy, raw=True
+        ),
+        start=2,
+    ):
+        print(f"{i}. Received page at offset {offset} from {query_url}", flush=True)
+        yield from bodies
+
+
+def refresh_datasets_from_ckan_package_search(
+    snapshot_path: str,
+    query_url: str,
+    hdx_api_key: str,
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
+    cursor: bool = False,
+) -> Iterator[dict]:
+    """Bring a snapshot up to date by fetching only those datasets modified since the newest
+    metadata_modified in the snapshot. Modified datasets replace their predecessors by id, new
+    datasets are appended and datasets whose ids no longer appear in an id-only listing of HDX
+    are dropped.
+
+    Arguments:
+        snapshot_path {str} -- a path to an existing snapshot file
+        query_url {str} -- the package_search endpoint
+        hdx_api_key {str} -- an API key for the HDX site
+
+    Keyword Arguments:
+        workers {int} -- the number of concurrent requests (default: {DEFAULT_FETCH_WORKERS})
+        policy {FetchPolicy | None} -- a retry and page size policy (default: {None})
+        cursor {bool} -- if True fetch with keyset rather than offset pagination (default: {False})
+
+    Yields:
+        Iterator[dict] -- the datasets of the refreshed snapshot
+    """
+    newest_modified = max(
+        (x["metadata_modified"] for x in read_snapshot(snapshot_path)), default=None
+    )
+    if newest_modified is None:
+        print(f"Snapshot at {snapshot_path} contains no datasets, nothing to refresh", flush=True)
+        return
+
+    # Solr expects UTC timestamps with at most millisecond precision
+    since = f"{newest_modified[0:23]}Z"
+    print(f"Fetching datasets modified since {since}", flush=True)
+    modified_query = {
+        "fq": f"metadata_modified:[{since} TO *]",
+        "start": 0,
+        "rows": MAX_ROW_LIMIT,
+    }
+    modified_datasets = {}
+    for dataset in fetch_datasets_from_ckan_package_search(
+        query_url,
+        modified_query,
+        hdx_api_key,
+        fetch_all=True,
+        workers=workers,
+        policy=policy,
+        cursor=cursor,
+    ):
+        modified_datasets[dataset["id"]] = dataset
+
+    print("Fetching id listing to reconcile deleted datasets", flush=True)
+    id_query = {"fq": "*:*", "fl": ["id"], "start": 0, "rows": MAX_ROW_LIMIT}
+    live_ids = {
+        x["id"]
+        for x in fetch_datasets_from_ckan_package_search(
+            query_url,
+            id_query,
+            hdx_api_key,
+            fetch_all=True,
+            workers=workers,
+            policy=policy,
+            cursor=cursor,
+        )
+    }
+
+    n_modified = 0
+    n_deleted = 0
+    for dataset in read_snapshot(snapshot_path):
+        if dataset["id"] in modified_datasets:
+            n_modified += 1
+            yield modified_datasets.pop(dataset["id"])
+        elif dataset["id"] in live_ids:
+            yield dataset
+        else:
+            n_deleted += 1
+
+    yield from modified_datasets.values()
+    print(
+        f"Refreshed snapshot: {n_modified} modified, {len(modified_datasets)} added, "
+        f"{n_deleted} deleted",
+        flush=True,
+    )
+
+
+def fetch_datasets_with_checkpoints(
+    query_url: str,
+    query: dict,
+    hdx_api_key: str,
+    checkpoint_directory: str,
+    resume: bool = False,
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
+) -> Iterator[dict]:
+    """Fetch all of the datasets matching a package_search query, saving each page to a checkpoint
+    directory along with a manifest of the offsets completed. If a fetch fails it can be resumed,
+    fetching only the pages missing from the checkpoint directory. Once all pages are present the
+    datasets are read back from the checkpoint directory in offset order.
+
+    Arguments:
+        query_url {str} -- the package_search endpoint
+        query {dict} -- the package_search query
+        hdx_api_key {str} -- an API key for the HDX site
+        checkpoint_directory {str} -- a directory in which to save pages and the manifest
+
+    Keyword Arguments:
+        resume {bool} -- if True continue from an existing manifest (default: {False})
+        workers {int} -- the number of concurrent requests (default: {DEFAULT_FETCH_WORKERS})
+        policy {FetchPolicy | None} -- a retry and page size policy (default: {None})
+
+    Yields:
+        Iterator[dict] -- package_search dataset dictionaries in query order
+    """
+    if policy is None:
+        policy = FetchPolicy()
+    headers = {
+        "Authorization": hdx_api_key,
+        "Content-Type": "application/json",
+    }
+    query = query.copy()
+    query["start"] = 0
+    query.setdefault("rows", MAX_ROW_LIMIT)
+    manifest_path = os.path.join(checkpoint_directory, CHECKPOINT_MANIFEST)
+
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["query_url"] != query_url or manifest["query"] != query:
+            raise ValueError(
+                f"Checkpoint manifest at {manifest_path} was made for a different query, "
+                "use a new checkpoint directory"
+            )
+        print(
+            f"Resuming from {manifest_path} with {len(manifest['completed_offsets'])} "
+            "pages already fetched",
+            flush=True,
+        )
+    else:
+        os.makedirs(checkpoint_directory, exist_ok=True)
+        http = urllib3.PoolManager(maxsize=workers)
+        first_page = policy.fetch(http, query_url, headers, query, 0)
+        manifest = {
+            "query_url": query_url,
+            "query": query,
+            "count": first_page["result"]["count"],
+            "completed_offsets": [],
+        }
+        _save_checkpoint_page(checkpoint_directory, manifest, 0, first_page)
+
+    offsets = range(0, manifest["count"], query["rows"])
+    completed_offsets = set(manifest["completed_offsets"])
+    missing_offsets = [x for x in offsets if x not in completed_offsets]
+    if len(missing_offsets) != 0:
+        print(
+            f"Fetching {len(missing_offsets)} of {len(offsets)} pages into {checkpoint_directory}",
+            flush=True,
+        )
+    for i, (offset, page) in enumerate(
+        fetch_pages_concurrently(
+            query_url, headers, query, missing_offsets, workers=workers, policy=policy
+        ),
+        start=1,
+    ):
+        print(f"{i}. Checkpointed page at offset {offset} from {query_url}", flush=True)
+        _save_checkpoint_page(checkpoint_directory, manifest, offset, page)
+
+    # Pages fetched at different times may overlap if datasets were added in between
+    dataset_ids = set()
+    for offset in offsets:
+        with open(_checkpoint_page_path(checkpoint_directory, offset), "rb") as page_file:
+            page = loads(page_file.read())
+        for dataset in page["result"]["results"]:
+            if dataset.get("id") in dataset_ids:
+                continue
+            dataset_ids.add(dataset.get("id"))
+            yield dataset
+
+    if len(dataset_ids) != manifest["count"]:
+        print(
+            f"Checkpointed pages contain {len(dataset_ids)} datasets, "
+            f"CKAN reported {manifest['count']} at the start of the fetch",
+            flush=True,
+        )
+
+
+def _checkpoint_page_path(checkpoint_directory: str, offset: int) -> str:
+    return os.path.join(checkpoint_directory, f"page-{offset:08d}.json")
+
+
+def _save_checkpoint_page(checkpoint_directory: str, manifest: dict, offset: int, page: dict):
+    # Pages and the manifest are written to temporary files and moved into place so that an
+    # interrupted run never leaves a partial file that looks complete
+    page_path = _checkpoint_page_path(checkpoint_directory, offset)
+    with open(f"{page_path}.tmp", "wb") as page_file:
+        page_file.write(dumps(page))
+    os.replace(f"{page_path}.tmp", page_path)
+
+    manifest["completed_offsets"].append(offset)
+    manifest_path = os.path.join(checkpoint_directory, CHECKPOINT_MANIFEST)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def make_field_projection(keys: list[str]) -> dict[str, str] | None:
+    """Work out the Solr fields needed to answer a scan for a list of keys, so that package_search
+    returns only those rather than complete package dictionaries.
+
+    Arguments:
+        keys {list[str]} -- a list of key definitions, as supplied to --key
+
+    Returns:
+        dict[str, str] | None -- a mapping of each key to its Solr field, or None if any key cannot
+                                 be answered from the Solr index
+    """
+    projection = {}
+    for key_ in keys:
+        if key_ not in PROJECTABLE_KEYS:
+            return None
+        projection[key_] = PROJECTABLE_KEYS[key_]
+    return projection
+
+
+def reshape_projected_dataset(projected_dataset: dict, projection: dict[str, str]) -> dict:
+    """Rebuild the package dictionary structure for a result returned using a field projection
+
+    Arguments:
+        projected_dataset {dict} -- a package_search result for a query with "fl" supplied
+        projection {dict[str, str]} -- a projection as returned by make_field_projection
+
+    Returns:
+        dict -- a package dictionary containing only the projected keys, resource keys whose
+                number of values differs from the number of resource names are left out
+    """
+    dataset = {}
+    resource_values = {}
+    for key_, field in projection.items():
+        if field not in projected_dataset:
+            continue
+        value = projected_dataset[field]
+        if key_ == "private":
+            dataset["private"] = value == "private"
+        elif key_.startswith("resources."):
+            resource_values[key_.split(".")[1]] = value if isinstance(value, list) else [value]
+        elif "." in key_:
+            key1, key2 = key_.split(".")
+            dataset.setdefault(key1, {})[key2] = value
+        else:
+            dataset[key_] = value
+
+    if len(resource_values) != 0:
+        # Solr leaves missing values out of multi-valued fields, so a resource field with a
+        # different number of values to the resource names cannot be matched to the resources and
+        # is left out rather than attributed to the wrong ones
+        n_resources = len(resource_values.get("name", next(iter(resource_values.values()))))
+        dataset["resources"] = [{} for _ in range(n_resources)]
+        for resource_key, values in resource_values.items():
+            if len(values) != n_resources:
+                continue
+            for resource, resource_value in zip(dataset["resources"], values):
+                resource[resource_key] = resource_value
+    return dataset
+
+
+def fetch_pages_concurrently(
+    query_url: str,
+    headers: dict,
+    query: dict,
+    offsets: Iterable[int],
+    workers: int = DEFAULT_FETCH_WORKERS,
+    policy: FetchPolicy | None = None,
+    raw: bool = False,
+) -> Iterator[tuple[int, dict | list[bytes]]]:
+    """Fetch package_search pages at the given offsets using a bounded pool of worker threads.
+    Pages are yielded in the order of offsets, regardless of the order in which they complete, and
+    at most 2 * workers pages are held in memory at any one time.
+
+    Arguments:
+        query_url {str} -- the package_search endpoint
+        headers {dict} -- request headers, including Authorization
+        query {dict} -- the package_search query, "start" is replaced by each offset in turn
+        offsets {Iterable[int]} -- the offsets of the pages to fetch
+
+    Keyword Arguments:
+        workers {int} -- the number of concurrent requests (default: {DEFAULT_FETCH_WORKERS})
+        policy {FetchPolicy | None} -- a retry and page size policy (default: {None})
+        raw {bool} -- if True pages are fetched with FetchPolicy.fetch_raw and not decoded
+        (default: {False})
+
+    Yields:
+        Iterator[tuple[int, dict | list[bytes]]] -- the offset and decoded JSON response for each
+        page, or the response bodies if raw is True
+    """
+    if policy is None:
+        policy = FetchPolicy()
+    fetch = policy.fetch_raw if raw else policy.fetch
+    http = urllib3.PoolManager(maxsize=workers)
+    offsets_iterator = iter(offsets)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for offset in itertools.islice(offsets_iterator, 2 * workers):
+            pending.append(
+                (offset, executor.submit(fetch, http, query_url, headers, query, offset))
+            )
+        while pending:
+            offset, future = pending.popleft()
+            page = future.result()
+            next_offset = next(offsets_iterator, None)
+            if next_offset is not None:
+                pending.append(
+                    (
+                        next_offset,
+                        executor.submit(fetch, http, query_url, headers, query, next_offset),
+                    )
+                )
+            yield offset, page
+
+
+def iterate_datasets(response: dict | Iterable[dict]) -> Iterable[dict]:
+    """Scan actions accept either a package_search response, as returned by
+    fetch_data_from_ckan_package_search, or any iterable of dataset dictionaries such as the
+    generators returned by fetch_datasets_from_ckan_package_search and read_snapshot.
+
+    Arguments:
+        response {dict | Iterable[dict]} -- a package_search response or iterable of datasets
+
+    Returns:
+        Iterable[dict] -- an iterable of dataset dictionaries
+    """
+    if isinstance(response, dict):
+        return response["result"]["results"]
+    return response
+
+
+def iterate_resources(response: dict | Iterable[dict]) -> Iterator[dict]:
+    """Iterate over the resources of datasets, as records for resource scan actions. Each record is
+    a shallow copy of the resource with the parent dataset added under "dataset" and its
+    organization under "organization", the dataset is shared between its resources rather than
+    copied.
+
+    Arguments:
+        response {dict | Iterable[dict]} -- a package_search response or iterable of datasets
+
+    Yields:
+        Iterator[dict] -- one record per resource, in dataset order
+    """
+    for dataset in iterate_datasets(response):
+        for resource in dataset.get("resources") or []:
+            record = resource.copy()
+            record["dataset"] = dataset
+            record["organization"] = dataset.get("organization")
+            yield record
+
+
+def resource_key_to_dataset_key(key: str) -> str:
+    """Convert a key for a resource record from iterate_resources into the equivalent key for a
+    dataset, for example format to resources.format or dataset.name to name
+
+    Arguments:
+        key {str} -- a key for a resource record
+
+    Returns:
+        str -- the equivalent dataset key
+    """
+    if key.startswith("dataset."):
+        return key.removeprefix("dataset.")
+    if key.startswith("organization."):
+        return key
+    return f"resources.{key}"
+
+
+def scan_survey(response: dict | Iterable[dict], key: str, verbose: bool = False) -> Counter:
+    key_occurence_counter = Counter()
+    survey_dataset = _make_dataset_scanner("survey", key, key_occurence_counter, verbose=verbose)
+    for dataset in iterate_datasets(response):
+        survey_dataset(dataset)
 
     return key_occurence_counter
 
 
 def scan_delete_key(
-    response: dict, key: str, hdx_site: str = "stage", verbose: bool = False
+    response: dict | Iterable[dict],
+    key: str,
+    hdx_site: str = "stage",
+    verbose: bool = False,
+    workers: int = DEFAULT_DELETE_WORKERS,
+    rate: float = DEFAULT_DELETE_RATE,
 ) -> Counter:
+    """Delete a key from datasets, or from their resources for keys of the form resources.key, using
+    a bounded pool of worker threads. Requests to CKAN are limited to rate per second across all
+    workers, and the updates for a dataset are made in sequence by a single worker because CKAN
+    resource_update rewrites the whole dataset. The latency of each update is reported.
+
+    Arguments:
+        response {dict | Iterable[dict]} -- a package_search response or iterable of datasets
+        key {str} -- the key to delete
+
+    Keyword Arguments:
+        hdx_site {str} -- an hdx_site value (default: {"stage"})
+        verbose {bool} -- print each update as it is made (default: {False})
+        workers {int} -- the number of concurrent workers (default: {DEFAULT_DELETE_WORKERS})
+        rate {float} -- the maximum requests per second (default: {DEFAULT_DELETE_RATE})
+
+    Returns:
+        Counter -- the number of occurrences of the key deleted
+    """
     # Does not use query_dict because we want this to be as controlled as possible
-    configure_hdx_connection(hdx_site, verbose=True)
     hdx_site_url, hdx_api_key, user_agent = get_hdx_url_and_key(hdx_site=hdx_site)
-    ckan = ckanapi.RemoteCKAN(
-        hdx_site_url,
-        apikey=hdx_api_key,
-        user_agent=user_agent,
-    )
+    rate_limiter = RateLimiter(rate=rate)
+    # RemoteCKAN holds a requests session, so each thread gets its own
+    thread_data = threading.local()
 
-    key_occurence_counter = Counter()
-    for i, dataset in enumerate(response["result"]["results"]):
+    def delete_from_dataset(dataset: dict) -> list[dict]:
+        if not hasattr(thread_data, "ckan"):
+            thread_data.ckan = ckanapi.RemoteCKAN(
+                hdx_site_url, apikey=hdx_api_key, user_agent=user_agent
+            )
+        updates = []
         if key.startswith("resources."):
             resource_key = key.split(".")[1]
             for resource in dataset["resources"]:
                 if resource_key in resource.keys():
                     resource.pop(resource_key)
-                    assert key not in resource.keys()
-                    ckan.action.resource_update(**resource)
-                    key_occurence_counter[key] += 1
-                    if verbose:
-                        comment = f"has {key} - deleted"
-                        print(dataset["name"], flush=True)
-                        print(f"\t{resource['name']} {comment}", flush=True)
-        else:
-            if key in dataset.keys():
-                dataset.pop(key)
-                assert key not in dataset.keys()
-                hdx_site_url, hdx_api_key, user_agent = get_hdx_url_and_key(hdx_site=hdx_site)
-                ckan.action.package_update(**dataset)
+                    assert resource_key not in resource.keys()
+                    updates.append(("resource_update", resource, resource["name"]))
+        elif key in dataset.keys():
+            dataset.pop(key)
+            assert key not in dataset.keys()
+            updates.append(("package_update", dataset, ""))
+
+        update_latencies = []
+        for action, payload, resource_name in updates:
+            rate_limiter.acquire()
+            t0 = time.time()
+            thread_data.ckan.call_action(action, data_dict=payload)
+            update_latencies.append(
+                {
+                    "dataset_name": dataset["name"],
+                    "resource_name": resource_name,
+                    "latency": round(time.time() - t0, 3),
+                }
+            )
+        return update_latencies
+
+    key_occurence_counter = Counter()
+    latencies = []
+    datasets_iterator = iter(iterate_datasets(response))
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for dataset in itertools.islice(datasets_iterator, 2 * workers):
+            pending.append(executor.submit(delete_from_dataset, dataset))
+        while pending:
+            update_latencies = pending.popleft().result()
+            next_dataset = next(datasets_iterator, None)
+            if next_dataset is not None:
+                pending.append(executor.submit(delete_from_dataset, next_dataset))
+            for update in update_latencies:
                 key_occurence_counter[key] += 1
+                latencies.append(update["latency"])
                 if verbose:
-                    comment = f"has {key} - deleted"
-                    print(f"{dataset['name']} {comment}", flush=True)
+                    comment = f"has {key} - deleted in {update['latency']:0.2f}s"
+                    if update["resource_name"] != "":
+                        print(update["dataset_name"], flush=True)
+                        print(f"\t{update['resource_name']} {comment}", flush=True)
+                    else:
+                        print(f"{update['dataset_name']} {comment}", flush=True)
 
-    return key_occurence_counter
+    if len(latencies) != 0:
+        print(f"CKAN updates: {summarise_latencies(latencies)}", flush=True)
 
+    return key_occurence_counter
 
-def scan_distribution(response: dict, key: str, verbose: bool = False) -> Counter:
-    value_occurence_counter = Counter()
 
-    for i, dataset in enumerate(response["result"]["results"]):
-        output_row = {key: ""}
-        output_rows = query_dict([key], dataset, output_row)
-        for row in output_rows:
-            if "key absent" not in str(row[key]):
-                value_occurence_counter[row[key]] += 1
+def scan_distribution(
+    response: dict | Iterable[dict],
+    key: str,
+    verbose: bool = False,
+    make_distribution: Callable[[], Counter | NumericDistribution] = Counter,
+) -> Counter | NumericDistribution:
+    value_occurence_counter = make_distribution()
+    distribution_dataset = _make_dataset_scanner("distribution", key, value_occurence_counter)
+    for dataset in iterate_datasets(response):
+        distribution_dataset(dataset)
 
     return value_occurence_counter
+
+
+def scan_actions(
+    response: dict | Iterable[dict],
+    actions: list[tuple[str, str]],
+    verbose: bool = False,
+    make_distribution: Callable[[], Counter | NumericDistribution] = Counter,
+    where: str | None = None,
+    resources: bool = False,
+) -> list[Counter | NumericDistribution | list[dict]]:
+    """Run several actions from PARALLEL_ACTIONS in a single pass over the datasets, each result is
+    identical to that of running the action on its own. If resources is True the actions are run
+    over the resource records from iterate_resources rather than datasets, and keys refer to those
+    records.
+
+    Arguments:
+        response {dict | Iterable[dict]} -- a package_search response or iterable of datasets
+        actions {list[tuple[str, str]]} -- (action, key) pairs, actions from PARALLEL_ACTIONS
+
+    Keyword Arguments:
+        verbose {bool} -- print the per-dataset output of survey actions (default: {False})
+        make_distribution {Callable} -- makes the result of distribution actions, Counter for exact
+        counts of values or a summary from sketch_utilities (default: {Counter})
+        where {str | None} -- a where expression selecting the datasets, or resource records, to
+        scan (default: {None})
+        resources {bool} -- if True scan resource records rather than datasets (default: {False})
+
+    Returns:
+        list[Counter | NumericDistribution | list[dict]] -- a result for each action, a Counter for
+        survey, the result of make_distribution for distribution, rows for list, a Counter of
+        totals from storage_utilities for storage, or a DuplicateIndex for duplicates
+    """
+    for action, _ in actions:
+        if action not in PARALLEL_ACTIONS:
+            raise ValueError(f"Action '{action}' cannot be combined with other actions")
+        if action in DATASET_ACTIONS and resources:
+            raise ValueError(f"Action '{action}' cannot be run over resource records")
+
+    results = [_make_action_result(action, make_distribution) for action, _ in actions]
+    name_column = "resource_name" if resources else "dataset_name"
+    scanners = [
+        _make_dataset_scanner(action, key, result, verbose=verbose, name_column=name_column)
+        for (action, key), result in zip(actions, results)
+    ]
+    records = iterate_resources(response) if resources else iterate_datasets(response)
+    if where is not None:
+        is_selected = compile_where(where)
+        records = (x for x in records if is_selected(x))
+    for record in records:
+        for scan_dataset in scanners:
+            scan_dataset(record)
+
+    return results
+
+
+def _make_action_result(
+    action: str, make_distribution: Callable[[], Counter | NumericDistribution]
+) -> Counter | NumericDistribution | DuplicateIndex | list[dict]:
+    if action == "list":
+        return []
+    if action == "distribution":
+        return make_distribution()
+    if action == "duplicates":
+        return DuplicateIndex()
+    return Counter()
+
+
+def _make_dataset_scanner(
+    action: str,
+    key: str,
+    result: Counter | NumericDistribution | list[dict],
+    verbose: bool = False,
+    name_column: str = "dataset_name",
+) -> Callable[[dict], None]:
+    # Returns a function which adds a single dataset, or resource record, to the result of an
+    # action, the keys are compiled once so that nothing is parsed per dataset
+    if action == "storage":
+        return functools.partial(add_dataset_storage, result)
+    if action == "duplicates":
+        return result.add_dataset
+
+    list_of_keys = key.split(",")
+    query = compile_query(list_of_keys)
+
+    if action == "survey":
+        survey_template = {name_column: ""}
+        for key_ in list_of_keys:
+            survey_template[key_] = f"{key_} key absent"
+
+        def survey_dataset(dataset: dict):
+            output_row = survey_template.copy()
+            output_row[name_column] = dataset.get("name", "")
+            for row in query(dataset, output_row):
+                for key_ in list_of_keys:
+                    if "key absent" not in str(row[key_]):
+                        result[key_] += 1
+                        if verbose:
+                            _print_survey_row(dataset, row, key_)
+
+        return survey_dataset
+
+    if action == "distribution" and not isinstance(result, Counter):
+
+        def summarise_dataset(dataset: dict):
+            for row in query(dataset, {key: ""}):
+                if "key absent" not in str(row[key]):
+                    result.add(row[key])
+
+        return summarise_dataset
+
+    if action == "distribution":
+
+        def distribution_dataset(dataset: dict):
+            for row in query(dataset, {key: ""}):
+                if "key absent" not in str(row[key]):
+                    result[row[key]] += 1
+
+        return distribution_dataset
+
+    list_template = {name_column: ""}
+    for key_ in list_of_keys:
+        list_template[key_] = ""
+
+    def list_dataset(dataset: dict):
+        output_row = list_template.copy()
+        output_row[name_column] = dataset.get("name", "")
+        result.extend(query(dataset, output_row))
+
+    return list_dataset
+
+
+def _print_survey_row(dataset: dict, row: dict, key_: str):
+    if key_ != "resources.name":
+        comment = f"has {key_}"
+        if key_.startswith("resources.") and "resources.name" in row.keys():
+            print(f"{dataset['name']} Resource:{row['resources.name']} {comment}", flush=True)
+        else:
+            print(f"{dataset['name']} {comment}", flush=True)
+
+
+def scan_in_parallel(
+    datasets: Iterable[dict | str | bytes],
+    actions: list[tuple[str, str]],
+    workers: int,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    where: str | None = None,
+    make_distribution: Callable[[], Counter | NumericDistribution] = Counter,
+    resources: bool = False,
+    projection: dict[str, str] | None = None,
+) -> list[Counter | NumericDistribution | list[dict]]:
+    """Run actions from PARALLEL_ACTIONS in a pool of worker processes. Datasets are partitioned
+    into shards of consecutive datasets and the per-shard results are merged in shard order, so
+    that the result is identical to that of the serial action. Datasets may be supplied as
+    dictionaries, as lines from a line-delimited snapshot or as package_search response bodies from
+    fetch_page_bodies_from_ckan_package_search, each of which counts as one item of a shard. Lines
+    and response bodies are decoded in the worker processes, and a where expression is
+    applied there after decoding. The number of datasets in the response bodies must match the
+    count reported by CKAN, as for a serial fetch.
+
+    Arguments:
+        datasets {Iterable[dict | str | bytes]} -- an iterable of datasets, JSON encoded datasets
+        or package_search response bodies
+        actions {list[tuple[str, str]]} -- (action, key) pairs, actions from PARALLEL_ACTIONS
+        workers {int} -- the number of worker processes
+
+    Keyword Arguments:
+        shard_size {int} -- the number of datasets in each shard (default: {DEFAULT_SHARD_SIZE})
+        where {str | None} -- a where expression selecting the datasets, or resource records, to
+        scan (default: {None})
+        make_distribution {Callable} -- makes the result of distribution actions, which must be
+        picklable (default: {Counter})
+        resources {bool} -- if True scan resource records rather than datasets (default: {False})
+        projection {dict[str, str] | None} -- a field projection, as returned by
+        make_field_projection, used to reshape datasets after decoding (default: {None})
+
+    Returns:
+        list[Counter | NumericDistribution | list[dict]] -- a result for each action, as returned by
+        scan_actions
+    """
+    merged_results = [_make_action_result(action, make_distribution) for action, _ in actions]
+    datasets_iterator = iter(datasets)
+    shards = iter(lambda: list(itertools.islice(datasets_iterator, shard_size)), [])
+    scan_shard = functools.partial(
+        _scan_shard,
+        actions,
+        where=where,
+        make_distribution=make_distribution,
+        resources=resources,
+        projection=projection,
+    )
+    n_expected_result = None
+    n_fetched = 0
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard in itertools.islice(shards, 2 * workers):
+            pending.append(executor.submit(scan_shard, shard))
+        while pending:
+            shard_count, n_shard_results, shard_results = pending.popleft().result()
+            if n_expected_result is None:
+                n_expected_result = shard_count
+            n_fetched += n_shard_results
+            next_shard = next(shards, None)
+            if next_shard is not None:
+                pending.append(executor.submit(scan_shard, next_shard))
+            for (action, _), merged_result, shard_result in zip(
+                actions, merged_results, shard_results
+            ):
+                if action == "list":
+                    merged_result.extend(shard_result)
+                else:
+                    merged_result.update(shard_result)
+
+    # A page which is short or repeated while paging would otherwise give incomplete results
+    if n_expected_result is not None:
+        assert (
+            n_expected_result == n_fetched
+        ), f"Fetched {n_fetched} datasets, CKAN reported {n_expected_result}"
+    return merged_results
+
+
+def _scan_shard(
+    actions: list[tuple[str, str]],
+    shard: list[dict | str | bytes],
+    where: str | None = None,
+    make_distribution: Callable[[], Counter | NumericDistribution] = Counter,
+    resources: bool = False,
+    projection: dict[str, str] | None = None,
+) -> tuple[int | None, int, list[Counter | NumericDistribution | list[dict]]]:
+    # Returns the count reported in the first response body, if any, and the number of datasets
+    # from response bodies along with the results
+    datasets = []
+    count = None
+    n_results = 0
+    for item in shard:
+        if isinstance(item, bytes):
+            response_json = loads(item)
+            if count is None:
+                count = response_json["result"].get("count")
+            n_results += len(response_json["result"]["results"])
+            datasets.extend(response_json["result"]["results"])
+        else:
+            datasets.append(loads(item) if isinstance(item, str) else item)
+    if projection is not None:
+        datasets = [reshape_projected_dataset(x, projection) for x in datasets]
+    results = scan_actions(
+        datasets,
+        actions,
+        make_distribution=make_distribution,
+        where=where,
+        resources=resources,
+    )
+    return count, n_results, results
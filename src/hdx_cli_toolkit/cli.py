@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import dataclasses
+import functools
 import json
 import os
+import random
 import time
 
 from collections import Counter
-from collections.abc import Callable
+from collections.abc import Callable, Iterable
 
-from typing import Optional
+from typing import Any, Optional
 
 import click
 from click.decorators import FC
@@ -46,10 +49,65 @@ from hdx_cli_toolkit.hdx_utilities import (
 )
 
 from hdx_cli_toolkit.ckan_utilities import (
-    fetch_data_from_ckan_package_search,
-    scan_survey,
+    fetch_datasets_from_ckan_package_search,
+    fetch_page_bodies_from_ckan_package_search,
+    refresh_datasets_from_ckan_package_search,
+    make_field_projection,
+    reshape_projected_dataset,
+    fetch_datasets_with_checkpoints,
+    FetchPolicy,
     scan_delete_key,
-    scan_distribution,
+    scan_actions,
+    scan_in_parallel,
+    resource_key_to_dataset_key,
+    PARALLEL_ACTIONS,
+    DATASET_ACTIONS,
+    DEFAULT_SHARD_SIZE,
+    REQUIRED_FIELDS,
+)
+
+from hdx_cli_toolkit.diff_utilities import diff_snapshots
+from hdx_cli_toolkit.filter_utilities import compile_where, list_where_keys
+from hdx_cli_toolkit.sketch_utilities import (
+    ApproximateDistribution,
+    NumericDistribution,
+    DEFAULT_COUNT_ERROR,
+    DEFAULT_DISTINCT_ERROR,
+    DEFAULT_TOP_K,
+)
+
+from hdx_cli_toolkit.snapshot_utilities import (
+    read_snapshot,
+    read_snapshot_lines,
+    load_compact_snapshot,
+    stream_to_snapshot,
+    is_line_delimited_snapshot,
+    make_manifest_path,
+    stream_to_store,
+    select_from_snapshot,
+    list_snapshot_names,
+)
+
+from hdx_cli_toolkit.index_utilities import (
+    build_snapshot_index,
+    iterate_datasets_from_index,
+    survey_from_index,
+    distribution_from_index,
+    list_from_index,
+)
+
+from hdx_cli_toolkit.storage_utilities import STORAGE_KEYS, make_storage_table
+from hdx_cli_toolkit.duplicate_utilities import (
+    DUPLICATE_KEYS,
+    DuplicateIndex,
+    make_duplicates_table,
+)
+
+from hdx_cli_toolkit.table_utilities import (
+    build_snapshot_tables,
+    survey_from_tables,
+    distribution_from_tables,
+    list_from_tables,
 )
 
 from hdx_cli_toolkit.data_quality_utilities import (
@@ -119,6 +177,15 @@ def multi_decorator(options: list[Callable[[FC], FC]]) -> Callable[[FC], FC]:
 
 @hdx_toolkit.command(name="list")
 @multi_decorator(OPTIONS)
+@click.option(
+    "--snapshot_path",
+    is_flag=False,
+    default=None,
+    help=(
+        "A file path to a snapshot written by scan, datasets are read from it rather than HDX "
+        "using its offset index"
+    ),
+)
 @click.option(
     "--output_path",
     is_flag=False,
@@ -133,16 +200,23 @@ def list_datasets(
     query: Optional[str] = None,
     hdx_site: str = "stage",
     output_path: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
 ):
     """List datasets in HDX"""
     print_banner("list")
 
-    filtered_datasets = get_filtered_datasets(
-        organization=organization,
-        dataset_filter=dataset_filter,
-        query=query,
-        hdx_site=hdx_site,
-    )
+    if snapshot_path is not None:
+        filtered_datasets = get_datasets_from_snapshot(
+            snapshot_path, organization, dataset_filter, query
+        )
+        print(f"Found {len(filtered_datasets)} datasets in {snapshot_path}", flush=True)
+    else:
+        filtered_datasets = get_filtered_datasets(
+            organization=organization,
+            dataset_filter=dataset_filter,
+            query=query,
+            hdx_site=hdx_site,
+        )
     # Automate setting of with_extras
     with_extras = False
     for extra_key in ["resources", "quickcharts", "showcases", "fs_check_info", "shape_info"]:
@@ -249,6 +323,15 @@ def update(
 
 @hdx_toolkit.command(name="print")
 @multi_decorator(OPTIONS)
+@click.option(
+    "--snapshot_path",
+    is_flag=False,
+    default=None,
+    help=(
+        "A file path to a snapshot written by scan, datasets are read from it rather than HDX "
+        "using its offset index"
+    ),
+)
 @click.option(
     "--with_extras",
     is_flag=True,
@@ -266,21 +349,31 @@ def print_datasets(
     query: Optional[str] = None,
     hdx_site: str = "stage",
     with_extras: bool = False,
+    snapshot_path: Optional[str] = None,
 ):
     """Print datasets in HDX to the terminal"""
 
-    filtered_datasets = get_filtered_datasets(
-        organization=organization,
-        dataset_filter=dataset_filter,
-        hdx_site=hdx_site,
-        query=query,
-        verbose=False,
-    )
+    if snapshot_path is not None:
+        filtered_datasets = get_datasets_from_snapshot(
+            snapshot_path, organization, dataset_filter, query
+        )
+    else:
+        filtered_datasets = get_filtered_datasets(
+            organization=organization,
+            dataset_filter=dataset_filter,
+            hdx_site=hdx_site,
+            query=query,
+            verbose=False,
+        )
 
     print("[", flush=True)
     for i, dataset in enumerate(filtered_datasets):
-        output_dict = dataset.data
-        if with_extras:
+        # Datasets from a snapshot are package_search records which already include resources
+        if isinstance(dataset, dict):
+            output_dict = dataset
+        elif not with_extras:
+            output_dict = dataset.data
+        else:
             output_dict = decorate_dataset_with_extras(dataset)
 
         print(json.dumps(output_dict, indent=4), flush=True)
@@ -701,6 +794,126 @@ def remove_extras_key(
         print(status, flush=True)
 
 
+# Actions which can be answered by SQL queries against a snapshot index, or from columnar tables
+INDEX_QUERIES = {
+    "survey": survey_from_index,
+    "distribution": distribution_from_index,
+    "list": list_from_index,
+}
+TABLE_QUERIES = {
+    "survey": survey_from_tables,
+    "distribution": distribution_from_tables,
+    "list": list_from_tables,
+}
+# The output for the result of each scan action, given the scan options and the key
+SCAN_OUTPUTS = {
+    "survey": lambda options, key, result: output_for_counter(key, options.hdx_site, result),
+    "distribution": lambda options, key, result: output_for_distribution(
+        key, options.hdx_site, result
+    ),
+    "delete_key": lambda options, key, result: output_for_counter(key, options.hdx_site, result),
+    "list": lambda options, key, result: output_for_list(options.result_path, result),
+    "diff": lambda options, key, result: output_for_diff(
+        options.result_path, options.diff_path, result
+    ),
+    "storage": lambda options, key, result: output_for_storage(
+        options.result_path, options.hdx_site, result
+    ),
+    "duplicates": lambda options, key, result: output_for_duplicates(
+        options.result_path, options.hdx_site, result
+    ),
+}
+
+
+@dataclasses.dataclass
+class ScanOptions:
+    """The options given to the scan command"""
+
+    hdx_site: str = "stage"
+    output_path: Optional[str] = None
+    input_path: Optional[str] = None
+    result_path: Optional[str] = None
+    diff_path: Optional[str] = None
+    action: tuple[str, ...] = ("survey",)
+    start: int = 0
+    rows: Optional[int] = 0
+    key: tuple[str, ...] = ("name",)
+    verbose: bool = False
+    fetch_workers: int = 1
+    refresh: Optional[str] = None
+    fields: Optional[str] = None
+    checkpoint_dir: Optional[str] = None
+    resume: bool = False
+    fetch_timeout: float = 20
+    index: Optional[str] = None
+    columnar: bool = False
+    compact: bool = False
+    workers: int = 1
+    rate: float = 10.0
+    store_dir: Optional[str] = None
+    store_label: Optional[str] = None
+    where: Optional[str] = None
+    numeric: bool = False
+    bin_width: Optional[float] = None
+    bin_range: Optional[tuple[float, float]] = None
+    approximate: bool = False
+    top_k: int = DEFAULT_TOP_K
+    count_error: float = DEFAULT_COUNT_ERROR
+    distinct_error: float = DEFAULT_DISTINCT_ERROR
+    cursor: bool = False
+    resources: bool = False
+
+    def __post_init__(self):
+        # The index is checked once, since scanning builds it if it does not exist
+        self.index_exists = self.index is not None and os.path.exists(self.index)
+
+    @property
+    def actions(self) -> list[tuple[str, str]]:
+        """(action, key) pairs, with a single --key used for every action"""
+        keys = self.key if len(self.key) != 1 else self.key * len(self.action)
+        return list(zip(self.action, keys))
+
+    @property
+    def fetch_all(self) -> bool:
+        """True if no --rows are given, so all datasets are fetched"""
+        return self.rows is None
+
+    @property
+    def writes(self) -> bool:
+        """True if datasets are written to a snapshot, checkpoint, index or store"""
+        return any(
+            x is not None
+            for x in [
+                self.output_path,
+                self.refresh,
+                self.checkpoint_dir,
+                self.index,
+                self.store_dir,
+            ]
+        )
+
+    @property
+    def parallel(self) -> bool:
+        """True if the actions are run in worker processes"""
+        return (
+            self.workers > 1 and self.action[0] in PARALLEL_ACTIONS + ["diff"] and not self.verbose
+        )
+
+    @property
+    def pipelined(self) -> bool:
+        """True if pages fetched are decoded and scanned in the worker processes while further
+        pages download, which is done for a full fetch for parallel actions"""
+        return (
+            self.parallel
+            and self.input_path is None
+            and self.refresh is None
+            and self.fetch_all
+            and self.action[0] in PARALLEL_ACTIONS
+            and not self.writes
+            and not self.cursor
+        )
+
+
 @hdx_toolkit.command(name="scan")
 @click.option(
     "--hdx_site",
@@ -711,17 +924,27 @@ def remove_extras_key(
 )
 @click.option(
     "--action",
-    type=click.Choice(["survey", "delete_key", "distribution", "list"]),
+    type=click.Choice(
+        ["survey", "delete_key", "distribution", "list", "diff", "storage", "duplicates"]
+    ),
     is_flag=False,
-    default="survey",
-    help="an action to take",
+    multiple=True,
+    default=["survey"],
+    help="an action to take, repeat to run several actions in a single pass over the datasets",
+)
+@click.option(
+    "--key",
+    is_flag=False,
+    multiple=True,
+    default=["private"],
+    help="a key or list of keys, repeat to give each --action its own keys in the same order",
 )
-@click.option("--key", is_flag=False, default="private", help="a key or list of keys")
 @click.option(
     "--start", is_flag=False, default=0, help="a starting offset for the rows returned by a query"
 )
 @click.option(
     "--rows",
+    type=int,
     is_flag=False,
     default=None,
     help="the number of rows to return, "
@@ -737,30 +960,273 @@ def remove_extras_key(
     "--output_path",
     is_flag=False,
     default=None,
-    help="A file path to export package_search records for datasets",
+    help=(
+        "A file path to export package_search records for datasets, "
+        "a .ndjson or .jsonl extension writes one dataset per line"
+    ),
 )
 @click.option(
     "--input_path",
     is_flag=False,
     default=None,
-    help="A file path to import package_search records for datasets",
+    help=(
+        "A file path to import package_search records for datasets, "
+        ".ndjson and .jsonl files are read one dataset at a time"
+    ),
 )
 @click.option(
     "--result_path",
     is_flag=False,
     default=None,
-    help="A file path to output results from list action",
+    help="A file path to output results from list, diff, storage and duplicates actions",
+)
+@click.option(
+    "--diff_path",
+    is_flag=False,
+    default=None,
+    help=(
+        "A file path to an earlier snapshot for the diff action, which is compared with the "
+        "datasets fetched or read from input_path"
+    ),
+)
+@click.option(
+    "--fetch_workers",
+    type=int,
+    is_flag=False,
+    default=1,
+    help="the number of concurrent requests to make when fetching all rows from CKAN",
+)
+@click.option(
+    "--refresh",
+    is_flag=False,
+    default=None,
+    help=(
+        "A file path to an existing snapshot to bring up to date by fetching only datasets "
+        "modified since it was made, written to output_path or a new path alongside it"
+    ),
+)
+@click.option(
+    "--fields",
+    is_flag=False,
+    default=None,
+    help=(
+        "a comma separated list of Solr fields to request from CKAN via the package_search fl "
+        "parameter, by default these are derived from --key where possible"
+    ),
+)
+@click.option(
+    "--checkpoint_dir",
+    is_flag=False,
+    default=None,
+    help=(
+        "A directory in which to save each page fetched from CKAN when fetching all rows, "
+        "so that an interrupted fetch can be resumed"
+    ),
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="if true fetch only the pages missing from --checkpoint_dir",
+)
+@click.option(
+    "--fetch_timeout",
+    type=float,
+    is_flag=False,
+    default=20,
+    help=(
+        "the timeout in seconds for each request to CKAN, requests which time out are retried "
+        "with fewer rows"
+    ),
+)
+@click.option(
+    "--index",
+    is_flag=False,
+    default=None,
+    help=(
+        "A file path to an SQLite snapshot index, if it does not exist it is built from the "
+        "datasets fetched or read from input_path, if it exists actions are run against it"
+    ),
+)
+@click.option(
+    "--columnar",
+    is_flag=True,
+    default=False,
+    help=(
+        "if true load the snapshot at input_path into in-memory columnar tables of datasets and "
+        "resources, and answer survey, distribution and list actions from them where possible"
+    ),
+)
+@click.option(
+    "--compact",
+    is_flag=True,
+    default=False,
+    help=(
+        "if true, with --columnar, load the snapshot into memory once as a compact snapshot and "
+        "run actions the tables cannot answer over it, rather than reading the snapshot again"
+    ),
+)
+@click.option(
+    "--workers",
+    type=int,
+    is_flag=False,
+    default=1,
+    help=(
+        "the number of processes to use for survey, distribution and list actions, "
+        "datasets are processed in shards and the results merged. For delete_key the number of "
+        "concurrent updates"
+    ),
+)
+@click.option(
+    "--rate",
+    type=float,
+    is_flag=False,
+    default=10.0,
+    help="the maximum number of updates per second for delete_key, 0 for no limit",
+)
+@click.option(
+    "--store_dir",
+    is_flag=False,
+    default=None,
+    help=(
+        "A snapshot store directory in which to save the datasets fetched or read, only datasets "
+        "not already in the store are written. The manifest written can be used as an input_path"
+    ),
+)
+@click.option(
+    "--store_label",
+    is_flag=False,
+    default=None,
+    help="a name for the manifest written to --store_dir, today's date by default",
+)
+@click.option(
+    "--where",
+    is_flag=False,
+    default=None,
+    help=(
+        "an expression selecting the datasets to act on, such as "
+        '\'organization.name == "wfp" and resources.format in ["CSV"]\''
+    ),
+)
+@click.option(
+    "--numeric",
+    is_flag=True,
+    default=False,
+    help=(
+        "if true distribution actions report a histogram, summary statistics and estimated "
+        "p50, p90 and p99 of numeric values rather than counting each value"
+    ),
+)
+@click.option(
+    "--bin_width",
+    type=float,
+    is_flag=False,
+    default=None,
+    help=(
+        "the width of histogram bins for --numeric, requires --bin_range, by default bins are "
+        "powers of 10"
+    ),
+)
+@click.option(
+    "--bin_range",
+    type=float,
+    nargs=2,
+    is_flag=False,
+    default=None,
+    help=(
+        "the lower and upper limits of the --bin_width bins, values outside them are counted in "
+        "two overflow bins"
+    ),
+)
+@click.option(
+    "--approximate",
+    is_flag=True,
+    default=False,
+    help=(
+        "if true distribution actions report estimated counts of the most common values and an "
+        "estimated number of distinct values, using a fixed amount of memory"
+    ),
+)
+@click.option(
+    "--top_k",
+    type=int,
+    is_flag=False,
+    default=DEFAULT_TOP_K,
+    help="the number of most common values to report for --approximate",
+)
+@click.option(
+    "--count_error",
+    type=float,
+    is_flag=False,
+    default=DEFAULT_COUNT_ERROR,
+    help=(
+        "for --approximate, the maximum overestimate of a count as a fraction of the number of "
+        "values, memory use is proportional to 1 / count_error"
+    ),
+)
+@click.option(
+    "--distinct_error",
+    type=float,
+    is_flag=False,
+    default=DEFAULT_DISTINCT_ERROR,
+    help=(
+        "for --approximate, the standard error of the number of distinct values as a fraction, "
+        "memory use is proportional to 1 / distinct_error ** 2"
+    ),
+)
+@click.option(
+    "--cursor",
+    is_flag=True,
+    default=False,
+    help=(
+        "if true fetch all rows from CKAN sorted by id, requesting each page with a filter for ids "
+        "after the last one seen rather than an offset. Pages are fetched one at a time"
+    ),
+)
+@click.option(
+    "--resources",
+    is_flag=True,
+    default=False,
+    help=(
+        "if true survey, distribution and list actions are run over resources rather than "
+        "datasets, keys such as format refer to resources, with dataset.* and organization.* "
+        "for the parent dataset"
+    ),
 )
 def scan(
     hdx_site: str = "stage",
     output_path: Optional[str] = None,
     input_path: Optional[str] = None,
     result_path: Optional[str] = None,
-    action: str = "survey",
+    diff_path: Optional[str] = None,
+    action: tuple[str, ...] = ("survey",),
     start: int = 0,
     rows: Optional[int] = 0,
-    key: str = "name",
+    key: tuple[str, ...] = ("name",),
     verbose: bool = False,
+    fetch_workers: int = 1,
+    refresh: Optional[str] = None,
+    fields: Optional[str] = None,
+    checkpoint_dir: Optional[str] = None,
+    resume: bool = False,
+    fetch_timeout: float = 20,
+    index: Optional[str] = None,
+    columnar: bool = False,
+    compact: bool = False,
+    workers: int = 1,
+    rate: float = 10.0,
+    store_dir: Optional[str] = None,
+    store_label: Optional[str] = None,
+    where: Optional[str] = None,
+    numeric: bool = False,
+    bin_width: Optional[float] = None,
+    bin_range: Optional[tuple[float, float]] = None,
+    approximate: bool = False,
+    top_k: int = DEFAULT_TOP_K,
+    count_error: float = DEFAULT_COUNT_ERROR,
+    distinct_error: float = DEFAULT_DISTINCT_ERROR,
+    cursor: bool = False,
+    resources: bool = False,
 ):
     """Scan all of HDX and perform an action, currently supported actions are:
 
@@ -773,77 +1239,610 @@ def scan(
 
     4. list - replicates the list command, providing a table of datasets with values
     of selected keys
+
+    5. diff - compare datasets with an earlier snapshot given by --diff_path, listing datasets and
+    resources added, removed or modified and the keys changed
+
+    6. storage - total the size of resources by organization, format and url_type, with counts of
+    resources over size thresholds, --key is ignored
+
+    7. duplicates - find clusters of resources in different datasets which are likely to be copies
+    of the same file, from their URL, hash, size, file name and file structure check, --key is
+    ignored
+
+    Survey, distribution, list, storage and duplicates actions can be combined by repeating
+    --action, they are then run in a single pass over the datasets.
+
+    Actions other than diff can be restricted to datasets matching a --where expression.
+
+    With --resources, survey, distribution and list actions are run over one record per resource.
+
+    Distribution actions summarise numeric values with a histogram and quantile estimates if
+    --numeric is set, or report estimates of the most common values and the number of distinct
+    values if --approximate is set.
     """
+    options = ScanOptions(
+        hdx_site=hdx_site,
+        output_path=output_path,
+        input_path=input_path,
+        result_path=result_path,
+        diff_path=diff_path,
+        action=action,
+        start=start,
+        rows=rows,
+        key=key,
+        verbose=verbose,
+        fetch_workers=fetch_workers,
+        refresh=refresh,
+        fields=fields,
+        checkpoint_dir=checkpoint_dir,
+        resume=resume,
+        fetch_timeout=fetch_timeout,
+        index=index,
+        columnar=columnar,
+        compact=compact,
+        workers=workers,
+        rate=rate,
+        store_dir=store_dir,
+        store_label=store_label,
+        where=where,
+        numeric=numeric,
+        bin_width=bin_width,
+        bin_range=bin_range,
+        approximate=approximate,
+        top_k=top_k,
+        count_error=count_error,
+        distinct_error=distinct_error,
+        cursor=cursor,
+        resources=resources,
+    )
     print_banner("Scan HDX")
+    if not check_scan_options(options):
+        return
+    make_distribution = get_make_distribution(options)
+    if make_distribution is None:
+        return
     t0 = time.time()
-    fetch_all = False
-    if rows is None:
-        start = 0
-        rows = 1000
-        fetch_all = True
-    if fetch_all and input_path is None:
+    policy = FetchPolicy(timeout=options.fetch_timeout, verbose=options.verbose)
+    datasets, projection = get_scan_datasets(options, policy)
+    if datasets is None:
+        return
+    results, datasets = answer_from_index_or_tables(options, datasets, make_distribution)
+    results = run_scan_actions(options, datasets, results, make_distribution, projection)
+
+    output_scan_results(options, results)
+    if len(policy.latencies) != 0:
+        print(f"CKAN requests: {policy.summarise()}", flush=True)
+    print(f"Action '{', '.join(options.action)}' results took {(time.time() - t0):0.2f} seconds")
+
+
+def check_scan_options(options: ScanOptions) -> bool:
+    """Check that the actions, keys and --where expression can be used together, printing why if
+    not, and then the remaining scan options
+
+    Arguments:
+        options {ScanOptions} -- the options given to the scan command
+
+    Returns:
+        bool -- True if the scan can go ahead
+    """
+    if len(options.key) != 1 and len(options.key) != len(options.action):
+        print("Provide either one --key or one --key for each --action, terminating", flush=True)
+        return False
+    for single_action in ["delete_key", "diff"]:
+        if single_action in options.action and len(options.action) != 1:
+            print(
+                f"Scan->{single_action} cannot be combined with other actions, terminating",
+                flush=True,
+            )
+            return False
+    action, key = options.actions[0]
+    if action == "diff" and (options.diff_path is None or not os.path.exists(options.diff_path)):
+        print(
+            f"Scan->diff requires an existing --diff_path, {options.diff_path} not found",
+            flush=True,
+        )
+        return False
+    if action == "delete_key" and key not in ["extras", "resources._csrf_token"]:
+        click.secho(
+            "Scan->delete_key will only act on 'extras' and 'resources._csrf_token' "
+            "terminating with no further action",
+            fg="red",
+            color=True,
+        )
+        return False
+    if options.where is not None and action == "diff":
+        print("Scan->diff does not support --where, terminating", flush=True)
+        return False
+    if options.where is not None:
+        try:
+            list_where_keys(options.where)
+        except ValueError as error:
+            print(f"{error}, terminating", flush=True)
+            return False
+    return check_scan_source_options(options)
+
+
+def check_scan_source_options(options: ScanOptions) -> bool:
+    """Check that the options for the source of datasets and the results made can be used
+    together, printing why if not
+
+    Arguments:
+        options {ScanOptions} -- the options given to the scan command
+
+    Returns:
+        bool -- True if the scan can go ahead
+    """
+    if options.resume and options.checkpoint_dir is None:
+        print("--resume requires a --checkpoint_dir, terminating", flush=True)
+        return False
+    # Datasets which are written to a snapshot, checkpoint, index or store must be complete, so are
+    # not fetched with a field projection, and records fetched with --fields are raw Solr documents
+    read_only = all(x in ["survey", "distribution", "list"] for x in options.action)
+    if options.fields is not None and (options.writes or not read_only):
+        print(
+            "--fields can only be used with survey, distribution and list actions which do not "
+            "write a snapshot, index, store or checkpoint, terminating",
+            flush=True,
+        )
+        return False
+    unsupported_actions = [
+        x for x in options.action if x not in PARALLEL_ACTIONS or x in DATASET_ACTIONS
+    ]
+    if options.resources and len(unsupported_actions) != 0:
+        print(
+            f"Scan->{unsupported_actions[0]} does not support --resources, terminating", flush=True
+        )
+        return False
+    if options.columnar and (options.input_path is None or options.index is not None):
+        print(
+            "--columnar requires an --input_path and cannot be combined with --index, terminating",
+            flush=True,
+        )
+        return False
+    if options.compact and not options.columnar:
+        print("--compact requires --columnar, terminating", flush=True)
+        return False
+    if options.cursor and options.checkpoint_dir is not None:
+        print("--cursor cannot be combined with --checkpoint_dir, terminating", flush=True)
+        return False
+    if options.cursor and options.fetch_workers > 1:
+        print("--cursor fetches pages one at a time, --fetch_workers is ignored", flush=True)
+    if options.numeric and options.approximate:
+        print("--numeric and --approximate cannot be combined, terminating", flush=True)
+        return False
+    return True
+
+
+def get_make_distribution(options: ScanOptions) -> Callable | None:
+    """Choose the type of result made by distribution actions
+
+    Arguments:
+        options {ScanOptions} -- the options given to the scan command
+
+    Returns:
+        Callable | None -- a function making an empty result, or None if the --numeric or
+        --approximate options are not valid
+    """
+    make_distribution = Counter
+    if options.numeric:
+        make_distribution = functools.partial(
+            NumericDistribution, bin_width=options.bin_width, bin_range=options.bin_range
+        )
+    elif options.approximate:
+        make_distribution = functools.partial(
+            ApproximateDistribution,
+            top_k=options.top_k,
+            count_error=options.count_error,
+            distinct_error=options.distinct_error,
+        )
+    # Making a result checks the --numeric and --approximate options
+    try:
+        make_distribution()
+    except ValueError as error:
+        print(f"{error}, terminating", flush=True)
+        return None
+    return make_distribution
+
+
+def get_scan_datasets(
+    options: ScanOptions, policy: FetchPolicy
+) -> tuple[Iterable | None, dict[str, str] | None]:
+    """Get the datasets to scan from an index, a refreshed snapshot, CKAN or a snapshot file,
+    saving them to a snapshot store if --store_dir is given
+
+    Arguments:
+        options {ScanOptions} -- the options given to the scan command
+        policy {FetchPolicy} -- the policy for requests to CKAN
+
+    Returns:
+        tuple[Iterable | None, dict[str, str] | None] -- the datasets, or None if they cannot be
+        read, and the field projection they were fetched with, if any
+    """
+    if (
+        options.fetch_all
+        and options.input_path is None
+        and options.refresh is None
+        and not options.index_exists
+    ):
         print(
             "No rows value provided so fetching all data in 1000 row chunks. "
             "This takes ~10 minutes and generates an 865MB file.",
             flush=True,
         )
-    if input_path is None:
-        hdx_site_url, hdx_api_key, _ = get_hdx_url_and_key(hdx_site=hdx_site)
-        package_search_url = f"{hdx_site_url}/api/action/package_search"
-        query = {"fq": "*:*", "start": start, "rows": rows}
-        response = fetch_data_from_ckan_package_search(
-            package_search_url, query, hdx_api_key=hdx_api_key, fetch_all=fetch_all
+    datasets = []
+    projection = None
+    if options.index_exists:
+        print(f"Using snapshot index: {options.index}", flush=True)
+    elif options.refresh is not None:
+        datasets = refresh_scan_snapshot(options, policy)
+    elif options.input_path is None:
+        datasets, projection = fetch_scan_datasets(options, policy)
+    else:
+        datasets = read_scan_snapshot(options)
+    if datasets is None:
+        return None, None
+
+    if options.store_dir is not None and not options.index_exists:
+        manifest_path = make_manifest_path(options.store_dir, options.store_label)
+        print(f"Saving datasets to snapshot store with manifest: {manifest_path}", flush=True)
+        datasets = stream_to_store(datasets, manifest_path)
+    return datasets, projection
+
+
+def refresh_scan_snapshot(options: ScanOptions, policy: FetchPolicy) -> Iterable | None:
+    if not os.path.exists(options.refresh):
+        print(f"Snapshot file at {options.refresh} does not exist, terminating")
+        return None
+    hdx_site_url, hdx_api_key, _ = get_hdx_url_and_key(hdx_site=options.hdx_site)
+    package_search_url = f"{hdx_site_url}/api/action/package_search"
+    datasets = refresh_datasets_from_ckan_package_search(
+        options.refresh,
+        package_search_url,
+        hdx_api_key=hdx_api_key,
+        workers=options.fetch_workers,
+        policy=policy,
+        cursor=options.cursor,
+    )
+    output_path = make_path_unique(
+        options.output_path if options.output_path is not None else options.refresh
+    )
+    print(f"Writing refreshed snapshot to file: {output_path}", flush=True)
+    return stream_to_snapshot(datasets, output_path)
+
+
+def fetch_scan_datasets(
+    options: ScanOptions, policy: FetchPolicy
+) -> tuple[Iterable, dict[str, str] | None]:
+    hdx_site_url, hdx_api_key, _ = get_hdx_url_and_key(hdx_site=options.hdx_site)
+    package_search_url = f"{hdx_site_url}/api/action/package_search"
+    query = {"fq": "*:*", "start": options.start, "rows": options.rows}
+    if options.fetch_all:
+        query.update({"start": 0, "rows": 1000})
+    projection = None
+    if options.fields is not None:
+        query["fl"] = list(dict.fromkeys(REQUIRED_FIELDS + options.fields.split(",")))
+    elif options.action[0] in PARALLEL_ACTIONS and not options.writes:
+        projection = make_scan_projection(options)
+        if projection is not None:
+            query["fl"] = sorted(set(projection.values()))
+    if "fl" in query:
+        print(f"Requesting only fields {', '.join(query['fl'])} from CKAN", flush=True)
+    if options.checkpoint_dir is not None and options.fetch_all:
+        datasets = fetch_datasets_with_checkpoints(
+            package_search_url,
+            query,
+            hdx_api_key=hdx_api_key,
+            checkpoint_directory=options.checkpoint_dir,
+            resume=options.resume,
+            workers=options.fetch_workers,
+            policy=policy,
+        )
+    elif options.pipelined:
+        datasets = fetch_page_bodies_from_ckan_package_search(
+            package_search_url,
+            query,
+            hdx_api_key=hdx_api_key,
+            workers=options.fetch_workers,
+            policy=policy,
         )
-        print(f"Querying CKAN took {(time.time() - t0)/60:0.2f} minutes")
-        if output_path is not None:
-            output_path = make_path_unique(output_path)
-            print(f"Writing results to file: {output_path}", flush=True)
-            with open(output_path, "w", encoding="utf-8") as json_file_handle:
-                json.dump(response, json_file_handle)
     else:
-        if os.path.exists(input_path):
-            with open(input_path, encoding="utf-8") as json_file_handle:
-                response = json.load(json_file_handle)
-            print(f"Loading CKAN snapshot from file took {(time.time() - t0):0.2f} seconds")
-        else:
-            print(f"Input file at {input_path} does not exist, terminating")
-            return
+        datasets = fetch_datasets_from_ckan_package_search(
+            package_search_url,
+            query,
+            hdx_api_key=hdx_api_key,
+            fetch_all=options.fetch_all,
+            workers=options.fetch_workers,
+            policy=policy,
+            cursor=options.cursor,
+        )
+    if projection is not None and not options.pipelined:
+        datasets = (reshape_projected_dataset(x, projection) for x in datasets)
+    if options.output_path is not None:
+        output_path = make_path_unique(options.output_path)
+        print(f"Writing results to file: {output_path}", flush=True)
+        datasets = stream_to_snapshot(datasets, output_path)
+    return datasets, projection
+
+
+def make_scan_projection(options: ScanOptions) -> dict[str, str] | None:
+    projection_keys = [x for _, key_ in options.actions for x in key_.split(",")]
+    if options.where is not None:
+        projection_keys.extend(list_where_keys(options.where))
+    if "storage" in options.action:
+        projection_keys.extend(STORAGE_KEYS)
+    if "duplicates" in options.action:
+        projection_keys.extend(DUPLICATE_KEYS)
+    if options.resources:
+        projection_keys = [resource_key_to_dataset_key(x) for x in projection_keys]
+    # Resource names give the number of resources, so that the values of other resource fields
+    # can be matched to them
+    if options.resources or any(x.startswith("resources.") for x in projection_keys):
+        projection_keys.append("resources.name")
+    return make_field_projection(["name"] + projection_keys)
+
+
+def read_scan_snapshot(options: ScanOptions) -> Iterable | None:
+    input_path = options.input_path
+    if not os.path.exists(input_path):
+        print(f"Input file at {input_path} does not exist, terminating")
+        return None
+    datasets = read_snapshot(input_path)
+    # Worker processes can decode line-delimited snapshots themselves
+    if (
+        options.parallel
+        and options.index is None
+        and not options.columnar
+        and options.store_dir is None
+        and is_line_delimited_snapshot(input_path)
+    ):
+        datasets = read_snapshot_lines(input_path)
+    elif options.compact:
+        datasets = load_compact_snapshot(input_path)
+        print(f"Loaded {len(datasets)} datasets as a compact snapshot", flush=True)
+    print(f"Reading CKAN snapshot from file: {input_path}", flush=True)
+    return datasets
+
+
+def answer_from_index_or_tables(
+    options: ScanOptions, datasets: Iterable, make_distribution: Callable
+) -> tuple[list, Iterable]:
+    """Answer actions by SQL queries against an index, or from columnar tables, where possible
+
+    Arguments:
+        options {ScanOptions} -- the options given to the scan command
+        datasets {Iterable} -- the datasets to scan
+        make_distribution {Callable} -- makes an empty result for distribution actions
+
+    Returns:
+        tuple[list, Iterable] -- a result for each action, None for those not answered, and the
+        datasets to scan for the remaining actions
+    """
+    if options.index is not None:
+        if not os.path.exists(options.index):
+            n_datasets = build_snapshot_index(datasets, options.index)
+            print(f"Built snapshot index of {n_datasets} datasets at {options.index}", flush=True)
+        results = answer_scan_queries(options, INDEX_QUERIES, options.index, make_distribution)
+        return results, iterate_datasets_from_index(options.index)
+    if options.columnar:
+        tables = build_snapshot_tables(datasets)
+        print(
+            f"Built columnar tables of {tables.datasets.n_rows} datasets "
+            f"and {tables.resources.n_rows} resources",
+            flush=True,
+        )
+        results = answer_scan_queries(options, TABLE_QUERIES, tables, make_distribution)
+        # Actions which cannot be answered from the tables re-read the snapshot, unless it is held
+        # in memory
+        if not options.compact:
+            datasets = read_snapshot(options.input_path)
+        if (
+            not options.compact
+            and options.parallel
+            and is_line_delimited_snapshot(options.input_path)
+        ):
+            datasets = read_snapshot_lines(options.input_path)
+        return results, datasets
+    return [None] * len(options.action), datasets
+
+
+def answer_scan_queries(
+    options: ScanOptions, queries: dict[str, Callable], source: Any, make_distribution: Callable
+) -> list:
+    results = [None] * len(options.action)
+    # Where expressions and resource records cannot be pushed down to an index or tables, verbose
+    # surveys print each dataset, and numeric and approximate distributions are not stored in them
+    if options.where is not None or options.resources:
+        return results
+    for i, (action_, key_) in enumerate(options.actions):
+        if action_ == "survey" and options.verbose:
+            continue
+        if action_ == "distribution" and make_distribution is not Counter:
+            continue
+        if action_ in queries:
+            results[i] = queries[action_](source, key_)
+    return results
+
+
+def run_scan_actions(
+    options: ScanOptions,
+    datasets: Iterable,
+    results: list,
+    make_distribution: Callable,
+    projection: dict[str, str] | None,
+) -> list:
+    """Run the actions not already answered over the datasets
+
+    Arguments:
+        options {ScanOptions} -- the options given to the scan command
+        datasets {Iterable} -- the datasets to scan
+        results {list} -- a result for each action, None for those still to run
+        make_distribution {Callable} -- makes an empty result for distribution actions
+        projection {dict[str, str] | None} -- the field projection datasets were fetched with
+
+    Returns:
+        list -- a result for each action
+    """
+    results = list(results)
+    action, key = options.actions[0]
+    if action == "diff":
+        print(f"Comparing datasets with earlier snapshot: {options.diff_path}", flush=True)
+        results[0] = diff_snapshots(options.diff_path, datasets, workers=options.workers)
+        return results
+    if action == "delete_key":
+        if options.where is not None:
+            is_selected = compile_where(options.where)
+            datasets = (x for x in datasets if is_selected(x))
+        results[0] = scan_delete_key(
+            datasets,
+            key,
+            hdx_site=options.hdx_site,
+            verbose=options.verbose,
+            workers=options.workers,
+            rate=options.rate,
+        )
+        return results
+
+    remaining = [i for i, result in enumerate(results) if result is None]
+    remaining_actions = [options.actions[i] for i in remaining]
+    if len(remaining) == 0:
+        return results
+    if options.parallel:
+        print(f"Running actions in {options.workers} worker processes", flush=True)
+        remaining_results = scan_in_parallel(
+            datasets,
+            remaining_actions,
+            options.workers,
+            shard_size=1 if options.pipelined else DEFAULT_SHARD_SIZE,
+            where=options.where,
+            make_distribution=make_distribution,
+            resources=options.resources,
+            projection=projection if options.pipelined else None,
+        )
+    else:
+        remaining_results = scan_actions(
+            datasets,
+            remaining_actions,
+            verbose=options.verbose,
+            make_distribution=make_distribution,
+            where=options.where,
+            resources=options.resources,
+        )
+    for i, result in zip(remaining, remaining_results):
+        results[i] = result
+    return results
 
-    # print(json.dumps(response, indent=4), flush=True)
-    t0 = time.time()
-    key_occurence_counter = Counter()
-    if action == "survey":
-        key_occurence_counter = scan_survey(response, key, verbose=verbose)
-    elif action == "delete_key":
-        if key not in ["extras", "resources._csrf_token"]:
-            click.secho(
-                "Scan->delete_key will only act on 'extras' and 'resources._csrf_token' "
-                "terminating with no further action",
-                fg="red",
-                color=True,
-            )
-            return
-        else:
-            key_occurence_counter = scan_delete_key(
-                response, key, hdx_site=hdx_site, verbose=verbose
-            )
-    elif action == "distribution":
-        key_occurence_counter = scan_distribution(response, key, verbose=verbose)
-    elif action == "list":
-        filtered_datasets = response["result"]["results"]
-        output_rows = list_from_datasets(filtered_datasets, key, with_extras=False)
-        output_for_list(result_path, output_rows)
-        print(f"Action '{action}' results took {(time.time() - t0):0.2f} seconds")
-        return
 
-    if len(key_occurence_counter) == 0:
+def output_scan_results(options: ScanOptions, results: list):
+    actions = options.actions
+    for (action_, key_), result in zip(actions, results):
+        if len(actions) != 1:
+            print(f"Action '{action_}' for key '{key_}'", flush=True)
+        SCAN_OUTPUTS[action_](options, key_, result)
+
+
+def output_for_counter(key: str, hdx_site: str, counter: Counter):
+    if len(counter) == 0:
         print(f"Found no occurrences of {key} in {hdx_site}", flush=True)
+        return
+    key_width = max(len(str(k)) for k, _ in counter.most_common()) + 1
+    print("key, n_occurrences", flush=True)
+    for k, value in counter.most_common():
+        print(f"{k:<{key_width}}, {value}", flush=True)
+
+
+def output_for_distribution(key: str, hdx_site: str, distribution: Any):
+    if isinstance(distribution, NumericDistribution):
+        output_for_numeric_distribution(key, hdx_site, distribution)
+    elif isinstance(distribution, ApproximateDistribution):
+        output_for_approximate_distribution(key, hdx_site, distribution)
     else:
-        key_width = max(len(str(k)) for k, _ in key_occurence_counter.most_common()) + 1
-        print("key, n_occurrences", flush=True)
-        for key_, value in key_occurence_counter.most_common():
-            print(f"{key_:<{key_width}}, {value}", flush=True)
-    print(f"Action '{action}' results took {(time.time() - t0):0.2f} seconds")
+        output_for_counter(key, hdx_site, distribution)
+
+
+def output_for_diff(output_path: str | None, diff_path: str, diff_rows: list[dict]):
+    output_for_list(output_path, diff_rows)
+    change_counter = Counter(x["change"] for x in diff_rows)
+    print(f"Changes since {diff_path}: {dict(change_counter)}", flush=True)
+
+
+def output_for_numeric_distribution(key: str, hdx_site: str, distribution: NumericDistribution):
+    if distribution.count == 0:
+        print(
+            f"Found no numeric values of {key} in {hdx_site}, "
+            f"{distribution.non_numeric} other values",
+            flush=True,
+        )
+        return
+    print(f"Summary: {distribution.summarise()}", flush=True)
+    histogram = distribution.get_histogram()
+    bin_width = max(len(x) for x, _ in histogram) + 1
+    print("bin, n_occurrences", flush=True)
+    for label, value in histogram:
+        print(f"{label:<{bin_width}}, {value}", flush=True)
+
+
+def output_for_approximate_distribution(
+    key: str, hdx_site: str, distribution: ApproximateDistribution
+):
+    if distribution.total == 0:
+        print(f"Found no occurrences of {key} in {hdx_site}", flush=True)
+        return
+    print(
+        f"Found {distribution.total} values of {key}, "
+        f"approximately {distribution.estimate_distinct()} distinct",
+        flush=True,
+    )
+    most_common = distribution.most_common()
+    key_width = max(len(str(k)) for k, _, _ in most_common) + 1
+    print("key, n_occurrences, max_overestimate", flush=True)
+    for k, value, error in most_common:
+        print(f"{k:<{key_width}}, {value}, {error}", flush=True)
+
+
+def output_for_storage(output_path: str | None, hdx_site: str, totals: Counter):
+    storage_rows = make_storage_table(totals)
+    if len(storage_rows) == 0:
+        print(f"Found no resources in {hdx_site}", flush=True)
+        return
+    total_row = storage_rows[0]
+    print(
+        f"Found {total_row['n_resources']} resources totalling {total_row['total_bytes']} bytes, "
+        f"{total_row['n_unknown_size']} without a size",
+        flush=True,
+    )
+    output_for_list(output_path, storage_rows)
+
+
+def output_for_duplicates(output_path: str | None, hdx_site: str, duplicate_index: DuplicateIndex):
+    duplicate_rows = make_duplicates_table(duplicate_index)
+    if len(duplicate_rows) == 0:
+        print(
+            f"Found no likely duplicates among {len(duplicate_index.resources)} resources "
+            f"in {hdx_site}",
+            flush=True,
+        )
+        return
+    n_clusters = duplicate_rows[-1]["cluster"]
+    n_datasets = len({x["dataset_name"] for x in duplicate_rows})
+    n_organizations = len({x["organization"] for x in duplicate_rows})
+    print(
+        f"Found {n_clusters} clusters of likely duplicates covering {len(duplicate_rows)} "
+        f"resources in {n_datasets} datasets from {n_organizations} organizations",
+        flush=True,
+    )
+    output_for_list(output_path, duplicate_rows)
+
+
+def get_datasets_from_snapshot(
+    snapshot_path: str, organization: str, dataset_filter: str, query: Optional[str]
+) -> list[dict]:
+    if query is not None:
+        print("--query is not supported with --snapshot_path and is ignored", flush=True)
+    if not os.path.exists(snapshot_path):
+        print(f"Snapshot file at {snapshot_path} does not exist", flush=True)
+        return []
+    return select_from_snapshot(snapshot_path, dataset_filter, organization=organization)
 
 
 def output_for_list(output_path: str | None, output_rows: list[dict]):
@@ -895,12 +1894,22 @@ def output_for_list(output_path: str | None, output_rows: list[dict]):
     default=None,
     help="A file path to export the report in CSV",
 )
+@click.option(
+    "--snapshot_path",
+    is_flag=False,
+    default=None,
+    help=(
+        "A file path to a snapshot written by scan, the dataset metadata is read from it "
+        "rather than HDX using its offset index"
+    ),
+)
 def data_quality_report(
     hdx_site: str = "stage",
     dataset_name: str | None = None,
     lucky_dip: bool = False,
     output_format: str = "full",
     output_path: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
 ):
     """Compile a data quality report"""
     print_banner("data_quality_report")
@@ -909,7 +1918,20 @@ def data_quality_report(
         print("Lucky_dip not specified, and no dataset_name provided - returning", flush=True)
         return
 
-    report = compile_data_quality_report(dataset_name, hdx_site, lucky_dip)
+    metadata_dict = None
+    if snapshot_path is not None:
+        if lucky_dip:
+            dataset_name = random.choice(list_snapshot_names(snapshot_path))
+            lucky_dip = False
+        datasets = select_from_snapshot(snapshot_path, dataset_filter=dataset_name)
+        if len(datasets) == 0:
+            print(f"Dataset '{dataset_name}' not found in {snapshot_path}", flush=True)
+            return
+        metadata_dict = {"result": datasets[0]}
+
+    report = compile_data_quality_report(
+        dataset_name, hdx_site, lucky_dip, metadata_dict=metadata_dict
+    )
 
     if not report["relevance"]["in_hdx"]:
         return
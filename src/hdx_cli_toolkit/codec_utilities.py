@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+A JSON codec for the large JSON paths in the toolkit - snapshots and package_search responses.
+orjson is used if it is installed (pip install hdx_cli_toolkit[fast]), otherwise the standard
+library json module. Values which orjson cannot handle, such as integers wider than 64 bits or NaN,
+fall back to the standard library.
+
+Encoded output differs between the two in whitespace and in the escaping of non-ASCII characters,
+so anything that must be byte-for-byte reproducible, such as content hashes, should use the
+standard library directly, as does JSON printed for display so that it is the same whichever
+library is installed.
+"""
+
+import json
+
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_codec_name() -> str:
+    """Report which JSON library is in use
+
+    Returns:
+        str -- "orjson" or "json"
+    """
+    return "json" if orjson is None else "orjson"
+
+
+def loads(data: str | bytes) -> Any:
+    """Decode JSON from a string or UTF-8 encoded bytes
+
+    Arguments:
+        data {str | bytes} -- JSON text
+
+    Returns:
+        Any -- the decoded value
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a value as compact JSON on a single line
+
+    Arguments:
+        value {Any} -- a JSON serialisable value
+
+    Returns:
+        bytes -- UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(value).encode("utf-8")
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for finding the differences between two snapshots of the package_search records for
+datasets in HDX, as generated by the scan command.
+
+Each dataset is reduced to a canonical content hash and the hashes of the two snapshots are joined
+by dataset id, so that added, removed and unchanged datasets are found without comparing their
+contents. Only datasets whose hashes differ are compared, their resources are matched by id and
+compared by content hash, and changed records are compared key by key to find the key paths which
+have changed.
+"""
+
+import itertools
+
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+from hdx_cli_toolkit.ckan_utilities import DEFAULT_SHARD_SIZE
+from hdx_cli_toolkit.codec_utilities import loads
+from hdx_cli_toolkit.snapshot_utilities import (
+    hash_record,
+    read_snapshot,
+    read_snapshot_lines,
+    is_line_delimited_snapshot,
+)
+
+
+def diff_snapshots(
+    old_snapshot_path: str, new_datasets: Iterable[dict | str], workers: int = 1
+) -> list[dict]:
+    """Find the datasets and resources added, removed and modified between an earlier snapshot and a
+    later set of datasets. The earlier snapshot is read twice, once to hash it and once to decode
+    the records of modified datasets, the later datasets are read once. With more than one worker,
+    datasets are decoded and hashed in a pool of worker processes.
+
+    Arguments:
+        old_snapshot_path {str} -- a path to the earlier snapshot file
+        new_datasets {Iterable[dict | str]} -- the later datasets, or JSON encoded datasets
+
+    Keyword Arguments:
+        workers {int} -- the number of worker processes used for hashing (default: {1})
+
+    Returns:
+        list[dict] -- one row for each change, with the change, dataset_name, resource_name and a
+        comma separated list of changed_keys
+    """
+    old_hashes = {}
+    for position, (dataset_id, dataset_name, content_hash, _) in enumerate(
+        _hash_datasets(_read_snapshot_for_diff(old_snapshot_path), workers)
+    ):
+        old_hashes[dataset_id] = (dataset_name, content_hash, position)
+
+    new_ids = set()
+    modified_datasets = {}
+    changes = []
+    for dataset_id, dataset_name, content_hash, dataset in _hash_datasets(new_datasets, workers):
+        new_ids.add(dataset_id)
+        if dataset_id not in old_hashes:
+            changes.append((dataset_id, _make_change_row("added", dataset_name)))
+        elif old_hashes[dataset_id][1] != content_hash:
+            modified_datasets[dataset_id] = loads(dataset) if isinstance(dataset, str) else dataset
+            changes.append((dataset_id, None))
+
+    # Only the records of modified datasets are decoded and held for comparison
+    old_datasets = {}
+    if len(modified_datasets) != 0:
+        modified_positions = {old_hashes[x][2] for x in modified_datasets}
+        for position, dataset in enumerate(_read_snapshot_for_diff(old_snapshot_path)):
+            if position in modified_positions:
+                dataset = loads(dataset) if isinstance(dataset, str) else dataset
+                old_datasets[dataset["id"]] = dataset
+
+    output_rows = []
+    for dataset_id, row in changes:
+        if row is not None:
+            output_rows.append(row)
+        else:
+            output_rows.extend(
+                compare_datasets(old_datasets[dataset_id], modified_datasets[dataset_id])
+            )
+    for dataset_id, (dataset_name, _, _) in old_hashes.items():
+        if dataset_id not in new_ids:
+            output_rows.append(_make_change_row("removed", dataset_name))
+
+    return output_rows
+
+
+def compare_datasets(old_dataset: dict, new_dataset: dict) -> list[dict]:
+    """Compare two versions of a dataset, reporting the changed key paths of the dataset and of each
+    resource which has been added, removed or modified. Resources are matched by id and only those
+    whose content hashes differ are compared key by key.
+
+    Arguments:
+        old_dataset {dict} -- the earlier version of the dataset
+        new_dataset {dict} -- the later version of the dataset
+
+    Returns:
+        list[dict] -- one row for each change, as returned by diff_snapshots
+    """
+    output_rows = []
+    old_metadata = {k: v for k, v in old_dataset.items() if k != "resources"}
+    new_metadata = {k: v for k, v in new_dataset.items() if k != "resources"}
+    changed_keys = find_changed_key_paths(old_metadata, new_metadata)
+    if len(changed_keys) != 0:
+        output_rows.append(_make_change_row("modified", new_dataset["name"], "", changed_keys))
+
+    old_resources = {_resource_id(x, i): x for i, x in enumerate(old_dataset.get("resources", []))}
+    for i, resource in enumerate(new_dataset.get("resources", [])):
+        old_resource = old_resources.pop(_resource_id(resource, i), None)
+        if old_resource is None:
+            output_rows.append(
+                _make_change_row("resource added", new_dataset["name"], resource.get("name", ""))
+            )
+            continue
+        if hash_record(old_resource) == hash_record(resource):
+            continue
+        changed_keys = find_changed_key_paths(old_resource, resource, prefix="resources.")
+        if len(changed_keys) != 0:
+            output_rows.append(
+                _make_change_row(
+                    "resource modified", new_dataset["name"], resource.get("name", ""), changed_keys
+                )
+            )
+    for resource in old_resources.values():
+        output_rows.append(
+            _make_change_row("resource removed", new_dataset["name"], resource.get("name", ""))
+        )
+
+    return output_rows
+
+
+def find_changed_key_paths(old_value: Any, new_value: Any, prefix: str = "") -> list[str]:
+    """Find the key paths at which two dictionaries differ, descending into nested dictionaries.
+    Lists are compared as a whole.
+
+    Arguments:
+        old_value {Any} -- the earlier value
+        new_value {Any} -- the later value
+
+    Keyword Arguments:
+        prefix {str} -- a prefix for the key paths returned (default: {""})
+
+    Returns:
+        list[str] -- key paths in the form used by --key, such as organization.title
+    """
+    if old_value == new_value:
+        return []
+    if not isinstance(old_value, dict) or not isinstance(new_value, dict):
+        return [prefix.rstrip(".")]
+
+    changed_keys = []
+    for key in list(old_value.keys()) + [x for x in new_value.keys() if x not in old_value]:
+        if key not in old_value or key not in new_value:
+            changed_keys.append(f"{prefix}{key}")
+        else:
+            changed_keys.extend(
+                find_changed_key_paths(old_value[key], new_value[key], prefix=f"{prefix}{key}.")
+            )
+    return changed_keys
+
+
+def _read_snapshot_for_diff(snapshot_path: str) -> Iterator[dict | str]:
+    # Line-delimited snapshots are not decoded here so that only the lines needed are decoded
+    if is_line_delimited_snapshot(snapshot_path):
+        return read_snapshot_lines(snapshot_path)
+    return read_snapshot(snapshot_path)
+
+
+def _hash_datasets(
+    datasets: Iterable[dict | str], workers: int
+) -> Iterator[tuple[str, str, str, dict | str]]:
+    # Yields the id, name, content hash and the dataset as supplied, in the order supplied
+    if workers <= 1:
+        for dataset in datasets:
+            yield *_hash_shard([dataset])[0], dataset
+        return
+
+    datasets_iterator = iter(datasets)
+    shards = iter(lambda: list(itertools.islice(datasets_iterator, DEFAULT_SHARD_SIZE)), [])
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard in itertools.islice(shards, 2 * workers):
+            pending.append((shard, executor.submit(_hash_shard, shard)))
+        while pending:
+            shard, future = pending.popleft()
+            shard_hashes = future.result()
+            next_shard = next(shards, None)
+            if next_shard is not None:
+                pending.append((next_shard, executor.submit(_hash_shard, next_shard)))
+            for dataset_hash, dataset in zip(shard_hashes, shard):
+                yield *dataset_hash, dataset
+
+
+def _hash_shard(shard: list[dict | str]) -> list[tuple[str, str, str]]:
+    hashes = []
+    for dataset in shard:
+        if isinstance(dataset, str):
+            dataset = loads(dataset)
+        hashes.append((dataset["id"], dataset["name"], hash_record(dataset)))
+    return hashes
+
+
+def _resource_id(resource: dict, position: int) -> str:
+    return resource.get("id", f"position {position}")
+
+
+def _make_change_row(
+    change: str, dataset_name: str, resource_name: str = "", changed_keys: list[str] | None = None
+) -> dict:
+    return {
+        "change": change,
+        "dataset_name": dataset_name,
+        "resource_name": resource_name,
+        "changed_keys": ",".join(changed_keys) if changed_keys is not None else "",
+    }
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for the scan duplicates action, which finds clusters of resources in different datasets
+that are likely to be copies of the same file.
+
+Each resource is reduced to a set of identity signals:
+
+1. url - the resource URL, which links resources pointing at the same external source
+2. hash - the resource hash, where CKAN has one
+3. size_and_header - the size with the header hashes, rows and columns of each sheet reported by
+the file structure check in fs_check_info
+4. size_and_file_name - the size with the file name at the end of the URL, which for uploads is the
+name of the file uploaded
+
+Size alone is not used, since unrelated files often have the same size. Each signal is hashed into
+an index of signal digests to resources, and resources sharing any signal are joined into a cluster
+with a union-find, so the work is linear in the number of resources with no pairwise comparison.
+
+The index is merged with update, so that shards of datasets scanned in separate processes give the
+same clusters as a single pass. Digests are used rather than the built-in hash, which differs from
+one process to another.
+"""
+
+import dataclasses
+import hashlib
+
+from typing import Any
+
+from hdx_cli_toolkit.codec_utilities import loads
+from hdx_cli_toolkit.storage_utilities import parse_size
+
+DUPLICATE_SIGNALS = ["url", "hash", "size_and_header", "size_and_file_name"]
+DUPLICATE_KEYS = [
+    "organization.name",
+    "resources.name",
+    "resources.format",
+    "resources.url",
+    "resources.size",
+    "resources.hash",
+    "resources.fs_check_info",
+]
+DIGEST_SIZE = 16
+
+
+@dataclasses.dataclass
+class DuplicateIndex:
+    """An index from identity signal digests to the resources which have them"""
+
+    resources: list[tuple] = dataclasses.field(default_factory=list)
+    signals: dict[bytes, list[int]] = dataclasses.field(default_factory=dict)
+
+    def add_dataset(self, dataset: dict):
+        """Add the resources of a dataset to the index
+
+        Arguments:
+            dataset {dict} -- a package_search dataset dictionary
+        """
+        organization = dataset.get("organization")
+        organization_name = organization.get("name", "") if isinstance(organization, dict) else ""
+        resources = dataset.get("resources")
+        if not isinstance(resources, list):
+            return
+        for resource in resources:
+            if not isinstance(resource, dict):
+                continue
+            signals = get_resource_signals(resource)
+            if len(signals) == 0:
+                continue
+            position = len(self.resources)
+            self.resources.append(
+                (
+                    dataset.get("name", ""),
+                    organization_name,
+                    resource.get("id", ""),
+                    resource.get("name", ""),
+                    resource.get("format", ""),
+                    parse_size(resource.get("size")),
+                    resource.get("url", ""),
+                )
+            )
+            for signal in signals:
+                self.signals.setdefault(_digest_signal(signal), []).append(position)
+
+    def update(self, other: "DuplicateIndex"):
+        """Merge the index for a later shard of datasets into this one
+
+        Arguments:
+            other {DuplicateIndex} -- an index for datasets which follow those in this one
+        """
+        offset = len(self.resources)
+        self.resources.extend(other.resources)
+        for digest, positions in other.signals.items():
+            self.signals.setdefault(digest, []).extend(x + offset for x in positions)
+
+    def find_clusters(self) -> list[tuple[list[int], list[str]]]:
+        """Group resources which share any signal into clusters, keeping clusters which span more
+        than one dataset
+
+        Returns:
+            list[tuple[list[int], list[str]]] -- the positions of the resources in each cluster
+            with the names of the signals they share, largest clusters first and then in order of
+            their first resource
+        """
+        parents = list(range(len(self.resources)))
+        shared_signals = [(x, y) for x, y in self.signals.items() if len(y) > 1]
+        for _, positions in shared_signals:
+            root = _find_root(parents, positions[0])
+            for position in positions[1:]:
+                other_root = _find_root(parents, position)
+                if other_root != root:
+                    root, other_root = min(root, other_root), max(root, other_root)
+                    parents[other_root] = root
+
+        clusters = {}
+        signal_names = {}
+        for digest, positions in shared_signals:
+            root = _find_root(parents, positions[0])
+            signal_names.setdefault(root, set()).add(DUPLICATE_SIGNALS[digest[0]])
+            for position in positions:
+                clusters.setdefault(root, set()).add(position)
+
+        output = []
+        for root, positions in clusters.items():
+            if len({self.resources[x][0] for x in positions}) > 1:
+                names = [x for x in DUPLICATE_SIGNALS if x in signal_names[root]]
+                output.append((sorted(positions), names))
+        output.sort(key=lambda x: (-len(x[0]), x[0][0]))
+        return output
+
+
+def get_resource_signals(resource: dict) -> list[tuple]:
+    """Derive the identity signals for a resource
+
+    Arguments:
+        resource {dict} -- a resource dictionary
+
+    Returns:
+        list[tuple] -- (signal name, value, ...) tuples for each signal the resource has
+    """
+    signals = []
+    url = str(resource.get("url") or "").strip()
+    size = parse_size(resource.get("size"))
+    if url != "":
+        signals.append(("url", url))
+    if resource.get("hash"):
+        signals.append(("hash", str(resource["hash"])))
+    if size is not None and size != 0:
+        header_signature = _get_header_signature(resource.get("fs_check_info"))
+        if header_signature is not None:
+            signals.append(("size_and_header", size, header_signature))
+        file_name = _get_file_name(url)
+        if file_name != "":
+            signals.append(("size_and_file_name", size, file_name))
+    return signals
+
+
+def make_duplicates_table(duplicate_index: DuplicateIndex) -> list[dict]:
+    """List the resources in each cluster of likely duplicates
+
+    Arguments:
+        duplicate_index {DuplicateIndex} -- an index built by the duplicates action
+
+    Returns:
+        list[dict] -- a row for each resource in a cluster, clusters numbered from 1
+    """
+    rows = []
+    for cluster_number, (cluster, signal_names) in enumerate(
+        duplicate_index.find_clusters(), start=1
+    ):
+        for position in cluster:
+            (
+                dataset_name,
+                organization,
+                resource_id,
+                name,
+                format_,
+                size,
+                url,
+            ) = duplicate_index.resources[position]
+            rows.append(
+                {
+                    "cluster": cluster_number,
+                    "n_resources": len(cluster),
+                    "signals": ",".join(signal_names),
+                    "dataset_name": dataset_name,
+                    "organization": organization,
+                    "resource_name": name,
+                    "resource_id": resource_id,
+                    "format": format_,
+                    "size": "" if size is None else size,
+                    "url": url,
+                }
+            )
+    return rows
+
+
+def _get_header_signature(fs_check_info: Any) -> tuple | None:
+    if isinstance(fs_check_info, str):
+        try:
+            fs_check_info = loads(fs_check_info)
+        except ValueError:
+            return None
+    if not isinstance(fs_check_info, list):
+        return None
+    for event in reversed(fs_check_info):
+        if not isinstance(event, dict) or not isinstance(event.get("hxl_proxy_response"), dict):
+            continue
+        sheets = event["hxl_proxy_response"].get("sheets")
+        if not isinstance(sheets, list):
+            continue
+        signature = tuple(
+            (x.get("header_hash"), x.get("nrows"), x.get("ncols"))
+            for x in sheets
+            if isinstance(x, dict) and x.get("header_hash")
+        )
+        return signature if len(signature) != 0 else None
+    return None
+
+
+def _get_file_name(url: str) -> str:
+    path = url.split("?", 1)[0].split("#", 1)[0]
+    if "://" in path:
+        path = path.split("://", 1)[1].partition("/")[2]
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _digest_signal(signal: tuple) -> bytes:
+    # The repr of a tuple of strings, numbers and None is the same in every process, the first
+    # byte of the digest identifies the signal so that its name can be reported
+    encoded_signal = repr(signal).encode("utf-8")
+    digest = hashlib.blake2b(encoded_signal, digest_size=DIGEST_SIZE).digest()
+    return bytes([DUPLICATE_SIGNALS.index(signal[0])]) + digest
+
+
+def _find_root(parents: list[int], position: int) -> int:
+    root = position
+    while parents[root] != root:
+        root = parents[root]
+    while parents[position] != root:
+        parents[position], position = root, parents[position]
+    return root
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for filtering package_search records with a where expression, as supplied to scan --where,
+for example:
+
+organization.name == "wfp" and resources.format in ["CSV", "XLSX"]
+
+Expressions use Python syntax restricted to key paths, literal strings, numbers, True, False, None
+and lists, the comparisons ==, !=, <, <=, >, >=, in and not in, and the operators and, or and not.
+A key path on its own is true if its value is truthy.
+
+Key paths descend through lists, so resources.format stands for the formats of all of a dataset's
+resources. A comparison is true if any value of a key path satisfies it, and != and not in are true
+if no value satisfies == or in respectively. A comparison with a key path which is absent is false,
+as is a comparison between values which cannot be ordered.
+
+The right hand side of in is either a literal list or string, or a key path whose values form the
+collection, so "hxl" in tags.name tests whether any tag is named hxl.
+
+Expressions are parsed with the ast module and compiled once into nested functions, no Python code
+is evaluated.
+"""
+
+import ast
+import operator
+
+from collections.abc import Callable
+from typing import Any
+
+COMPARISON_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+def compile_where(expression: str) -> Callable[[dict], bool]:
+    """Compile a where expression into a function which tests a dataset
+
+    Arguments:
+        expression {str} -- a where expression
+
+    Raises:
+        ValueError: if the expression cannot be parsed or uses unsupported syntax
+
+    Returns:
+        Callable[[dict], bool] -- a function returning True for datasets which match the expression
+    """
+    return _compile_condition(_parse_where(expression))
+
+
+def list_where_keys(expression: str) -> list[str]:
+    """List the key paths used in a where expression, so that they can be requested from CKAN
+
+    Arguments:
+        expression {str} -- a where expression
+
+    Raises:
+        ValueError: if the expression cannot be parsed or uses unsupported syntax
+
+    Returns:
+        list[str] -- dotted key paths in the order they first appear
+    """
+    compile_where(expression)
+    keys = []
+    _collect_keys(_parse_where(expression), keys)
+    return keys
+
+
+def _parse_where(expression: str) -> ast.expr:
+    try:
+        return ast.parse(expression.strip(), mode="eval").body
+    except SyntaxError as error:
+        raise ValueError(f"Could not parse where expression '{expression}': {error.msg}") from error
+
+
+def _collect_keys(node: ast.AST, keys: list[str]):
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        key_ = ".".join(_get_path_parts(node))
+        if key_ not in keys:
+            keys.append(key_)
+        return
+    for child in ast.iter_child_nodes(node):
+        _collect_keys(child, keys)
+
+
+def _compile_condition(node: ast.expr) -> Callable[[dict], bool]:
+    if isinstance(node, ast.BoolOp):
+        conditions = [_compile_condition(x) for x in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda dataset: all(x(dataset) for x in conditions)
+        return lambda dataset: any(x(dataset) for x in conditions)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        condition = _compile_condition(node.operand)
+        return lambda dataset: not condition(dataset)
+    if isinstance(node, ast.Compare):
+        operands = [_compile_operand(x) for x in [node.left] + node.comparators]
+        comparisons = [
+            _compile_comparison(op, left, right)
+            for op, left, right in zip(node.ops, operands, operands[1:])
+        ]
+        return lambda dataset: all(x(dataset) for x in comparisons)
+    if isinstance(node, (ast.Name, ast.Attribute, ast.Constant)):
+        get_values, _ = _compile_operand(node)
+        return lambda dataset: any(get_values(dataset))
+    raise ValueError(f"'{ast.unparse(node)}' is not supported in a where expression")
+
+
+def _compile_comparison(
+    op: ast.cmpop,
+    left: tuple[Callable[[dict], list[Any]], bool],
+    right: tuple[Callable[[dict], list[Any]], bool],
+) -> Callable[[dict], bool]:
+    # Operands are a function returning the values to compare and whether the operand is a literal
+    get_left, _ = left
+    get_right, right_is_literal = right
+    if isinstance(op, (ast.In, ast.NotIn)):
+        negate = isinstance(op, ast.NotIn)
+
+        def test_membership(dataset: dict) -> bool:
+            right_values = get_right(dataset)
+            # A literal list or string is the collection, a key path supplies its values
+            collection = right_values[0] if right_is_literal else right_values
+            return negate != any(
+                _safely(operator.contains, collection, x) for x in get_left(dataset)
+            )
+
+        return test_membership
+    if isinstance(op, ast.NotEq):
+        equal = _compile_comparison(ast.Eq(), left, right)
+        return lambda dataset: not equal(dataset)
+    if type(op) not in COMPARISON_OPERATORS:
+        raise ValueError(f"'{type(op).__name__}' is not supported in a where expression")
+
+    compare = COMPARISON_OPERATORS[type(op)]
+    return lambda dataset: any(
+        _safely(compare, x, y) for x in get_left(dataset) for y in get_right(dataset)
+    )
+
+
+def _compile_operand(node: ast.expr) -> tuple[Callable[[dict], list[Any]], bool]:
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        parts = _get_path_parts(node)
+
+        def get_values(dataset: dict) -> list[Any]:
+            values = [dataset]
+            for part in parts:
+                values = [x[part] for x in _flatten(values) if isinstance(x, dict) and part in x]
+            return _flatten(values)
+
+        return get_values, False
+
+    try:
+        literal_value = ast.literal_eval(node)
+    except ValueError as error:
+        raise ValueError(f"'{ast.unparse(node)}' is not supported in a where expression") from error
+    if isinstance(literal_value, (dict, set, bytes, complex)):
+        raise ValueError(f"'{ast.unparse(node)}' is not supported in a where expression")
+
+    def get_literal(_: dict) -> list[Any]:
+        return [literal_value]
+
+    return get_literal, True
+
+
+def _get_path_parts(node: ast.expr) -> list[str]:
+    if isinstance(node, ast.Name):
+        return [node.id]
+    if isinstance(node, ast.Attribute):
+        return _get_path_parts(node.value) + [node.attr]
+    raise ValueError(f"'{ast.unparse(node)}' is not a key path")
+
+
+def _flatten(values: list[Any]) -> list[Any]:
+    if not any(isinstance(x, list) for x in values):
+        return values
+    flattened = []
+    for value in values:
+        if isinstance(value, list):
+            flattened.extend(_flatten(value))
+        else:
+            flattened.append(value)
+    return flattened
+
+
+def _safely(function: Callable[[Any, Any], bool], left: Any, right: Any) -> bool:
+    # Values of different types, such as a string and a number, are treated as not matching
+    try:
+        return function(left, right)
+    except TypeError:
+        return False
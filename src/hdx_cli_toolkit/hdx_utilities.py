@@ -10,6 +10,7 @@ import time
 import traceback
 import urllib3
 
+from collections.abc import Iterable
 from pathlib import Path
 from typing import Optional
 
@@ -34,7 +35,7 @@ from hdx_cli_toolkit.utilities import (
     write_dictionary,
     make_path_unique,
     print_dictionary_comparison,
-    query_dict,
+    compile_query,
 )
 
 
@@ -627,7 +628,7 @@ def get_hdx_url_and_key(hdx_site: str) -> tuple[str, str, str]:
 
 
 def list_from_datasets(
-    filtered_datasets: list[dict] | list[Dataset],
+    filtered_datasets: Iterable[dict] | Iterable[Dataset],
     key: str,
     with_extras: bool = False,
 ) -> list[dict]:
@@ -635,6 +636,7 @@ def list_from_datasets(
     output_template = {"dataset_name": ""}
     for key_ in keys:
         output_template[key_] = ""
+    query = compile_query(keys)
     output = []
     for dataset in filtered_datasets:
         # We always get extras for list, in case we need to access keys from there
@@ -648,7 +650,7 @@ def list_from_datasets(
             dataset_dict = dataset
         output_row = output_template.copy()
         output_row["dataset_name"] = dataset_dict["name"]
-        new_rows = query_dict(keys, dataset_dict, output_row)
+        new_rows = query(dataset_dict, output_row)
         if new_rows:
             output.extend(new_rows)
     return output
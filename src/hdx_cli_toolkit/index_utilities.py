@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for loading a snapshot of package_search records into an SQLite database so that repeated
+scan actions can be answered with indexed SQL queries rather than a full parse of the snapshot.
+
+Datasets are stored without their resources in a datasets table and resources are stored in a
+resources table, both hold the original records as JSON alongside indexed columns. Survey,
+distribution and list actions are pushed down to SQL where the result is guaranteed to be the same
+as that of the Python scan functions, otherwise datasets are reassembled in their original order and
+passed to those functions.
+"""
+
+import os
+import sqlite3
+
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from hdx_cli_toolkit.codec_utilities import dumps, loads
+
+SCHEMA = """
+CREATE TABLE datasets (
+    position INTEGER PRIMARY KEY,
+    id TEXT,
+    name TEXT,
+    owner_org TEXT,
+    metadata_modified TEXT,
+    data TEXT
+);
+CREATE TABLE resources (
+    position INTEGER PRIMARY KEY,
+    dataset_position INTEGER,
+    id TEXT,
+    name TEXT,
+    format TEXT,
+    data TEXT
+);
+CREATE INDEX datasets_name ON datasets (name);
+CREATE INDEX datasets_owner_org ON datasets (owner_org);
+CREATE INDEX datasets_metadata_modified ON datasets (metadata_modified);
+CREATE INDEX resources_format ON resources (format);
+CREATE INDEX resources_dataset_position ON resources (dataset_position);
+"""
+
+
+def build_snapshot_index(datasets: Iterable[dict], index_path: str) -> int:
+    """Load datasets into a new SQLite snapshot index
+
+    Arguments:
+        datasets {Iterable[dict]} -- an iterable of package_search dataset dictionaries
+        index_path {str} -- a path for the SQLite database, which should not already exist
+
+    Returns:
+        int -- the number of datasets loaded
+    """
+    # The index is built in a temporary file and moved into place once complete, so that an
+    # interrupted or failed build never leaves a partial index which a later scan would use
+    temporary_path = f"{index_path}.tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    connection = sqlite3.connect(temporary_path)
+    n_datasets = 0
+    try:
+        connection.executescript(SCHEMA)
+        for position, dataset in enumerate(datasets):
+            # An empty resources list is kept in the dataset record to mark where resources go
+            resources = dataset.get("resources", [])
+            dataset_data = dataset
+            if isinstance(resources, list) and len(resources) != 0:
+                dataset_data = {k: v if k != "resources" else [] for k, v in dataset.items()}
+            else:
+                resources = []
+            connection.execute(
+                "INSERT INTO datasets VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    position,
+                    dataset.get("id"),
+                    dataset.get("name"),
+                    dataset.get("owner_org"),
+                    dataset.get("metadata_modified"),
+                    dumps(dataset_data).decode("utf-8"),
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO resources (dataset_position, id, name, format, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        position,
+                        x.get("id"),
+                        x.get("name"),
+                        x.get("format"),
+                        dumps(x).decode("utf-8"),
+                    )
+                    for x in resources
+                ],
+            )
+            n_datasets += 1
+        connection.commit()
+    except BaseException:
+        connection.close()
+        os.remove(temporary_path)
+        raise
+    connection.close()
+    os.replace(temporary_path, index_path)
+
+    return n_datasets
+
+
+def iterate_datasets_from_index(index_path: str) -> Iterator[dict]:
+    """Reassemble datasets, including their resources, from a snapshot index in their original order
+
+    Arguments:
+        index_path {str} -- a path to a SQLite snapshot index
+
+    Yields:
+        Iterator[dict] -- package_search dataset dictionaries
+    """
+    connection = sqlite3.connect(index_path)
+    try:
+        resource_rows = connection.execute(
+            "SELECT dataset_position, data FROM resources ORDER BY position"
+        )
+        resource_row = resource_rows.fetchone()
+        for position, data in connection.execute(
+            "SELECT position, data FROM datasets ORDER BY position"
+        ):
+            dataset = loads(data)
+            resources = []
+            while resource_row is not None and resource_row[0] == position:
+                resources.append(loads(resource_row[1]))
+                resource_row = resource_rows.fetchone()
+            if len(resources) != 0:
+                dataset["resources"] = resources
+            yield dataset
+    finally:
+        connection.close()
+
+
+def survey_from_index(index_path: str, key: str) -> Counter | None:
+    """Count the occurrences of a key or list of keys using SQL, with the same result as scan_survey
+
+    Arguments:
+        index_path {str} -- a path to a SQLite snapshot index
+        key {str} -- a key or comma separated list of keys
+
+    Returns:
+        Counter | None -- occurrences of each key, or None if the keys cannot be answered in SQL
+    """
+    keys = key.split(",")
+    connection = sqlite3.connect(index_path)
+    try:
+        # Mixing dataset and resource keys makes scan_survey count dataset keys once per resource
+        locations = [_locate_key(connection, x) for x in keys]
+        if None in locations or len({x[0] for x in locations}) != 1:
+            return None
+        first_seen = []
+        for key_, (table, path) in zip(keys, locations):
+            n_occurrences, first_position = connection.execute(
+                f"SELECT COUNT(*), MIN(position) FROM {table} WHERE json_type(data, ?) IS NOT NULL",
+                (path,),
+            ).fetchone()
+            if n_occurrences != 0:
+                first_seen.append((first_position, key_, n_occurrences))
+    finally:
+        connection.close()
+
+    return Counter({key_: n for _, key_, n in sorted(first_seen, key=lambda x: x[0])})
+
+
+def distribution_from_index(index_path: str, key: str) -> Counter | None:
+    """Calculate the distribution of values for a key using SQL, with the same result as
+    scan_distribution
+
+    Arguments:
+        index_path {str} -- a path to a SQLite snapshot index
+        key {str} -- a single key
+
+    Returns:
+        Counter | None -- occurrences of each value, or None if the key cannot be answered in SQL
+    """
+    connection = sqlite3.connect(index_path)
+    try:
+        location = _locate_key(connection, key)
+        if location is None:
+            return None
+        table, path = location
+        rows = connection.execute(
+            f"SELECT json_extract(data, ?1), json_type(data, ?1), COUNT(*), MIN(position) "
+            f"FROM {table} WHERE json_type(data, ?1) IS NOT NULL GROUP BY 1, 2 ORDER BY 4",
+            (path,),
+        ).fetchall()
+    finally:
+        connection.close()
+
+    if any(x[1] in ("object", "array") for x in rows):
+        return None
+    # Accumulate rather than construct the Counter so that values which compare equal in Python,
+    # such as True and 1, are merged as they are by scan_distribution
+    value_occurence_counter = Counter()
+    for value, type_, n, _ in rows:
+        value_occurence_counter[_decode_json_value(value, type_)] += n
+    return value_occurence_counter
+
+
+def list_from_index(index_path: str, key: str) -> list[dict] | None:
+    """Replicate list_from_datasets using SQL for keys which are not nested
+
+    Arguments:
+        index_path {str} -- a path to a SQLite snapshot index
+        key {str} -- a key or comma separated list of keys
+
+    Returns:
+        list[dict] | None -- output rows, or None if the keys cannot be answered in SQL
+    """
+    keys = key.split(",")
+    if any("." in x or x == "resources" for x in keys):
+        return None
+    columns = ", ".join(
+        f"json_extract(data, ?{i + 1}), json_type(data, ?{i + 1})" for i in range(len(keys))
+    )
+    output = []
+    connection = sqlite3.connect(index_path)
+    try:
+        for row in connection.execute(
+            f"SELECT name, {columns} FROM datasets ORDER BY position",
+            [_make_json_path([x]) for x in keys],
+        ):
+            output_row = {"dataset_name": row[0]}
+            for i, key_ in enumerate(keys):
+                value, type_ = row[2 * i + 1], row[2 * i + 2]
+                if type_ is None:
+                    output_row[key_] = f"'{key_}' key absent"
+                else:
+                    output_row[key_] = _decode_json_value(value, type_)
+            output.append(output_row)
+    finally:
+        connection.close()
+
+    return output
+
+
+def _locate_key(connection: sqlite3.Connection, key: str) -> tuple[str, str] | None:
+    # Returns the table and JSON path for a key, if every dataset has the structure compile_query
+    # expects so that SQL gives the same answer
+    parts = key.split(".")
+    if len(parts) == 1:
+        return "datasets", _make_json_path(parts)
+    if len(parts) != 2:
+        return None
+
+    table, path, parent_type = "datasets", _make_json_path(parts), "object"
+    if parts[0] == "resources":
+        table, path, parent_type = "resources", _make_json_path(parts[1:]), "array"
+    n_other_structure = connection.execute(
+        "SELECT COUNT(*) FROM datasets WHERE json_type(data, ?) IS NOT ?",
+        (_make_json_path(parts[0:1]), parent_type),
+    ).fetchone()[0]
+    if n_other_structure != 0:
+        return None
+    return table, path
+
+
+def _make_json_path(parts: list[str]) -> str:
+    return "$." + ".".join(f'"{x}"' for x in parts)
+
+
+def _decode_json_value(value: Any, json_type: str) -> Any:
+    if json_type == "true":
+        return True
+    if json_type == "false":
+        return False
+    if json_type in ("object", "array"):
+        return loads(value)
+    return value
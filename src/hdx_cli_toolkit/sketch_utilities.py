@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Fixed size summaries of the values of a key across datasets, used in place of an exact Counter by
+scan --action distribution for keys where a table of every distinct value is not useful.
+
+Each summary has an add method which takes one value and an update method which merges in another
+summary of the same kind, as Counter.update does, so that summaries built for separate pages or
+worker processes can be combined into the summary of all of the values.
+
+NumericDistribution summarises numeric values such as total_res_downloads, num_resources or
+resources.size with a histogram, either of fixed width bins over a given range, with values outside
+it counted in two overflow bins, or of bins which are powers of 10, and a QuantileSketch.
+QuantileSketch follows DDSketch (Masson, Rim and Lee, 2019), values are counted in logarithmically
+sized buckets so that any quantile is estimated to within a relative accuracy, and the number of
+buckets is capped by merging the buckets of the smallest values.
+
+ApproximateDistribution summarises high cardinality values such as resources.url or maintainer with
+a HeavyHitters summary of the most common values and a DistinctCounter estimate of the number of
+distinct values. HeavyHitters uses the Space-Saving algorithm (Metwally, Agrawal and El Abbadi,
+2005), it keeps a fixed number of counters and the count of any value is overestimated by at most
+the total count divided by the number of counters. DistinctCounter is a HyperLogLog (Flajolet et
+al., 2007) whose number of registers is chosen for a given standard error.
+"""
+
+import dataclasses
+import hashlib
+import math
+
+from collections import Counter
+from typing import Any
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BUCKETS = 2048
+REPORTED_QUANTILES = [0.5, 0.9, 0.99]
+DEFAULT_TOP_K = 25
+DEFAULT_COUNT_ERROR = 0.001
+DEFAULT_DISTINCT_ERROR = 0.01
+MAX_FIXED_BINS = 1000
+
+
+@dataclasses.dataclass
+class QuantileSketch:
+    """A mergeable sketch estimating quantiles to within a relative accuracy, using at most
+    max_buckets buckets however many values are added"""
+
+    relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+    max_buckets: int = DEFAULT_MAX_BUCKETS
+    positive_buckets: Counter = dataclasses.field(default_factory=Counter)
+    negative_buckets: Counter = dataclasses.field(default_factory=Counter)
+    zero_count: int = 0
+    count: int = 0
+
+    def __post_init__(self):
+        if not 0 < self.relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self._gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def add(self, value: float):
+        """Add a value to the sketch
+
+        Arguments:
+            value {float} -- a finite number
+        """
+        if value > 0:
+            self.positive_buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+        elif value < 0:
+            self.negative_buckets[math.ceil(math.log(-value) / self._log_gamma)] += 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+        if len(self.positive_buckets) + len(self.negative_buckets) > self.max_buckets:
+            self._collapse()
+
+    def update(self, other: "QuantileSketch"):
+        """Merge another sketch into this one
+
+        Arguments:
+            other {QuantileSketch} -- a sketch with the same relative_accuracy
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same relative_accuracy can be merged")
+        self.positive_buckets.update(other.positive_buckets)
+        self.negative_buckets.update(other.negative_buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self._collapse()
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate a quantile of the values added
+
+        Arguments:
+            q {float} -- a quantile between 0 and 1
+
+        Returns:
+            float | None -- the estimated value, or None if no values have been added
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        cumulative_count = 0
+        # Negative values run from the largest magnitude to the smallest
+        for index in sorted(self.negative_buckets, reverse=True):
+            cumulative_count += self.negative_buckets[index]
+            if cumulative_count > rank:
+                return -self._bucket_value(index)
+        cumulative_count += self.zero_count
+        if cumulative_count > rank:
+            return 0.0
+        for index in sorted(self.positive_buckets):
+            cumulative_count += self.positive_buckets[index]
+            if cumulative_count > rank:
+                return self._bucket_value(index)
+        return self._bucket_value(max(self.positive_buckets))
+
+    def _bucket_value(self, index: int) -> float:
+        # The value within the bucket with the smallest relative error to any value in it
+        return 2 * self._gamma**index / (self._gamma + 1)
+
+    def _collapse(self):
+        # Merge the buckets of the values closest to zero, keeping the accuracy of the large values
+        for buckets in [self.negative_buckets, self.positive_buckets]:
+            n_excess = len(self.positive_buckets) + len(self.negative_buckets) - self.max_buckets
+            if n_excess <= 0:
+                return
+            indices = sorted(buckets)
+            n_merged = min(n_excess, len(indices) - 1)
+            if n_merged <= 0:
+                continue
+            target = indices[n_merged]
+            for index in indices[0:n_merged]:
+                buckets[target] += buckets.pop(index)
+
+
+@dataclasses.dataclass
+class NumericDistribution:
+    """A histogram, quantile sketch and summary statistics for numeric values. Bins are bin_width
+    wide between the lower and upper limits of bin_range, with an overflow bin on either side, or
+    powers of 10 if bin_width is None. Values which are not numbers, including numbers in strings,
+    are counted as non_numeric"""
+
+    bin_width: float | None = None
+    bin_range: tuple[float, float] | None = None
+    relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+    bins: Counter = dataclasses.field(default_factory=Counter)
+    sketch: QuantileSketch | None = None
+    count: int = 0
+    non_numeric: int = 0
+    total: float = 0
+    minimum: float | None = None
+    maximum: float | None = None
+
+    def __post_init__(self):
+        if (self.bin_width is None) != (self.bin_range is None):
+            raise ValueError("bin_width and bin_range must be given together")
+        if self.bin_width is not None:
+            if self.bin_width <= 0:
+                raise ValueError("bin_width must be greater than 0")
+            lower, upper = self.bin_range
+            if lower >= upper:
+                raise ValueError("the upper limit of bin_range must be greater than the lower")
+            # The number of fixed width bins is bounded, as the number of sketch buckets is
+            if (upper - lower) / self.bin_width > MAX_FIXED_BINS:
+                raise ValueError(f"bin_range must be at most {MAX_FIXED_BINS} bin_width wide")
+        if self.sketch is None:
+            self.sketch = QuantileSketch(relative_accuracy=self.relative_accuracy)
+
+    def add(self, value: Any):
+        """Add a value to the distribution
+
+        Arguments:
+            value {Any} -- a value of the key being summarised
+        """
+        if (
+            isinstance(value, bool)
+            or not isinstance(value, (int, float))
+            or not math.isfinite(value)
+        ):
+            self.non_numeric += 1
+            return
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.bins[self._get_bin(value)] += 1
+        self.sketch.add(value)
+
+    def update(self, other: "NumericDistribution"):
+        """Merge another distribution into this one
+
+        Arguments:
+            other {NumericDistribution} -- a distribution with the same bin_width and bin_range
+        """
+        if other.bin_width != self.bin_width or other.bin_range != self.bin_range:
+            raise ValueError("Only distributions with the same bins can be merged")
+        self.bins.update(other.bins)
+        self.sketch.update(other.sketch)
+        self.count += other.count
+        self.non_numeric += other.non_numeric
+        self.total += other.total
+        for value in [other.minimum, other.maximum]:
+            if value is not None:
+                self.minimum = value if self.minimum is None else min(self.minimum, value)
+                self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate a quantile of the numeric values added
+
+        Arguments:
+            q {float} -- a quantile between 0 and 1
+
+        Returns:
+            float | None -- the estimated value, or None if no numeric values have been added
+        """
+        return self.sketch.quantile(q)
+
+    def summarise(self) -> dict:
+        """Summarise the distribution
+
+        Returns:
+            dict -- count, non_numeric, min, max, mean and the p50, p90 and p99 estimates
+        """
+        summary = {
+            "count": self.count,
+            "non_numeric": self.non_numeric,
+            "min": self.minimum,
+            "max": self.maximum,
+            "mean": round(self.total / self.count, 3) if self.count != 0 else None,
+        }
+        for q in REPORTED_QUANTILES:
+            value = self.quantile(q)
+            summary[f"p{round(q * 100)}"] = round(value, 3) if value is not None else None
+        return summary
+
+    def get_histogram(self) -> list[tuple[str, int]]:
+        """List the histogram bins in order of value
+
+        Returns:
+            list[tuple[str, int]] -- a label for each bin, such as [10, 100), and its count
+        """
+        histogram = []
+        for lower, upper in sorted(self.bins):
+            if lower == upper:
+                label = f"{lower:g}"
+            elif math.isinf(lower):
+                label = f"< {upper:g}"
+            elif math.isinf(upper):
+                label = f">= {lower:g}"
+            elif lower < 0 and self.bin_width is None:
+                label = f"({lower:g}, {upper:g}]"
+            else:
+                label = f"[{lower:g}, {upper:g})"
+            histogram.append((label, self.bins[(lower, upper)]))
+        return histogram
+
+    def _get_bin(self, value: float) -> tuple[float, float]:
+        if self.bin_width is not None:
+            range_lower, range_upper = self.bin_range
+            if value < range_lower:
+                return (-math.inf, range_lower)
+            if value >= range_upper:
+                return (range_upper, math.inf)
+            lower = (
+                range_lower + math.floor((value - range_lower) / self.bin_width) * self.bin_width
+            )
+            return (lower, min(lower + self.bin_width, range_upper))
+        if value == 0:
+            return (0, 0)
+        exponent = math.floor(math.log10(abs(value)))
+        # log10 can be rounded across a power of 10
+        if 10**exponent > abs(value):
+            exponent -= 1
+        elif 10 ** (exponent + 1) <= abs(value):
+            exponent += 1
+        if value > 0:
+            return (10**exponent, 10 ** (exponent + 1))
+        return (-(10 ** (exponent + 1)), -(10**exponent))
+
+
+@dataclasses.dataclass
+class HeavyHitters:
+    """A Space-Saving summary of the most common values using capacity counters. The count of each
+    value held is an overestimate by at most its error, which is at most total / capacity"""
+
+    capacity: int
+    counts: dict = dataclasses.field(default_factory=dict)
+    errors: dict = dataclasses.field(default_factory=dict)
+    # Values grouped by count, so that a value with the minimum count can be found in constant time
+    buckets: dict = dataclasses.field(default_factory=dict)
+    min_count: int = 0
+    total: int = 0
+
+    def __post_init__(self):
+        if self.capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+    def add(self, value: Any):
+        """Count an occurrence of a value
+
+        Arguments:
+            value {Any} -- a hashable value
+        """
+        self.total += 1
+        count = self.counts.get(value)
+        if count is None and len(self.counts) < self.capacity:
+            self.counts[value] = 1
+            self.errors[value] = 0
+            self.buckets.setdefault(1, {})[value] = None
+            self.min_count = 1
+            return
+        if count is None:
+            # The value replaces the oldest value with the minimum count and inherits its count
+            count = self.min_count
+            bucket = self.buckets[count]
+            replaced_value = next(iter(bucket))
+            del bucket[replaced_value]
+            del self.counts[replaced_value]
+            del self.errors[replaced_value]
+            self.counts[value] = count
+            self.errors[value] = count
+            bucket[value] = None
+        self._increment(value, count)
+
+    def update(self, other: "HeavyHitters"):
+        """Merge another summary into this one, the counts and errors of values missing from a full
+        summary are taken to be its minimum count, so counts remain overestimates
+
+        Arguments:
+            other {HeavyHitters} -- a summary with the same capacity
+        """
+        if other.capacity != self.capacity:
+            raise ValueError("Only summaries with the same capacity can be merged")
+        self_floor = self.min_count if len(self.counts) == self.capacity else 0
+        other_floor = other.min_count if len(other.counts) == other.capacity else 0
+        merged = []
+        for value in list(self.counts) + [x for x in other.counts if x not in self.counts]:
+            merged.append(
+                (
+                    self.counts.get(value, self_floor) + other.counts.get(value, other_floor),
+                    self.errors.get(value, self_floor) + other.errors.get(value, other_floor),
+                    value,
+                )
+            )
+        # The values kept stay in the order first seen, so that ties are listed as by Counter
+        capacity = self.capacity
+        kept = sorted(range(len(merged)), key=lambda i: merged[i][0], reverse=True)[0:capacity]
+        self.counts, self.errors, self.buckets = {}, {}, {}
+        for count, error, value in (merged[i] for i in sorted(kept)):
+            self.counts[value] = count
+            self.errors[value] = error
+            self.buckets.setdefault(count, {})[value] = None
+        self.min_count = min(self.buckets) if len(self.buckets) != 0 else 0
+        self.total += other.total
+
+    def most_common(self, n: int | None = None) -> list[tuple[Any, int, int]]:
+        """List the values with the highest counts
+
+        Keyword Arguments:
+            n {int | None} -- the number of values to list, or None for all (default: {None})
+
+        Returns:
+            list[tuple[Any, int, int]] -- value, count and error, in descending order of count
+        """
+        values = sorted(self.counts.items(), key=lambda x: x[1], reverse=True)
+        return [(value, count, self.errors[value]) for value, count in values[0:n]]
+
+    def _increment(self, value: Any, count: int):
+        bucket = self.buckets[count]
+        del bucket[value]
+        if len(bucket) == 0:
+            del self.buckets[count]
+            if count == self.min_count:
+                self.min_count = count + 1
+        self.counts[value] = count + 1
+        self.buckets.setdefault(count + 1, {})[value] = None
+
+
+@dataclasses.dataclass
+class DistinctCounter:
+    """A HyperLogLog estimate of the number of distinct values, with 2 ** precision registers
+    chosen so that the standard error of the estimate is at most error"""
+
+    error: float = DEFAULT_DISTINCT_ERROR
+    registers: bytearray | None = None
+
+    def __post_init__(self):
+        if not 0 < self.error < 1:
+            raise ValueError("error must be between 0 and 1")
+        # The standard error of HyperLogLog is 1.04 / sqrt(number of registers)
+        self.precision = min(max(math.ceil(math.log2((1.04 / self.error) ** 2)), 4), 18)
+        if self.registers is None:
+            self.registers = bytearray(2**self.precision)
+
+    def add(self, value: Any):
+        """Add a value to the estimate
+
+        Arguments:
+            value {Any} -- a value, values with the same repr are counted as the same value
+        """
+        value_hash = int.from_bytes(
+            hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        n_bits = 64 - self.precision
+        index = value_hash >> n_bits
+        rank = n_bits - (value_hash & ((1 << n_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other: "DistinctCounter"):
+        """Merge another estimate into this one
+
+        Arguments:
+            other {DistinctCounter} -- an estimate with the same error
+        """
+        if other.precision != self.precision:
+            raise ValueError("Only estimates with the same error can be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        """Estimate the number of distinct values added
+
+        Returns:
+            int -- the estimated number of distinct values
+        """
+        n_registers = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(
+            n_registers, 0.7213 / (1 + 1.079 / n_registers)
+        )
+        estimate = alpha * n_registers**2 / sum(2.0**-x for x in self.registers)
+        n_zeros = self.registers.count(0)
+        # Linear counting is more accurate while many registers are empty
+        if estimate <= 2.5 * n_registers and n_zeros != 0:
+            estimate = n_registers * math.log(n_registers / n_zeros)
+        return round(estimate)
+
+
+@dataclasses.dataclass
+class ApproximateDistribution:
+    """The top_k most common values with counts overestimated by at most count_error times the
+    total, and an estimate of the number of distinct values with a standard error of distinct_error
+    """
+
+    top_k: int = DEFAULT_TOP_K
+    count_error: float = DEFAULT_COUNT_ERROR
+    distinct_error: float = DEFAULT_DISTINCT_ERROR
+    heavy_hitters: HeavyHitters | None = None
+    distinct_counter: DistinctCounter | None = None
+
+    def __post_init__(self):
+        if self.top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        if not 0 < self.count_error < 1:
+            raise ValueError("count_error must be between 0 and 1")
+        if self.heavy_hitters is None:
+            capacity = max(self.top_k, math.ceil(1 / self.count_error))
+            self.heavy_hitters = HeavyHitters(capacity=capacity)
+        if self.distinct_counter is None:
+            self.distinct_counter = DistinctCounter(error=self.distinct_error)
+
+    @property
+    def total(self) -> int:
+        return self.heavy_hitters.total
+
+    def add(self, value: Any):
+        """Add a value to the distribution
+
+        Arguments:
+            value {Any} -- a hashable value of the key being summarised
+        """
+        self.heavy_hitters.add(value)
+        self.distinct_counter.add(value)
+
+    def update(self, other: "ApproximateDistribution"):
+        """Merge another distribution into this one
+
+        Arguments:
+            other {ApproximateDistribution} -- a distribution with the same error bounds
+        """
+        self.heavy_hitters.update(other.heavy_hitters)
+        self.distinct_counter.update(other.distinct_counter)
+
+    def most_common(self) -> list[tuple[Any, int, int]]:
+        """List the top_k most common values
+
+        Returns:
+            list[tuple[Any, int, int]] -- value, estimated count and the maximum overestimate of the
+            count, in descending order of count
+        """
+        return self.heavy_hitters.most_common(self.top_k)
+
+    def estimate_distinct(self) -> int:
+        """Estimate the number of distinct values
+
+        Returns:
+            int -- the estimated number of distinct values
+        """
+        return self.distinct_counter.estimate()
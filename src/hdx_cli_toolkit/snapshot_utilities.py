@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for reading and writing snapshots of the package_search records for datasets in HDX, as
+generated by the scan command. Two formats are supported, selected by file extension:
+
+1. Line-delimited JSON (.ndjson or .jsonl) - one dataset per line, written as records arrive and
+read lazily so that only a single dataset need be held in memory.
+
+2. JSON (any other extension) - the legacy format, a package_search response of the form
+{"result": {"count": n, "results": [...]}}. This is written incrementally but must be loaded
+completely to be read.
+
+Snapshots can also be kept in a store, a directory in which each distinct dataset is saved once as a
+compressed blob named by its content hash under objects/, and each snapshot is a manifest under
+manifests/ listing the id, name and hash of its datasets. Since most datasets are unchanged from one
+day to the next, a daily snapshot adds little more than its manifest to the store. A manifest path
+can be read like any other snapshot.
+
+Each snapshot file written has a sidecar offset index, with the same path plus .idx, which gives the
+byte offset and length of each dataset record in the file along with its id, name and organization.
+IndexedSnapshot uses this to read individual datasets from a memory-mapped snapshot without reading
+the rest of the file.
+
+A snapshot which is to be held in memory, to be scanned more than once, can be loaded as a
+CompactSnapshot, which stores datasets as tuples of values rather than dictionaries and keeps a
+single copy of each repeated string.
+"""
+
+import datetime
+import fnmatch
+import gzip
+import hashlib
+import json
+import mmap
+import os
+
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from hdx_cli_toolkit.codec_utilities import dumps, loads
+from hdx_cli_toolkit.utilities import make_path_unique
+
+LINE_DELIMITED_EXTENSIONS = (".ndjson", ".jsonl")
+MANIFEST_EXTENSION = ".manifest"
+OFFSET_INDEX_EXTENSION = ".idx"
+MAX_INTERNED_LENGTH = 256
+
+
+def is_line_delimited_snapshot(snapshot_path: str) -> bool:
+    """Determine whether a snapshot file is in the line-delimited JSON format from its extension
+
+    Arguments:
+        snapshot_path {str} -- a path to a snapshot file
+
+    Returns:
+        bool -- True if the snapshot is line-delimited JSON
+    """
+    _, extension = os.path.splitext(snapshot_path)
+    return extension.lower() in LINE_DELIMITED_EXTENSIONS
+
+
+def read_snapshot(snapshot_path: str) -> Iterator[dict]:
+    """Read datasets from a snapshot file. Line-delimited snapshots, store manifests and legacy JSON
+    snapshots with an up to date offset index are read one dataset at a time, other legacy JSON
+    snapshots are loaded in full on the first iteration.
+
+    Arguments:
+        snapshot_path {str} -- a path to a snapshot file
+
+    Yields:
+        Iterator[dict] -- package_search dataset dictionaries in the order they were written
+    """
+    if snapshot_path.endswith(MANIFEST_EXTENSION):
+        yield from read_from_store(snapshot_path)
+        return
+    # JSON snapshots with an up to date offset index can also be read one dataset at a time
+    line_delimited = is_line_delimited_snapshot(snapshot_path)
+    if not line_delimited and read_offset_index(snapshot_path) is not None:
+        with IndexedSnapshot(snapshot_path) as indexed_snapshot:
+            yield from indexed_snapshot
+        return
+    with open(snapshot_path, "rb") as snapshot_file:
+        if line_delimited:
+            for line in snapshot_file:
+                if line.strip():
+                    yield loads(line)
+        else:
+            yield from loads(snapshot_file.read())["result"]["results"]
+
+
+def read_snapshot_lines(snapshot_path: str) -> Iterator[str]:
+    """Read the undecoded lines of a line-delimited snapshot, so that they can be decoded elsewhere
+
+    Arguments:
+        snapshot_path {str} -- a path to a line-delimited snapshot file
+
+    Yields:
+        Iterator[str] -- one JSON encoded dataset per line
+    """
+    with open(snapshot_path, encoding="utf-8") as snapshot_file:
+        for line in snapshot_file:
+            if line.strip():
+                yield line
+
+
+def stream_to_snapshot(datasets: Iterable[dict], snapshot_path: str) -> Iterator[dict]:
+    """Write datasets to a snapshot file as they are consumed, passing each one through so that a
+    scan action can process it. The file, and its sidecar offset index, are complete once the
+    returned iterator is exhausted.
+
+    Arguments:
+        datasets {Iterable[dict]} -- an iterable of dataset dictionaries
+        snapshot_path {str} -- a path to the snapshot file to be written
+
+    Yields:
+        Iterator[dict] -- the datasets supplied, unchanged
+    """
+    line_delimited = is_line_delimited_snapshot(snapshot_path)
+    n_datasets = 0
+    offset = 0
+    index_entries = []
+    with open(snapshot_path, "wb") as snapshot_file:
+        if not line_delimited:
+            offset += snapshot_file.write(b'{"result": {"results": [')
+        for dataset in datasets:
+            if not line_delimited and n_datasets != 0:
+                offset += snapshot_file.write(b", ")
+            record = dumps(dataset)
+            index_entries.append(_make_index_entry(offset, len(record), dataset))
+            offset += snapshot_file.write(record)
+            if line_delimited:
+                offset += snapshot_file.write(b"\n")
+            n_datasets += 1
+            yield dataset
+        if not line_delimited:
+            offset += snapshot_file.write(f'], "count": {n_datasets}}}}}'.encode("utf-8"))
+
+    _write_offset_index(snapshot_path, offset, index_entries)
+
+
+def write_snapshot(datasets: Iterable[dict], snapshot_path: str) -> int:
+    """Write datasets to a snapshot file
+
+    Arguments:
+        datasets {Iterable[dict]} -- an iterable of dataset dictionaries
+        snapshot_path {str} -- a path to the snapshot file to be written
+
+    Returns:
+        int -- the number of datasets written
+    """
+    n_datasets = 0
+    for _ in stream_to_snapshot(datasets, snapshot_path):
+        n_datasets += 1
+    return n_datasets
+
+
+class IndexedSnapshot:
+    """Random access to the datasets in a snapshot file using its sidecar offset index. The snapshot
+    is memory-mapped and only the records requested are decoded. Use as a context manager, or call
+    close when finished.
+    """
+
+    def __init__(self, snapshot_path: str):
+        self.snapshot_path = snapshot_path
+        self.entries = read_offset_index(snapshot_path)
+        if self.entries is None:
+            raise ValueError(f"Snapshot {snapshot_path} has no up to date offset index")
+        self._by_name = {x["name"]: x for x in self.entries}
+        self._by_id = {x["id"]: x for x in self.entries}
+        self._file = open(snapshot_path, "rb")
+        self._mmap = None
+        if os.path.getsize(snapshot_path) != 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the memory map and close the snapshot file"""
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __iter__(self) -> Iterator[dict]:
+        for entry in self.entries:
+            yield self._decode(entry)
+
+    def get(self, name_or_id: str) -> dict | None:
+        """Read a single dataset by name or id
+
+        Arguments:
+            name_or_id {str} -- a dataset name or id
+
+        Returns:
+            dict | None -- the dataset, or None if it is not in the snapshot
+        """
+        entry = self._by_name.get(name_or_id, self._by_id.get(name_or_id))
+        if entry is None:
+            return None
+        return self._decode(entry)
+
+    def select(self, dataset_filter: str = "*", organization: str = "") -> Iterator[dict]:
+        """Read the datasets whose names match a filter, in snapshot order, decoding only those
+
+        Keyword Arguments:
+            dataset_filter {str} -- a dataset name or pattern with wildcards (default: {"*"})
+            organization {str} -- an organization name, or "" for all (default: {""})
+
+        Yields:
+            Iterator[dict] -- the datasets selected
+        """
+        if not any(x in dataset_filter for x in "*?["):
+            entry = self._by_name.get(dataset_filter)
+            entries = [] if entry is None else [entry]
+        else:
+            entries = (x for x in self.entries if fnmatch.fnmatch(x["name"], dataset_filter))
+        for entry in entries:
+            if organization == "" or entry["organization"] == organization:
+                yield self._decode(entry)
+
+    def _decode(self, entry: dict) -> dict:
+        start, end = entry["offset"], entry["offset"] + entry["length"]
+        return loads(self._mmap[start:end])
+
+
+def select_from_snapshot(
+    snapshot_path: str, dataset_filter: str = "*", organization: str = ""
+) -> list[dict]:
+    """Select datasets from a snapshot by name and organization. The sidecar offset index is used
+    where it is up to date, and built first for line-delimited snapshots which have none, otherwise
+    the whole snapshot is read.
+
+    Arguments:
+        snapshot_path {str} -- a path to a snapshot file or store manifest
+
+    Keyword Arguments:
+        dataset_filter {str} -- a dataset name or pattern with wildcards (default: {"*"})
+        organization {str} -- an organization name, or "" for all (default: {""})
+
+    Returns:
+        list[dict] -- the datasets selected, in snapshot order
+    """
+    if _ensure_offset_index(snapshot_path):
+        with IndexedSnapshot(snapshot_path) as indexed_snapshot:
+            return list(indexed_snapshot.select(dataset_filter, organization=organization))
+
+    return [
+        x
+        for x in read_snapshot(snapshot_path)
+        if fnmatch.fnmatch(x["name"], dataset_filter)
+        and (organization == "" or _get_organization_name(x) == organization)
+    ]
+
+
+def list_snapshot_names(snapshot_path: str) -> list[str]:
+    """List the names of the datasets in a snapshot, using the sidecar offset index where possible
+
+    Arguments:
+        snapshot_path {str} -- a path to a snapshot file or store manifest
+
+    Returns:
+        list[str] -- dataset names in snapshot order
+    """
+    if _ensure_offset_index(snapshot_path):
+        return [x["name"] for x in read_offset_index(snapshot_path)]
+    if snapshot_path.endswith(MANIFEST_EXTENSION):
+        return [x["name"] for x in read_store_manifest(snapshot_path)]
+    return [x["name"] for x in read_snapshot(snapshot_path)]
+
+
+class CompactRecord:
+    """A JSON object held as a tuple of keys, shared by all records with the same keys, and a tuple
+    of values, which takes a fraction of the memory of a dictionary"""
+
+    __slots__ = ("keys", "values")
+
+    def __init__(self, keys: tuple[str, ...], values: tuple):
+        self.keys = keys
+        self.values = values
+
+    def to_dict(self) -> dict:
+        """Convert the record, and any records and tuples nested in it, back to JSON types
+
+        Returns:
+            dict -- the record as a dictionary
+        """
+        return {key_: _expand_value(value) for key_, value in zip(self.keys, self.values)}
+
+
+class CompactSnapshot:
+    """Datasets held in memory with every JSON object stored as a CompactRecord, lists as tuples
+    and repeated strings, such as organization names, formats and keys, stored once. Iterating
+    yields each dataset as a new dictionary, so a snapshot loaded once can be scanned repeatedly
+    while only one dataset at a time is held as dictionaries.
+    """
+
+    def __init__(self, datasets: Iterable[dict] = ()):
+        self._strings = {}
+        self._shapes = {}
+        self._records = []
+        for dataset in datasets:
+            self.append(dataset)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[dict]:
+        for record in self._records:
+            yield record.to_dict()
+
+    def __getitem__(self, position: int) -> dict:
+        return self._records[position].to_dict()
+
+    def append(self, dataset: dict):
+        """Add a dataset to the snapshot
+
+        Arguments:
+            dataset {dict} -- a package_search dataset dictionary
+        """
+        self._records.append(self._compact_value(dataset))
+
+    def _compact_value(self, value: Any) -> Any:
+        if isinstance(value, str):
+            if len(value) > MAX_INTERNED_LENGTH:
+                return value
+            return self._strings.setdefault(value, value)
+        if isinstance(value, dict):
+            keys = tuple(value)
+            shape = self._shapes.get(keys)
+            if shape is None:
+                shape = self._shapes[keys] = tuple(self._compact_value(x) for x in keys)
+            return CompactRecord(shape, tuple(self._compact_value(x) for x in value.values()))
+        if isinstance(value, list):
+            return tuple(self._compact_value(x) for x in value)
+        return value
+
+
+def load_compact_snapshot(snapshot_path: str) -> CompactSnapshot:
+    """Load a snapshot into memory as a CompactSnapshot, decoding one dataset at a time where the
+    snapshot format allows, see read_snapshot
+
+    Arguments:
+        snapshot_path {str} -- a path to a snapshot file or store manifest
+
+    Returns:
+        CompactSnapshot -- the datasets in the snapshot
+    """
+    return CompactSnapshot(read_snapshot(snapshot_path))
+
+
+def _expand_value(value: Any) -> Any:
+    if isinstance(value, CompactRecord):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return [_expand_value(x) for x in value]
+    return value
+
+
+def build_offset_index(snapshot_path: str) -> int:
+    """Write the sidecar offset index for an existing line-delimited snapshot
+
+    Arguments:
+        snapshot_path {str} -- a path to a line-delimited snapshot file
+
+    Returns:
+        int -- the number of datasets indexed
+    """
+    offset = 0
+    index_entries = []
+    with open(snapshot_path, "rb") as snapshot_file:
+        for line in snapshot_file:
+            record = line.rstrip(b"\r\n")
+            if record.strip():
+                index_entries.append(_make_index_entry(offset, len(record), loads(record)))
+            offset += len(line)
+
+    _write_offset_index(snapshot_path, offset, index_entries)
+    return len(index_entries)
+
+
+def read_offset_index(snapshot_path: str) -> list[dict] | None:
+    """Read the sidecar offset index for a snapshot
+
+    Arguments:
+        snapshot_path {str} -- a path to a snapshot file
+
+    Returns:
+        list[dict] | None -- the offset, length, id, name and organization of each dataset, or None
+        if there is no index or the snapshot has changed size since it was written
+    """
+    index_path = f"{snapshot_path}{OFFSET_INDEX_EXTENSION}"
+    if not os.path.exists(index_path) or not os.path.exists(snapshot_path):
+        return None
+    with open(index_path, encoding="utf-8") as index_file:
+        snapshot_size = int(index_file.readline())
+        if snapshot_size != os.path.getsize(snapshot_path):
+            return None
+        entries = []
+        for line in index_file:
+            offset, length, dataset_id, name, organization = line.rstrip("\n").split("\t")
+            entries.append(
+                {
+                    "offset": int(offset),
+                    "length": int(length),
+                    "id": dataset_id,
+                    "name": name,
+                    "organization": organization,
+                }
+            )
+    return entries
+
+
+def _ensure_offset_index(snapshot_path: str) -> bool:
+    # Line-delimited snapshots without an up to date index are indexed on first use
+    if read_offset_index(snapshot_path) is not None:
+        return True
+    if is_line_delimited_snapshot(snapshot_path):
+        build_offset_index(snapshot_path)
+        return True
+    return False
+
+
+def _make_index_entry(offset: int, length: int, dataset: dict) -> str:
+    # Only the index line is kept, so that datasets are not held until the index is written
+    return (
+        f"{offset}\t{length}\t{dataset.get('id', '')}\t{dataset.get('name', '')}"
+        f"\t{_get_organization_name(dataset)}\n"
+    )
+
+
+def _write_offset_index(snapshot_path: str, snapshot_size: int, index_entries: list[str]):
+    # The first line is the size of the snapshot, so that an index which is out of date is ignored
+    lines = [f"{snapshot_size}\n"] + index_entries
+    _write_atomically(f"{snapshot_path}{OFFSET_INDEX_EXTENSION}", "".join(lines).encode("utf-8"))
+
+
+def _get_organization_name(dataset: dict) -> str:
+    organization = dataset.get("organization")
+    if isinstance(organization, dict):
+        return organization.get("name", "")
+    return ""
+
+
+def hash_record(record: Any) -> str:
+    """Calculate a canonical content hash for a JSON serialisable record, which does not depend on
+    the order of keys in dictionaries
+
+    Arguments:
+        record {Any} -- a JSON serialisable record
+
+    Returns:
+        str -- a hexadecimal blake2b digest
+    """
+    # The standard library is used rather than the codec so that hashes are the same whichever
+    # JSON library is installed, and the default ensure_ascii encoding is canonical and fastest
+    canonical_json = json.dumps(record, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical_json.encode("ascii"), digest_size=16).hexdigest()
+
+
+def stream_to_store(datasets: Iterable[dict], manifest_path: str) -> Iterator[dict]:
+    """Save datasets to a snapshot store as they are consumed, passing each one through so that a
+    scan action can process it. Only datasets not already in the store are written, and the
+    manifest is written once the returned iterator is exhausted.
+
+    Arguments:
+        datasets {Iterable[dict]} -- an iterable of dataset dictionaries
+        manifest_path {str} -- a path for the manifest, as returned by make_manifest_path
+
+    Yields:
+        Iterator[dict] -- the datasets supplied, unchanged
+    """
+    store_directory = _get_store_directory(manifest_path)
+    manifest_lines = []
+    for dataset in datasets:
+        content_hash = hash_record(dataset)
+        object_path = _store_object_path(store_directory, content_hash)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            _write_atomically(object_path, gzip.compress(dumps(dataset), 6))
+        manifest_lines.append(
+            json.dumps({"id": dataset["id"], "name": dataset["name"], "hash": content_hash}) + "\n"
+        )
+        yield dataset
+
+    _write_atomically(manifest_path, "".join(manifest_lines).encode("utf-8"))
+
+
+def write_to_store(datasets: Iterable[dict], store_directory: str, label: str | None = None) -> str:
+    """Save datasets to a snapshot store
+
+    Arguments:
+        datasets {Iterable[dict]} -- an iterable of dataset dictionaries
+        store_directory {str} -- the store directory, created if it does not exist
+
+    Keyword Arguments:
+        label {str | None} -- a name for the manifest, today's date by default (default: {None})
+
+    Returns:
+        str -- the path of the manifest written
+    """
+    manifest_path = make_manifest_path(store_directory, label=label)
+    for _ in stream_to_store(datasets, manifest_path):
+        pass
+    return manifest_path
+
+
+def read_from_store(manifest_path: str) -> Iterator[dict]:
+    """Reconstruct the datasets of a snapshot from a store manifest, in their original order
+
+    Arguments:
+        manifest_path {str} -- a path to a manifest in a snapshot store
+
+    Yields:
+        Iterator[dict] -- package_search dataset dictionaries
+    """
+    store_directory = _get_store_directory(manifest_path)
+    for entry in read_store_manifest(manifest_path):
+        with open(_store_object_path(store_directory, entry["hash"]), "rb") as object_file:
+            yield loads(gzip.decompress(object_file.read()))
+
+
+def read_store_manifest(manifest_path: str) -> Iterator[dict]:
+    """Read the entries of a store manifest without reading any datasets
+
+    Arguments:
+        manifest_path {str} -- a path to a manifest in a snapshot store
+
+    Yields:
+        Iterator[dict] -- the id, name and hash of each dataset
+    """
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        for line in manifest_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def make_manifest_path(store_directory: str, label: str | None = None) -> str:
+    """Make the path for a manifest in a snapshot store, creating the manifests directory if needed
+
+    Arguments:
+        store_directory {str} -- the store directory
+
+    Keyword Arguments:
+        label {str | None} -- a name for the manifest, today's date by default (default: {None})
+
+    Returns:
+        str -- a path to the manifest, with a suffix added if one already exists for the label
+    """
+    if label is None:
+        label = datetime.date.today().isoformat()
+    manifests_directory = os.path.join(store_directory, "manifests")
+    os.makedirs(manifests_directory, exist_ok=True)
+    return make_path_unique(os.path.join(manifests_directory, f"{label}{MANIFEST_EXTENSION}"))
+
+
+def _get_store_directory(manifest_path: str) -> str:
+    return os.path.dirname(os.path.dirname(os.path.abspath(manifest_path)))
+
+
+def _store_object_path(store_directory: str, content_hash: str) -> str:
+    return os.path.join(store_directory, "objects", content_hash[0:2], f"{content_hash}.json.gz")
+
+
+def _write_atomically(path: str, data: bytes):
+    # A partially written file is never visible at path, so an interrupted save leaves no corrupt
+    # objects in the store
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as output_file:
+        output_file.write(data)
+    os.replace(temporary_path, path)
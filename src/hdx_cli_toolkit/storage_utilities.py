@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for the scan storage action, which totals the size of resources by organization, format
+and url_type and counts the resources over a set of size thresholds.
+
+Totals are kept in a Counter keyed by (dimension, value, measure), for example
+("format", "CSV", "total_bytes"), so that the totals for shards of datasets scanned in separate
+processes are merged with Counter.update, and memory is bounded by the number of distinct
+organizations, formats and url_types rather than the number of resources.
+
+Resource sizes are taken from the size key, which may be an integer, a numeric string, null or
+absent. Resources without a usable size are counted in n_unknown_size.
+"""
+
+import math
+
+from collections import Counter
+from typing import Any
+
+STORAGE_DIMENSIONS = ["total", "organization", "format", "url_type"]
+STORAGE_KEYS = ["organization.name", "resources.format", "resources.url_type", "resources.size"]
+SIZE_THRESHOLDS = {"1MB": 10**6, "10MB": 10**7, "100MB": 10**8, "1GB": 10**9}
+
+
+def add_dataset_storage(totals: Counter, dataset: dict):
+    """Add the resources of a dataset to storage totals
+
+    Arguments:
+        totals {Counter} -- totals keyed by (dimension, value, measure)
+        dataset {dict} -- a package_search dataset dictionary
+    """
+    organization = dataset.get("organization")
+    organization_name = organization.get("name", "") if isinstance(organization, dict) else ""
+    resources = dataset.get("resources")
+    if not isinstance(resources, list):
+        return
+    for resource in resources:
+        if not isinstance(resource, dict):
+            continue
+        size = parse_size(resource.get("size"))
+        groups = [
+            ("total", ""),
+            ("organization", organization_name),
+            ("format", str(resource.get("format") or "")),
+            ("url_type", str(resource.get("url_type") or "")),
+        ]
+        for dimension, value in groups:
+            totals[(dimension, value, "n_resources")] += 1
+            if size is None:
+                totals[(dimension, value, "n_unknown_size")] += 1
+                continue
+            totals[(dimension, value, "total_bytes")] += size
+            for label, threshold in SIZE_THRESHOLDS.items():
+                if size > threshold:
+                    totals[(dimension, value, f"n_over_{label}")] += 1
+
+
+def make_storage_table(totals: Counter) -> list[dict]:
+    """Convert storage totals into rows for display or writing to CSV, ordered by dimension and then
+    by total bytes, largest first
+
+    Arguments:
+        totals {Counter} -- totals keyed by (dimension, value, measure)
+
+    Returns:
+        list[dict] -- a row for each dimension and value
+    """
+    measures = ["n_resources", "n_unknown_size", "total_bytes"] + [
+        f"n_over_{x}" for x in SIZE_THRESHOLDS
+    ]
+    groups = {}
+    for dimension, value, _ in totals:
+        groups.setdefault((dimension, value), None)
+
+    rows = []
+    for dimension, value in groups:
+        row = {"dimension": dimension, "value": value}
+        for measure in measures:
+            row[measure] = totals[(dimension, value, measure)]
+        rows.append(row)
+
+    rows.sort(
+        key=lambda x: (
+            STORAGE_DIMENSIONS.index(x["dimension"]),
+            -x["total_bytes"],
+            -x["n_resources"],
+            x["value"],
+        )
+    )
+    return rows
+
+
+def parse_size(size: Any) -> int | None:
+    """Read a resource size in bytes
+
+    Arguments:
+        size {Any} -- the value of a resource size key
+
+    Returns:
+        int | None -- the size, or None if it is not a non-negative number
+    """
+    if isinstance(size, bool):
+        return None
+    if isinstance(size, (int, float)):
+        return int(size) if math.isfinite(size) and size >= 0 else None
+    if isinstance(size, str):
+        try:
+            return parse_size(float(size.strip()))
+        except ValueError:
+            return None
+    return None
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Utilities for flattening a snapshot of package_search records into two in-memory columnar tables,
+one row per dataset and one row per resource, so that scan actions over many keys can be answered by
+counting codes rather than walking nested dictionaries.
+
+Each column holds one code per row in an array of unsigned integers, with code 0 meaning the key is
+absent, and a list of the distinct values the codes stand for. The datasets table has a column for
+each top level key and for each key of a dictionary valued top level key, such as
+organization.name. The resources table has a column for each resource key and records the dataset
+row of each resource.
+
+Survey, distribution and list actions are answered from the tables where the result is guaranteed to
+be the same as that of the Python scan functions, as for the SQLite snapshot index, otherwise None
+is returned and the datasets must be scanned.
+"""
+
+import array
+import dataclasses
+import json
+
+from collections import Counter
+from collections.abc import Iterable
+from typing import Any
+
+ABSENT_CODE = 0
+
+
+@dataclasses.dataclass
+class Column:
+    """A dictionary encoded column, values[codes[row]] is the value for a row"""
+
+    codes: array.array = dataclasses.field(default_factory=lambda: array.array("I"))
+    values: list = dataclasses.field(default_factory=lambda: [None])
+    codes_by_value: dict = dataclasses.field(default_factory=dict, repr=False)
+
+    def set(self, row: int, value: Any):
+        """Set the value for a row, which must be after any row already set
+
+        Arguments:
+            row {int} -- the row number
+            value {Any} -- the value
+        """
+        # Values are encoded by type as well as value so that True and 1 remain distinct
+        if isinstance(value, (dict, list)):
+            encoding_key = ("json", json.dumps(value, sort_keys=True, default=str))
+        else:
+            encoding_key = (type(value), value)
+        code = self.codes_by_value.get(encoding_key)
+        if code is None:
+            code = len(self.values)
+            self.codes_by_value[encoding_key] = code
+            self.values.append(value)
+        self.pad(row)
+        self.codes.append(code)
+
+    def pad(self, n_rows: int):
+        """Mark rows as absent up to n_rows
+
+        Arguments:
+            n_rows {int} -- the number of rows the column should have
+        """
+        if len(self.codes) < n_rows:
+            self.codes.extend(array.array("I", [ABSENT_CODE]) * (n_rows - len(self.codes)))
+
+    def get_present_codes(self) -> bytearray:
+        """Flag the codes of values which the scan functions count as present, a value is not
+        counted if it contains the text "key absent" used for absent keys
+
+        Returns:
+            bytearray -- 1 for each code counted as present, 0 otherwise
+        """
+        return bytearray(
+            x != ABSENT_CODE and "key absent" not in str(value)
+            for x, value in enumerate(self.values)
+        )
+
+
+@dataclasses.dataclass
+class Table:
+    """A set of columns with the same number of rows"""
+
+    n_rows: int = 0
+    columns: dict[str, Column] = dataclasses.field(default_factory=dict)
+
+    def get_column(self, name: str) -> Column:
+        """Get a column, creating it if it does not exist
+
+        Arguments:
+            name {str} -- the column name
+
+        Returns:
+            Column -- the column
+        """
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = Column()
+        return column
+
+    def finish(self):
+        """Pad every column to the number of rows in the table"""
+        for column in self.columns.values():
+            column.pad(self.n_rows)
+
+
+@dataclasses.dataclass
+class SnapshotTables:
+    """The datasets and resources tables for a snapshot, with the structure needed to tell whether
+    a key can be answered from them"""
+
+    datasets: Table = dataclasses.field(default_factory=Table)
+    resources: Table = dataclasses.field(default_factory=Table)
+    resource_datasets: array.array = dataclasses.field(default_factory=lambda: array.array("I"))
+    n_resources: array.array = dataclasses.field(default_factory=lambda: array.array("I"))
+    n_dict_values: Counter = dataclasses.field(default_factory=Counter)
+    n_resource_lists: int = 0
+
+
+def build_snapshot_tables(datasets: Iterable[dict]) -> SnapshotTables:
+    """Flatten datasets into columnar tables
+
+    Arguments:
+        datasets {Iterable[dict]} -- an iterable of package_search dataset dictionaries
+
+    Returns:
+        SnapshotTables -- the datasets and resources tables
+    """
+    tables = SnapshotTables()
+    dataset_table, resource_table = tables.datasets, tables.resources
+    for dataset_row, dataset in enumerate(datasets):
+        n_resources = 0
+        for key_, value in dataset.items():
+            if key_ == "resources" and isinstance(value, list):
+                if all(isinstance(x, dict) for x in value):
+                    tables.n_resource_lists += 1
+                for resource in value:
+                    if not isinstance(resource, dict):
+                        continue
+                    for resource_key, resource_value in resource.items():
+                        resource_table.get_column(resource_key).set(
+                            resource_table.n_rows, resource_value
+                        )
+                    tables.resource_datasets.append(dataset_row)
+                    resource_table.n_rows += 1
+                    n_resources += 1
+                continue
+            dataset_table.get_column(key_).set(dataset_row, value)
+            if isinstance(value, dict):
+                tables.n_dict_values[key_] += 1
+                for sub_key, sub_value in value.items():
+                    dataset_table.get_column(f"{key_}.{sub_key}").set(dataset_row, sub_value)
+        tables.n_resources.append(n_resources)
+        dataset_table.n_rows += 1
+
+    dataset_table.finish()
+    resource_table.finish()
+    return tables
+
+
+def survey_from_tables(tables: SnapshotTables, key: str) -> Counter | None:
+    """Count the occurrences of a key or list of keys, with the same result as scan_survey
+
+    Arguments:
+        tables {SnapshotTables} -- tables from build_snapshot_tables
+        key {str} -- a key or comma separated list of keys
+
+    Returns:
+        Counter | None -- occurrences of each key, or None if the keys cannot be answered
+    """
+    keys = key.split(",")
+    locations = [_locate_key(tables, x) for x in keys]
+    if None in locations:
+        return None
+    # Dataset keys are counted once per resource row if any key is a resource key
+    resource_rows = any(table == "resources" for table, _ in locations)
+
+    first_seen = []
+    for i, (key_, (table, column)) in enumerate(zip(keys, locations)):
+        if column is None:
+            continue
+        present_codes = column.get_present_codes()
+        if table == "resources" or not resource_rows:
+            code_counts = Counter(column.codes)
+            n_occurrences = sum(n for code, n in code_counts.items() if present_codes[code])
+            first_row = next((j for j, x in enumerate(column.codes) if present_codes[x]), None)
+        else:
+            n_occurrences = 0
+            first_row = None
+            row = 0
+            for code, n_resources in zip(column.codes, tables.n_resources):
+                if present_codes[code] and n_resources != 0:
+                    n_occurrences += n_resources
+                    first_row = row if first_row is None else first_row
+                row += n_resources
+        if n_occurrences != 0:
+            first_seen.append((first_row, i, key_, n_occurrences))
+
+    return Counter({key_: n for _, _, key_, n in sorted(first_seen)})
+
+
+def distribution_from_tables(tables: SnapshotTables, key: str) -> Counter | None:
+    """Calculate the distribution of values for a key, with the same result as scan_distribution
+
+    Arguments:
+        tables {SnapshotTables} -- tables from build_snapshot_tables
+        key {str} -- a single key
+
+    Returns:
+        Counter | None -- occurrences of each value, or None if the key cannot be answered
+    """
+    location = _locate_key(tables, key)
+    if location is None:
+        return None
+    _, column = location
+    value_occurence_counter = Counter()
+    if column is None:
+        return value_occurence_counter
+    if any(isinstance(x, (dict, list)) for x in column.values):
+        return None
+
+    present_codes = column.get_present_codes()
+    # Counting codes preserves the order in which values are first seen, and accumulating merges
+    # values which compare equal, such as True and 1, as scan_distribution does
+    for code, n in Counter(column.codes).items():
+        if present_codes[code]:
+            value_occurence_counter[column.values[code]] += n
+    return value_occurence_counter
+
+
+def list_from_tables(tables: SnapshotTables, key: str) -> list[dict] | None:
+    """Replicate list_from_datasets
+
+    Arguments:
+        tables {SnapshotTables} -- tables from build_snapshot_tables
+        key {str} -- a key or comma separated list of keys
+
+    Returns:
+        list[dict] | None -- output rows, or None if the keys cannot be answered
+    """
+    keys = key.split(",")
+    locations = [_locate_key(tables, x) for x in keys]
+    name_column = tables.datasets.columns.get("name")
+    if None in locations or name_column is None:
+        return None
+
+    columns = []
+    for key_, (table, column) in zip(keys, locations):
+        absent_message = f"'{key_.split('.')[-1]}' key absent"
+        values = [absent_message] if column is None else [absent_message] + column.values[1:]
+        codes = column.codes if column is not None else None
+        columns.append((key_, table, codes, values))
+
+    output = []
+    if all(table == "datasets" for _, table, _, _ in columns):
+        for dataset_row, name_code in enumerate(name_column.codes):
+            output_row = {"dataset_name": name_column.values[name_code]}
+            for key_, _, codes, values in columns:
+                output_row[key_] = values[codes[dataset_row]] if codes is not None else values[0]
+            output.append(output_row)
+        return output
+
+    for resource_row, dataset_row in enumerate(tables.resource_datasets):
+        output_row = {"dataset_name": name_column.values[name_column.codes[dataset_row]]}
+        for key_, table, codes, values in columns:
+            if codes is None:
+                output_row[key_] = values[0]
+            else:
+                row = resource_row if table == "resources" else dataset_row
+                output_row[key_] = values[codes[row]]
+        output.append(output_row)
+    return output
+
+
+def _locate_key(tables: SnapshotTables, key: str) -> tuple[str, Column | None] | None:
+    # Returns the table and column for a key, or None if any dataset has a structure for which the
+    # scan functions would give a different answer. A column of None means the key is always absent
+    n_datasets = tables.datasets.n_rows
+    parts = key.split(".")
+    if len(parts) == 1 and key != "resources":
+        return "datasets", tables.datasets.columns.get(key)
+    if len(parts) != 2:
+        return None
+    if parts[0] == "resources":
+        if tables.n_resource_lists != n_datasets:
+            return None
+        return "resources", tables.resources.columns.get(parts[1])
+    if tables.n_dict_values[parts[0]] != n_datasets:
+        return None
+    return "datasets", tables.datasets.columns.get(key)
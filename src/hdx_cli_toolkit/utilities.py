@@ -344,7 +344,8 @@ def query_dict(
 ) -> list[dict[str, Any]]:
     """This function takes a list of key definitions which can be simple (i.e. archived) or nested
     (resource.name). Nested keys can access simple dictionaries or the same key in each element
-    of a list. Key depth is limited to 2, and list.list nested keys are not handled.
+    of a list. Key depth is limited to 2, and list.list nested keys are not handled - compile_query
+    handles keys of any depth and is preferred when many dictionaries are to be queried.
 
     Arguments:
         keys {list[str]} -- a list of key definitions
@@ -400,6 +401,95 @@ def query_dict(
     return output
 
 
+def compile_query(keys: list[str]) -> Callable[[dict[str, Any], dict[str, Any]], list[dict]]:
+    """This function compiles a list of key definitions into a query function which can be applied
+    to many dictionaries without parsing the keys again. The query function takes a dataset
+    dictionary and an output row, like query_dict, and returns the same result as query_dict for
+    keys of depth 2. Keys may be nested to any depth, lists are fanned out at any level, including
+    lists of lists, so that each element gives one or more rows. Keys passing through different
+    lists generate separate rows, keys passing through dictionaries appear in every row.
+
+    Arguments:
+        keys {list[str]} -- a list of key definitions
+
+    Returns:
+        Callable[[dict[str, Any], dict[str, Any]], list[dict]] -- a query function
+    """
+    # Keys are merged into a tree which shares common prefixes. Each level of the tree is a pair of
+    # (leaves, branches), where leaves are (name, output key, absent message) and branches are
+    # (name, next level)
+    tree = {}
+    for key_ in keys:
+        level = tree
+        parts = key_.split(".")
+        for i, part in enumerate(parts):
+            node = level.setdefault(part, [None, {}])
+            if i == len(parts) - 1:
+                node[0] = key_
+            level = node[1]
+
+    def freeze(level: dict) -> tuple[tuple, tuple]:
+        leaves = tuple(
+            (name, output_key, f"'{name}' key absent")
+            for name, (output_key, _) in level.items()
+            if output_key is not None
+        )
+        branches = tuple(
+            (name, freeze(children)) for name, (_, children) in level.items() if children
+        )
+        return leaves, branches
+
+    root = freeze(tree)
+
+    def query(dataset_dict: dict[str, Any], output_row: dict[str, Any]) -> list[dict[str, Any]]:
+        return _expand_level(root, dataset_dict, output_row)
+
+    return query
+
+
+def _expand_level(level: tuple, value: dict[str, Any], output_row: dict[str, Any]) -> list[dict]:
+    list_branches = []
+    _collect_level(level, value, output_row, list_branches)
+    if len(list_branches) == 0:
+        return [output_row]
+
+    output = []
+    for next_level, elements in list_branches:
+        _expand_elements(next_level, elements, output_row, output)
+    return output
+
+
+def _collect_level(level: tuple, value: dict[str, Any], output_row: dict[str, Any], list_branches):
+    # Values reached through dictionaries are written to the row, lists are left for fan out
+    leaves, branches = level
+    for name, output_key, absent_message in leaves:
+        output_row[output_key] = value.get(name, absent_message)
+    for name, next_level in branches:
+        next_value = value.get(name)
+        if isinstance(next_value, dict):
+            _collect_level(next_level, next_value, output_row, list_branches)
+        elif isinstance(next_value, list):
+            list_branches.append((next_level, next_value))
+
+
+def _expand_elements(level: tuple, elements: list, output_row: dict[str, Any], output: list):
+    leaves, branches = level
+    for element in elements:
+        if isinstance(element, dict):
+            if branches:
+                output.extend(_expand_level(level, element, output_row.copy()))
+            else:
+                # The common case, such as resources.name, is handled without recursion
+                row = output_row.copy()
+                for name, output_key, absent_message in leaves:
+                    row[output_key] = element.get(name, absent_message)
+                output.append(row)
+        elif isinstance(element, list):
+            _expand_elements(level, element, output_row, output)
+        else:
+            output.append(output_row.copy())
+
+
 def traverse(keys, dictionary, value_list=None):
     if value_list is None:
         value_list = []
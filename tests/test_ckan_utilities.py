@@ -1,15 +1,38 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import functools
 import json
+import re
+import os
+import time
 from unittest import mock
 
+import pytest
+import urllib3.exceptions
+
 from hdx_cli_toolkit.ckan_utilities import (
     scan_delete_key,
     scan_distribution,
+    fetch_datasets_from_ckan_package_search,
     scan_survey,
     fetch_data_from_ckan_package_search,
+    refresh_datasets_from_ckan_package_search,
+    make_field_projection,
+    reshape_projected_dataset,
+    fetch_datasets_with_checkpoints,
+    fetch_page_bodies_from_ckan_package_search,
+    FetchPolicy,
+    RateLimiter,
+    scan_actions,
+    scan_in_parallel,
+    iterate_resources,
+    resource_key_to_dataset_key,
 )
+from hdx_cli_toolkit.filter_utilities import compile_where
+from hdx_cli_toolkit.hdx_utilities import list_from_datasets
+from hdx_cli_toolkit.sketch_utilities import ApproximateDistribution, NumericDistribution
+from hdx_cli_toolkit.snapshot_utilities import write_snapshot
 
 
 def test_scan_survey(json_fixture):
@@ -29,6 +52,35 @@ def test_scan_delete_key(mock_ckanapi, json_fixture):
     assert key_occurence_counter == {"resources._csrf_token": 3}
 
 
+@mock.patch("ckanapi.RemoteCKAN.call_action")
+@mock.patch("hdx_cli_toolkit.ckan_utilities.get_hdx_url_and_key")
+def test_scan_delete_key_concurrently(mock_get_hdx_url_and_key, mock_ckanapi, json_fixture):
+    mock_get_hdx_url_and_key.return_value = (
+        "https://stage.data-humdata-org.ahconu.org",
+        "dummy-api-key",
+        "hdx-cli-toolkit",
+    )
+    key = "resources._csrf_token"
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    key_occurence_counter = scan_delete_key(iter(datasets), key, workers=4, rate=0)
+
+    assert key_occurence_counter == {"resources._csrf_token": 3}
+    assert mock_ckanapi.call_count == 3
+    for call in mock_ckanapi.call_args_list:
+        assert call.args[0] == "resource_update"
+        assert "_csrf_token" not in call.kwargs["data_dict"]
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(rate=50)
+    t0 = time.monotonic()
+    for _ in range(11):
+        rate_limiter.acquire()
+
+    # The first token is available immediately, the next 10 take at least 1/50 second each
+    assert time.monotonic() - t0 >= 0.19
+
+
 def test_scan_distribution(json_fixture):
     key = "data_update_frequency"
     response = json_fixture("2024-08-24-hdx-snapshot-filtered.json")
@@ -58,3 +110,362 @@ def test_fetch_data_from_ckan_package_search(mock_request, json_fixture):
         json=query,
         timeout=20,
     )
+
+
+@mock.patch("urllib3.PoolManager.request")
+@mock.patch("urllib3.request")
+def test_fetch_data_from_ckan_package_search_concurrently(mock_request, mock_pool_request):
+    datasets = [{"name": f"dataset-{i:02d}"} for i in range(25)]
+
+    def make_page(start, rows):
+        return json.dumps({"result": {"count": 25, "results": datasets[start : start + rows]}})
+
+    mock_request.return_value.data = make_page(0, 10)
+    mock_pool_request.side_effect = lambda *args, **kwargs: mock.Mock(
+        data=make_page(kwargs["json"]["start"], kwargs["json"]["rows"])
+    )
+
+    package_search_url = "https://fake_hdx_site.org/api/action/package_search"
+    query = {"fq": "*:*", "start": 0, "rows": 10}
+    response = fetch_data_from_ckan_package_search(
+        package_search_url, query, hdx_api_key="", fetch_all=True, workers=3
+    )
+
+    assert [x["name"] for x in response["result"]["results"]] == [x["name"] for x in datasets]
+    assert mock_pool_request.call_count == 2
+
+
+@mock.patch("urllib3.request")
+def test_refresh_datasets_from_ckan_package_search(mock_request, tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.ndjson")
+    _ = write_snapshot(
+        [
+            {"id": "a", "name": "deleted", "metadata_modified": "2024-01-01T00:00:00.000000"},
+            {"id": "b", "name": "modified", "metadata_modified": "2024-01-02T00:00:00.000000"},
+            {"id": "c", "name": "unchanged", "metadata_modified": "2024-01-03T00:00:00.123456"},
+        ],
+        snapshot_path,
+    )
+    modified = [
+        {"id": "b", "name": "modified", "metadata_modified": "2024-02-01T00:00:00.000000"},
+        {"id": "c", "name": "unchanged", "metadata_modified": "2024-01-03T00:00:00.123456"},
+        {"id": "d", "name": "added", "metadata_modified": "2024-02-02T00:00:00.000000"},
+    ]
+    ids = [{"id": "b"}, {"id": "c"}, {"id": "d"}]
+
+    def make_page(*args, **kwargs):
+        results = ids if "fl" in kwargs["json"] else modified
+        return mock.Mock(data=json.dumps({"result": {"count": 3, "results": results}}))
+
+    mock_request.side_effect = make_page
+
+    package_search_url = "https://fake_hdx_site.org/api/action/package_search"
+    datasets = list(
+        refresh_datasets_from_ckan_package_search(snapshot_path, package_search_url, "")
+    )
+
+    assert mock_request.call_args_list[0].kwargs["json"]["fq"] == (
+        "metadata_modified:[2024-01-03T00:00:00.123Z TO *]"
+    )
+    assert [x["name"] for x in datasets] == ["modified", "unchanged", "added"]
+    assert datasets[0]["metadata_modified"] == "2024-02-01T00:00:00.000000"
+
+
+@mock.patch("urllib3.request")
+def test_fetch_datasets_with_cursor(mock_request):
+    datasets = [{"id": f"id-{i:02d}", "name": f"dataset-{i:02d}"} for i in range(25)]
+
+    def search(*args, **kwargs):
+        query = kwargs["json"]
+        assert query["sort"] == "id asc"
+        after = re.search(r'id:\{"(.*)" TO \*\]', query["fq"])
+        results = [x for x in datasets if after is None or x["id"] > after.group(1)]
+        # A dataset added early in the id order during the fetch would shift later offsets
+        if after is not None:
+            datasets.insert(0, {"id": f"id-00-{len(datasets)}", "name": "added"})
+        page = results[query["start"] : query["start"] + query["rows"]]
+        return mock.Mock(data=json.dumps({"result": {"count": len(results), "results": page}}))
+
+    mock_request.side_effect = search
+    package_search_url = "https://fake_hdx_site.org/api/action/package_search"
+    query = {"fq": "*:*", "start": 0, "rows": 10}
+    fetched = list(
+        fetch_datasets_from_ckan_package_search(
+            package_search_url, query, hdx_api_key="", fetch_all=True, cursor=True
+        )
+    )
+
+    assert [x["name"] for x in fetched] == [f"dataset-{i:02d}" for i in range(25)]
+    assert mock_request.call_count == 3
+    for call in mock_request.call_args_list:
+        assert call.kwargs["json"]["start"] == 0
+    assert mock_request.call_args_list[2].kwargs["json"]["fq"] == '(*:*) AND id:{"id-19" TO *]'
+
+
+def test_make_field_projection():
+    assert make_field_projection(["name", "private", "resources.format"]) == {
+        "name": "name",
+        "private": "capacity",
+        "resources.format": "res_format",
+    }
+    assert make_field_projection(["name", "resources._csrf_token"]) is None
+
+
+def test_reshape_projected_dataset():
+    projection = make_field_projection(
+        ["name", "private", "organization.name", "resources.name", "resources.format"]
+    )
+    projected_dataset = {
+        "name": "gibraltar-healthsites",
+        "capacity": "public",
+        "organization": "healthsites",
+        "res_name": ["gibraltar-healthsites-csv", "gibraltar-healthsites-shp"],
+        "res_format": ["CSV", "SHP"],
+    }
+
+    dataset = reshape_projected_dataset(projected_dataset, projection)
+
+    assert dataset == {
+        "name": "gibraltar-healthsites",
+        "private": False,
+        "organization": {"name": "healthsites"},
+        "resources": [
+            {"name": "gibraltar-healthsites-csv", "format": "CSV"},
+            {"name": "gibraltar-healthsites-shp", "format": "SHP"},
+        ],
+    }
+
+
+def test_reshape_projected_dataset_leaves_out_misaligned_resource_values():
+    projection = make_field_projection(["name", "resources.format", "resources.name"])
+    projected_dataset = {
+        "name": "gibraltar-healthsites",
+        "res_format": ["SHP"],
+        "res_name": ["gibraltar-healthsites-csv", "gibraltar-healthsites-shp"],
+    }
+
+    dataset = reshape_projected_dataset(projected_dataset, projection)
+
+    assert dataset == {
+        "name": "gibraltar-healthsites",
+        "resources": [
+            {"name": "gibraltar-healthsites-csv"},
+            {"name": "gibraltar-healthsites-shp"},
+        ],
+    }
+
+
+@mock.patch("urllib3.PoolManager.request")
+def test_fetch_datasets_with_checkpoints_resume(mock_pool_request, tmp_path):
+    datasets = [{"id": f"{i:02d}", "name": f"dataset-{i:02d}"} for i in range(25)]
+    failing_offsets = {20}
+
+    def make_page(*args, **kwargs):
+        start = kwargs["json"]["start"]
+        if start in failing_offsets:
+            raise TimeoutError(f"Timed out at {start}")
+        results = datasets[start : start + kwargs["json"]["rows"]]
+        return mock.Mock(data=json.dumps({"result": {"count": 25, "results": results}}))
+
+    mock_pool_request.side_effect = make_page
+    package_search_url = "https://fake_hdx_site.org/api/action/package_search"
+    query = {"fq": "*:*", "rows": 10}
+    checkpoint_directory = str(tmp_path / "checkpoints")
+
+    with pytest.raises(TimeoutError):
+        list(fetch_datasets_with_checkpoints(package_search_url, query, "", checkpoint_directory))
+
+    with open(os.path.join(checkpoint_directory, "manifest.json"), encoding="utf-8") as manifest:
+        assert json.load(manifest)["completed_offsets"] == [0, 10]
+
+    failing_offsets.clear()
+    mock_pool_request.reset_mock()
+    fetched = list(
+        fetch_datasets_with_checkpoints(
+            package_search_url, query, "", checkpoint_directory, resume=True
+        )
+    )
+
+    assert mock_pool_request.call_count == 1
+    assert fetched == datasets
+
+
+@mock.patch("time.sleep")
+def test_fetch_policy_retries_and_resizes(mock_sleep):
+    datasets = [{"name": f"dataset-{i:02d}"} for i in range(25)]
+    failures = [urllib3.exceptions.ReadTimeoutError(None, "", "timed out"), 503]
+
+    def make_response(*args, **kwargs):
+        if len(failures) != 0:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return mock.Mock(status=failure)
+        start, rows = kwargs["json"]["start"], kwargs["json"]["rows"]
+        page = {"result": {"count": 25, "results": datasets[start : start + rows]}}
+        return mock.Mock(status=200, data=json.dumps(page))
+
+    http = mock.Mock()
+    http.request.side_effect = make_response
+    policy = FetchPolicy(max_rows=20, min_rows=5)
+
+    response = policy.fetch(http, "", {}, {"fq": "*:*", "rows": 20}, 0)
+
+    assert [x["name"] for x in response["result"]["results"]] == [x["name"] for x in datasets[:20]]
+    assert http.request.call_args_list[1].kwargs["json"]["rows"] == 10
+    assert mock_sleep.call_count == 2
+    assert policy.rows == 20
+    summary = policy.summarise()
+    assert summary["n_requests"] == 4
+    assert summary["n_failures"] == 2
+
+
+def test_scan_actions(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    actions = [
+        ("survey", "resources._csrf_token,resources.in_quarantine"),
+        ("distribution", "resources.format"),
+        ("list", "organization.name,resources.name"),
+    ]
+
+    survey, distribution, rows = scan_actions(iter(datasets), actions)
+
+    assert survey == scan_survey(datasets, actions[0][1])
+    assert distribution.most_common() == scan_distribution(datasets, actions[1][1]).most_common()
+    assert rows == list_from_datasets(datasets, actions[2][1])
+
+    with pytest.raises(ValueError):
+        scan_actions(datasets, [("survey", "private"), ("delete_key", "extras")])
+
+
+def test_iterate_resources(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    records = list(iterate_resources(iter(datasets)))
+
+    assert len(records) == sum(len(x["resources"]) for x in datasets)
+    assert records[0]["dataset"] is datasets[0]
+    assert records[0]["organization"] is datasets[0]["organization"]
+    assert records[0]["format"] == datasets[0]["resources"][0]["format"]
+    assert "dataset" not in datasets[0]["resources"][0]
+    assert resource_key_to_dataset_key("format") == "resources.format"
+    assert resource_key_to_dataset_key("dataset.name") == "name"
+    assert resource_key_to_dataset_key("organization.name") == "organization.name"
+
+
+def test_scan_actions_over_resources(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    actions = [
+        ("survey", "in_quarantine,_csrf_token"),
+        ("distribution", "format"),
+        ("list", "format,dataset.name"),
+    ]
+    survey_counter, distribution_counter, rows = scan_actions(datasets, actions, resources=True)
+
+    assert survey_counter == {"in_quarantine": 136, "_csrf_token": 3}
+    assert distribution_counter == scan_distribution(datasets, "resources.format")
+    assert rows[0] == {
+        "resource_name": datasets[0]["resources"][0]["name"],
+        "format": datasets[0]["resources"][0]["format"],
+        "dataset.name": datasets[0]["name"],
+    }
+    assert len(rows) == sum(len(x["resources"]) for x in datasets)
+
+    (csv_rows,) = scan_actions(
+        datasets, [("list", "format")], where='format == "CSV"', resources=True
+    )
+    assert len(csv_rows) == 9
+    assert {x["format"] for x in csv_rows} == {"CSV"}
+    lines = [json.dumps(x) for x in datasets]
+    assert scan_in_parallel(
+        lines, actions, 2, shard_size=5, where='format == "CSV"', resources=True
+    ) == scan_actions(datasets, actions, where='format == "CSV"', resources=True)
+
+
+def test_scan_in_parallel(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    lines = [json.dumps(x) for x in datasets]
+
+    key = "resources._csrf_token,resources.in_quarantine"
+    assert scan_in_parallel(lines, [("survey", key)], workers=2, shard_size=5) == [
+        scan_survey(datasets, key)
+    ]
+
+    actions = [("distribution", "resources.format"), ("list", "organization.name,resources.name")]
+    value_occurence_counter, rows = scan_in_parallel(datasets, actions, 2, shard_size=5)
+    assert (
+        value_occurence_counter.most_common()
+        == scan_distribution(datasets, actions[0][1]).most_common()
+    )
+    assert rows == list_from_datasets(datasets, actions[1][1])
+
+    where = 'resources.format in ["CSV", "GeoJSON"] and not private'
+    is_selected = compile_where(where)
+    selected_datasets = [x for x in datasets if is_selected(x)]
+    assert 0 < len(selected_datasets) < len(datasets)
+    assert scan_in_parallel(lines, actions, 2, shard_size=5, where=where) == scan_actions(
+        selected_datasets, actions
+    )
+
+    make_distribution = functools.partial(NumericDistribution, bin_width=50, bin_range=(0, 1000))
+    numeric_actions = [("distribution", "num_resources"), ("distribution", "resources.size")]
+    assert scan_in_parallel(
+        lines, numeric_actions, 2, shard_size=5, make_distribution=make_distribution
+    ) == scan_actions(datasets, numeric_actions, make_distribution=make_distribution)
+
+    make_distribution = functools.partial(ApproximateDistribution, top_k=5)
+    (approximate_distribution,) = scan_in_parallel(
+        lines, [actions[0]], 2, shard_size=5, make_distribution=make_distribution
+    )
+    exact_distribution = scan_distribution(datasets, actions[0][1])
+    assert approximate_distribution.estimate_distinct() == len(exact_distribution)
+    assert approximate_distribution.most_common() == [
+        (k, v, 0) for k, v in exact_distribution.most_common(5)
+    ]
+
+
+@mock.patch("urllib3.PoolManager.request")
+@mock.patch("urllib3.request")
+def test_scan_fetched_page_bodies_in_parallel(mock_request, mock_pool_request, json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+
+    def make_response(*args, **kwargs):
+        start, rows = kwargs["json"]["start"], kwargs["json"]["rows"]
+        page = {"result": {"count": len(datasets), "results": datasets[start : start + rows]}}
+        return mock.Mock(status=200, data=json.dumps(page).encode("utf-8"))
+
+    mock_request.side_effect = make_response
+    mock_pool_request.side_effect = make_response
+    package_search_url = "https://fake_hdx_site.org/api/action/package_search"
+
+    page_bodies = list(
+        fetch_page_bodies_from_ckan_package_search(
+            package_search_url, {"fq": "*:*", "start": 0, "rows": 10}, hdx_api_key="", workers=2
+        )
+    )
+
+    assert len(page_bodies) == 4
+    assert all(isinstance(x, bytes) for x in page_bodies)
+    actions = [("survey", "resources.format"), ("distribution", "organization.name")]
+    assert scan_in_parallel(page_bodies, actions, 2, shard_size=1) == scan_actions(
+        datasets, actions
+    )
+
+    # A missing page is not silently ignored
+    with pytest.raises(AssertionError, match="Fetched 30 datasets, CKAN reported 36"):
+        scan_in_parallel(page_bodies[0:3], actions, 2, shard_size=1)
+
+    # Projected results are reshaped in the worker processes
+    projection = make_field_projection(["name", "organization.name"])
+    projected_bodies = [
+        json.dumps(
+            {
+                "result": {
+                    "results": [{"name": x["name"], "organization": x["organization"]["name"]}]
+                }
+            }
+        ).encode("utf-8")
+        for x in datasets
+    ]
+    assert scan_in_parallel(
+        projected_bodies, [actions[1]], 2, shard_size=5, projection=projection
+    ) == scan_actions(datasets, [actions[1]])
@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import json
 import os
 from unittest import mock
 from click.testing import CliRunner
 
 from hdx.data.dataset import Dataset
 from hdx.api.configuration import Configuration, ConfigurationError
-from hdx_cli_toolkit.cli import list_datasets
+from hdx_cli_toolkit.cli import list_datasets, scan
+from hdx_cli_toolkit.snapshot_utilities import load_compact_snapshot, read_snapshot
 
 try:
     Configuration.create(
@@ -19,6 +21,8 @@ try:
 except ConfigurationError:
     pass
 
+FIXTURES_DIRECTORY = os.path.join(os.path.abspath(os.path.dirname(__file__)), "fixtures")
+
 
 @mock.patch("hdx.data.organization.Organization.get_datasets")
 def test_list_datasets(mock_hdx, json_fixture):
@@ -46,6 +50,163 @@ def test_list_datasets(mock_hdx, json_fixture):
     cli_test_template(command, cli_arguments, expected_output, forbidden_output="")
 
 
+def test_scan_rejects_fields_for_actions_which_write(tmp_path):
+    expected_output = "--fields can only be used with survey, distribution and list actions"
+    for cli_arguments in [
+        ["--action=delete_key", "--key=extras", "--fields=name"],
+        [
+            "--action=survey",
+            "--key=private",
+            "--fields=capacity",
+            "--rows=10",
+            f"--output_path={tmp_path / 'snapshot.ndjson'}",
+        ],
+    ]:
+        cli_test_template(scan, cli_arguments, expected_output)
+    assert not os.path.exists(tmp_path / "snapshot.ndjson")
+
+
+@mock.patch("urllib3.request")
+@mock.patch("hdx_cli_toolkit.cli.get_hdx_url_and_key")
+def test_scan_builds_index_from_complete_datasets(
+    mock_get_hdx_url_and_key, mock_request, json_fixture, tmp_path
+):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    mock_get_hdx_url_and_key.return_value = ("https://fake_hdx_site.org", "", "")
+    mock_request.side_effect = mock_package_search(datasets)
+    index_path = str(tmp_path / "snapshot.db")
+
+    cli_test_template(
+        scan,
+        ["--action=survey", "--key=private", "--rows=100", f"--index={index_path}"],
+        "Built snapshot index of 36 datasets",
+    )
+    assert "fl" not in mock_request.call_args.kwargs["json"]
+
+    # The index answers later actions on other keys
+    cli_test_template(
+        scan,
+        ["--action=distribution", "--key=license_id", f"--index={index_path}"],
+        "cc-by-sa     , 7",
+    )
+
+
+@mock.patch("urllib3.request")
+@mock.patch("hdx_cli_toolkit.cli.get_hdx_url_and_key")
+def test_scan_fetches_full_records_for_unprojectable_keys(
+    mock_get_hdx_url_and_key, mock_request, json_fixture
+):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    mock_get_hdx_url_and_key.return_value = ("https://fake_hdx_site.org", "", "")
+    mock_request.side_effect = mock_package_search(datasets)
+
+    cli_test_template(
+        scan,
+        ["--action=survey", "--key=data_update_frequency", "--rows=100"],
+        "data_update_frequency , 36",
+    )
+    assert "fl" not in mock_request.call_args.kwargs["json"]
+
+
+@mock.patch("urllib3.request")
+@mock.patch("hdx_cli_toolkit.cli.get_hdx_url_and_key")
+def test_scan_storage_from_package_search(mock_get_hdx_url_and_key, mock_request, json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    mock_get_hdx_url_and_key.return_value = ("https://fake_hdx_site.org", "", "")
+    mock_request.side_effect = mock_package_search(datasets)
+
+    cli_test_template(
+        scan,
+        ["--action=storage", "--rows=100"],
+        "Found 167 resources totalling 1014549221 bytes, 3 without a size",
+    )
+    assert "fl" not in mock_request.call_args.kwargs["json"]
+
+
+@mock.patch("urllib3.request")
+@mock.patch("hdx_cli_toolkit.cli.get_hdx_url_and_key")
+def test_scan_duplicates_from_package_search(mock_get_hdx_url_and_key, mock_request, json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    mock_get_hdx_url_and_key.return_value = ("https://fake_hdx_site.org", "", "")
+    mock_request.side_effect = mock_package_search(datasets)
+
+    cli_test_template(
+        scan,
+        ["--action=duplicates", "--rows=100"],
+        "Found 1 clusters of likely duplicates covering 2 resources in 2 datasets",
+    )
+    assert "fl" not in mock_request.call_args.kwargs["json"]
+
+
+@mock.patch("urllib3.request")
+@mock.patch("hdx_cli_toolkit.cli.get_hdx_url_and_key")
+def test_scan_saves_complete_datasets_to_store(
+    mock_get_hdx_url_and_key, mock_request, json_fixture, tmp_path
+):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    mock_get_hdx_url_and_key.return_value = ("https://fake_hdx_site.org", "", "")
+    mock_request.side_effect = mock_package_search(datasets)
+    store_directory = str(tmp_path / "store")
+
+    cli_test_template(
+        scan,
+        [
+            "--action=survey",
+            "--key=private",
+            "--rows=100",
+            "--workers=2",
+            f"--store_dir={store_directory}",
+            "--store_label=snapshot",
+        ],
+        "private , 36",
+    )
+    assert "fl" not in mock_request.call_args.kwargs["json"]
+    manifest_path = os.path.join(store_directory, "manifests", "snapshot.manifest")
+    assert list(read_snapshot(manifest_path)) == datasets
+
+
+def test_scan_columnar_from_compact_snapshot():
+    snapshot_path = os.path.join(FIXTURES_DIRECTORY, "2024-08-24-hdx-snapshot-filtered.json")
+    cli_arguments = [
+        f"--input_path={snapshot_path}",
+        "--columnar",
+        "--action=survey",
+        "--action=distribution",
+        "--key=private",
+        "--key=num_resources",
+        "--numeric",
+    ]
+
+    with mock.patch(
+        "hdx_cli_toolkit.cli.load_compact_snapshot", wraps=load_compact_snapshot
+    ) as mock_load_compact_snapshot:
+        compact_output = cli_test_template(
+            scan, cli_arguments + ["--compact"], "Loaded 36 datasets as a compact snapshot"
+        )
+    mock_load_compact_snapshot.assert_called_once_with(snapshot_path)
+
+    # Actions give the same results as when the snapshot is read a second time
+    output = cli_test_template(scan, cli_arguments, "Built columnar tables")
+    assert get_action_output(compact_output) == get_action_output(output)
+
+
+def get_action_output(output: str) -> str:
+    return output.split("Built columnar tables")[1].split("results took")[0]
+
+
+def mock_package_search(datasets):
+    # Serves pages of datasets, with only the top level keys listed in any fl parameter
+    def make_response(*args, **kwargs):
+        query = kwargs["json"]
+        results = datasets[query["start"] : query["start"] + query["rows"]]
+        if "fl" in query:
+            results = [{k: v for k, v in x.items() if k in query["fl"]} for x in results]
+        page = {"result": {"count": len(datasets), "results": results}}
+        return mock.Mock(status=200, data=json.dumps(page).encode("utf-8"))
+
+    return make_response
+
+
 def cli_test_template(command, cli_arguments, expected_output, forbidden_output=""):
     runner = CliRunner()
     result = runner.invoke(command, cli_arguments)
@@ -58,3 +219,5 @@ def cli_test_template(command, cli_arguments, expected_output, forbidden_output=
 
     if forbidden_output != "":
         assert forbidden_output not in str(result.exception)
+
+    return result.output
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import json
+
+import pytest
+
+from hdx_cli_toolkit import codec_utilities
+from hdx_cli_toolkit.codec_utilities import dumps, loads
+from hdx_cli_toolkit.snapshot_utilities import read_snapshot, write_snapshot
+
+RECORD = {"name": "café", "count": 3, "values": [1.5, None, True], "nested": {"a": "b"}}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def codec(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(codec_utilities, "orjson", None)
+    return request.param
+
+
+def test_codec_round_trip(codec):
+    assert codec_utilities.get_codec_name() == codec
+    encoded = dumps(RECORD)
+    assert isinstance(encoded, bytes)
+    assert b"\n" not in encoded
+    assert loads(encoded) == RECORD
+    assert loads(encoded.decode("utf-8")) == RECORD
+
+
+def test_codec_falls_back_for_values_orjson_rejects(codec):
+    big_integer = {"value": 2**70}
+    assert loads(dumps(big_integer)) == big_integer
+    assert loads(json.dumps(big_integer)) == big_integer
+
+
+def test_snapshot_round_trip_with_codec(codec, json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    for extension in [".ndjson", ".json"]:
+        snapshot_path = str(tmp_path / f"snapshot-{codec}{extension}")
+        write_snapshot(datasets, snapshot_path)
+        assert list(read_snapshot(snapshot_path)) == datasets
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+import json
+
+from hdx_cli_toolkit.diff_utilities import (
+    hash_record,
+    diff_snapshots,
+    find_changed_key_paths,
+)
+from hdx_cli_toolkit.snapshot_utilities import write_snapshot
+
+
+def test_hash_record_ignores_key_order():
+    assert hash_record({"a": 1, "b": [1, {"c": 2, "d": 3}]}) == hash_record(
+        {"b": [1, {"d": 3, "c": 2}], "a": 1}
+    )
+    assert hash_record({"a": 1}) != hash_record({"a": "1"})
+
+
+def test_find_changed_key_paths():
+    old_value = {"name": "a", "organization": {"name": "org", "title": "Org"}, "tags": [1, 2]}
+    new_value = {"name": "a", "organization": {"name": "org", "title": "New"}, "tags": [2, 1]}
+    new_value["archived"] = False
+
+    assert find_changed_key_paths(old_value, new_value) == [
+        "organization.title",
+        "tags",
+        "archived",
+    ]
+
+
+def test_diff_snapshots(json_fixture, tmp_path):
+    old_datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    old_snapshot_path = str(tmp_path / "old.ndjson")
+    write_snapshot(old_datasets, old_snapshot_path)
+
+    new_datasets = copy.deepcopy(old_datasets)
+    new_datasets[0]["notes"] = "changed"
+    new_datasets[2]["resources"][0]["format"] = "changed"
+    removed_resource = new_datasets[2]["resources"].pop()
+    removed_dataset = new_datasets.pop(1)
+    new_datasets.append({"id": "new-id", "name": "new-dataset", "resources": []})
+
+    changes = diff_snapshots(old_snapshot_path, iter(new_datasets))
+
+    assert changes == [
+        {
+            "change": "modified",
+            "dataset_name": old_datasets[0]["name"],
+            "resource_name": "",
+            "changed_keys": "notes",
+        },
+        {
+            "change": "resource modified",
+            "dataset_name": old_datasets[2]["name"],
+            "resource_name": old_datasets[2]["resources"][0]["name"],
+            "changed_keys": "resources.format",
+        },
+        {
+            "change": "resource removed",
+            "dataset_name": old_datasets[2]["name"],
+            "resource_name": removed_resource["name"],
+            "changed_keys": "",
+        },
+        {
+            "change": "added",
+            "dataset_name": "new-dataset",
+            "resource_name": "",
+            "changed_keys": "",
+        },
+        {
+            "change": "removed",
+            "dataset_name": removed_dataset["name"],
+            "resource_name": "",
+            "changed_keys": "",
+        },
+    ]
+    assert diff_snapshots(old_snapshot_path, old_datasets) == []
+
+    new_lines = [json.dumps(x) for x in new_datasets]
+    assert diff_snapshots(old_snapshot_path, new_lines, workers=2) == changes
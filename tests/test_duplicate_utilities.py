@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import json
+
+from hdx_cli_toolkit.ckan_utilities import scan_actions, scan_in_parallel
+from hdx_cli_toolkit.duplicate_utilities import (
+    DuplicateIndex,
+    get_resource_signals,
+    make_duplicates_table,
+)
+
+FS_CHECK_INFO = json.dumps(
+    [
+        {"state": "processing"},
+        {
+            "state": "success",
+            "hxl_proxy_response": {
+                "sheets": [
+                    {"name": "Sheet1", "header_hash": "abc", "nrows": 10, "ncols": 3},
+                    {"name": "Sheet2", "header_hash": None, "nrows": 0, "ncols": 0},
+                ]
+            },
+        },
+    ]
+)
+
+
+def test_get_resource_signals():
+    resource = {
+        "url": "https://data.example.org/dataset/1/resource/2/download/report.xlsx",
+        "size": "2048",
+        "hash": "",
+        "fs_check_info": FS_CHECK_INFO,
+    }
+
+    signals = get_resource_signals(resource)
+
+    assert signals == [
+        ("url", resource["url"]),
+        ("size_and_header", 2048, (("abc", 10, 3),)),
+        ("size_and_file_name", 2048, "report.xlsx"),
+    ]
+    assert get_resource_signals({"url": "https://example.org", "size": 0}) == [
+        ("url", "https://example.org")
+    ]
+
+
+def test_duplicate_index_clusters():
+    datasets = [
+        {
+            "name": "dataset-a",
+            "organization": {"name": "org-1"},
+            "resources": [
+                {"id": "a1", "url": "https://x.org/a/1/report.xlsx", "size": 100},
+                {"id": "a2", "url": "https://api.example.org/data", "size": None},
+                {"id": "a3", "url": "https://x.org/a/3/unique.csv", "size": 7},
+            ],
+        },
+        {
+            "name": "dataset-b",
+            "organization": {"name": "org-2"},
+            "resources": [
+                {"id": "b1", "url": "https://x.org/b/1/report.xlsx", "size": 100},
+                {"id": "b2", "url": "https://api.example.org/data", "size": None},
+            ],
+        },
+        {
+            "name": "dataset-c",
+            "organization": {"name": "org-2"},
+            "resources": [
+                {"id": "c1", "url": "https://x.org/c/1/copy.xlsx", "size": 100},
+                {"id": "c2", "url": "https://x.org/c/2/copy.xlsx", "size": 100},
+            ],
+        },
+    ]
+    datasets[2]["resources"][0]["fs_check_info"] = FS_CHECK_INFO
+    datasets[1]["resources"][0]["fs_check_info"] = FS_CHECK_INFO
+
+    duplicate_index = DuplicateIndex()
+    for dataset in datasets:
+        duplicate_index.add_dataset(dataset)
+    rows = make_duplicates_table(duplicate_index)
+
+    # c1 is linked to b1 by its file structure check and c2 to c1 by file name, within one dataset
+    assert [(x["cluster"], x["resource_id"], x["signals"]) for x in rows] == [
+        (1, "a1", "size_and_header,size_and_file_name"),
+        (1, "b1", "size_and_header,size_and_file_name"),
+        (1, "c1", "size_and_header,size_and_file_name"),
+        (1, "c2", "size_and_header,size_and_file_name"),
+        (2, "a2", "url"),
+        (2, "b2", "url"),
+    ]
+    assert rows[0]["n_resources"] == 4
+
+
+def test_duplicates_action_in_parallel(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    actions = [("duplicates", "private")]
+
+    (duplicate_index,) = scan_actions(datasets, actions)
+    (parallel_duplicate_index,) = scan_in_parallel(datasets, actions, 2, shard_size=5)
+
+    rows = make_duplicates_table(duplicate_index)
+    assert make_duplicates_table(parallel_duplicate_index) == rows
+    assert len(rows) == 2
+    assert {x["dataset_name"] for x in rows} == {
+        "sudan_wadi-halfa-and-abri-localities_-northern-state_sudan-health-nutrition-assessment_feb2024",
+        "sudan_wadi-halfa-and-abri-localities_-northern-state_sudan-wash-assessment",
+    }
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import pytest
+
+from hdx_cli_toolkit.filter_utilities import compile_where, list_where_keys
+
+DATASET = {
+    "name": "a-dataset",
+    "private": False,
+    "num_resources": 2,
+    "organization": {"name": "wfp", "title": "WFP"},
+    "tags": [{"name": "hxl"}, {"name": "food security"}],
+    "resources": [{"format": "CSV", "name": "a.csv"}, {"format": "XLSX", "name": "b.xlsx"}],
+}
+
+
+@pytest.mark.parametrize(
+    "expression,expected",
+    [
+        ('organization.name == "wfp"', True),
+        ('organization.name != "wfp"', False),
+        ('organization.name == "wfp" and resources.format in ["CSV"]', True),
+        ('resources.format in ["PDF", "JSON"]', False),
+        ('resources.format not in ["PDF", "JSON"]', True),
+        ('resources.format not in ["CSV"]', False),
+        ('resources.format == "XLSX"', True),
+        ('"hxl" in tags.name', True),
+        ('"WFP" in organization.title', True),
+        ('"WF" in organization.title', False),
+        ("num_resources >= 2 and not private", True),
+        ("1 < num_resources < 2", False),
+        ('num_resources > "1"', False),
+        ("archived", False),
+        ('archived == False or name == "a-dataset"', True),
+        ('missing.key != "x"', True),
+        ("resources.name", True),
+    ],
+)
+def test_compile_where(expression, expected):
+    assert compile_where(expression)(DATASET) is expected
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ['__import__("os").system("ls")', "name +", "name is None", "tags[0].name == 'hxl'"],
+)
+def test_compile_where_rejects_unsupported_expressions(expression):
+    with pytest.raises(ValueError):
+        compile_where(expression)
+
+
+def test_list_where_keys():
+    assert list_where_keys(
+        'organization.name == "wfp" and (resources.format in ["CSV"] or organization.name == "x")'
+    ) == ["organization.name", "resources.format"]
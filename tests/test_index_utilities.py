@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from hdx_cli_toolkit.ckan_utilities import scan_distribution, scan_survey
+from hdx_cli_toolkit.hdx_utilities import list_from_datasets
+from hdx_cli_toolkit.index_utilities import (
+    build_snapshot_index,
+    iterate_datasets_from_index,
+    survey_from_index,
+    distribution_from_index,
+    list_from_index,
+)
+
+
+def test_iterate_datasets_from_index(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    index_path = str(tmp_path / "snapshot.db")
+
+    n_datasets = build_snapshot_index(datasets, index_path)
+
+    assert n_datasets == len(datasets)
+    assert list(iterate_datasets_from_index(index_path)) == datasets
+
+
+def test_build_snapshot_index_leaves_no_partial_index(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    index_path = str(tmp_path / "snapshot.db")
+
+    def fail_part_way():
+        yield from datasets[0:10]
+        raise ValueError("Interrupted")
+
+    with pytest.raises(ValueError, match="Interrupted"):
+        build_snapshot_index(fail_part_way(), index_path)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_survey_from_index(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    index_path = str(tmp_path / "snapshot.db")
+    _ = build_snapshot_index(datasets, index_path)
+
+    for key in [
+        "resources._csrf_token,resources.in_quarantine",
+        "private,archived,extras",
+        "organization.name",
+    ]:
+        assert survey_from_index(index_path, key) == scan_survey(datasets, key)
+    assert survey_from_index(index_path, "private,resources.name") is None
+
+
+def test_distribution_from_index(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    index_path = str(tmp_path / "snapshot.db")
+    _ = build_snapshot_index(datasets, index_path)
+
+    for key in ["data_update_frequency", "private", "resources.format", "organization.name"]:
+        value_occurence_counter = distribution_from_index(index_path, key)
+        expected_counter = scan_distribution(datasets, key)
+        assert value_occurence_counter == expected_counter
+        assert value_occurence_counter.most_common() == expected_counter.most_common()
+    assert distribution_from_index(index_path, "tags") is None
+
+
+def test_list_from_index(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    index_path = str(tmp_path / "snapshot.db")
+    _ = build_snapshot_index(datasets, index_path)
+
+    key = "private,data_update_frequency,not_a_key"
+    assert list_from_index(index_path, key) == list_from_datasets(datasets, key)
+    assert list_from_index(index_path, "organization.name") is None
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import random
+
+import pytest
+
+from collections import Counter
+
+from hdx_cli_toolkit.sketch_utilities import (
+    ApproximateDistribution,
+    DistinctCounter,
+    HeavyHitters,
+    NumericDistribution,
+    QuantileSketch,
+)
+
+
+def make_skewed_values(n_values: int, seed: int) -> list[str]:
+    # Half of the values are drawn from a long tail of rare values
+    rng = random.Random(seed)
+    return [
+        f"common-{int(rng.paretovariate(1.0))}"
+        if rng.random() < 0.5
+        else f"rare-{rng.randrange(10**6)}"
+        for _ in range(n_values)
+    ]
+
+
+def test_quantile_sketch_relative_accuracy():
+    rng = random.Random(42)
+    values = [rng.lognormvariate(5, 2) for _ in range(20000)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    sorted_values = sorted(values)
+    for q in [0.0, 0.1, 0.5, 0.9, 0.99, 1.0]:
+        exact = sorted_values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.01)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_quantile_sketch_merge_matches_single_sketch():
+    values = [-25.0, -3.0, 0, 0, 1, 7.5, 12, 900, 1e6]
+    single_sketch = QuantileSketch()
+    shard_sketches = [QuantileSketch(), QuantileSketch()]
+    for i, value in enumerate(values):
+        single_sketch.add(value)
+        shard_sketches[i % 2].add(value)
+    shard_sketches[0].update(shard_sketches[1])
+
+    assert shard_sketches[0] == single_sketch
+    assert single_sketch.quantile(0) == pytest.approx(-25.0, rel=0.01)
+    assert single_sketch.quantile(0.25) == 0
+    with pytest.raises(ValueError):
+        single_sketch.update(QuantileSketch(relative_accuracy=0.05))
+
+
+def test_quantile_sketch_bounds_buckets():
+    sketch = QuantileSketch(max_buckets=20)
+    for value in range(1, 10000):
+        sketch.add(value)
+
+    assert len(sketch.positive_buckets) <= 20
+    assert sketch.count == 9999
+    assert sketch.quantile(0.99) == pytest.approx(9900, rel=0.01)
+
+
+def test_numeric_distribution():
+    distribution = NumericDistribution()
+    for value in [0, 3, 10, 99, 100, 1000, -5, 0.5, "12", None, True, float("nan")]:
+        distribution.add(value)
+
+    assert distribution.count == 8
+    assert distribution.non_numeric == 4
+    assert distribution.get_histogram() == [
+        ("(-10, -1]", 1),
+        ("0", 1),
+        ("[0.1, 1)", 1),
+        ("[1, 10)", 1),
+        ("[10, 100)", 2),
+        ("[100, 1000)", 1),
+        ("[1000, 10000)", 1),
+    ]
+    summary = distribution.summarise()
+    assert (summary["min"], summary["max"]) == (-5, 1000)
+    assert summary["mean"] == pytest.approx(1207.5 / 8, abs=0.001)
+    assert summary["p50"] == pytest.approx(3, rel=0.01)
+
+
+def test_numeric_distribution_fixed_bins_merge():
+    first = NumericDistribution(bin_width=10, bin_range=(-10, 30))
+    second = NumericDistribution(bin_width=10, bin_range=(-10, 30))
+    for value in [1, 9, 10]:
+        first.add(value)
+    for value in [-1, 25]:
+        second.add(value)
+    first.update(second)
+
+    assert first.get_histogram() == [
+        ("[-10, 0)", 1),
+        ("[0, 10)", 2),
+        ("[10, 20)", 1),
+        ("[20, 30)", 1),
+    ]
+    assert (first.minimum, first.maximum, first.count) == (-1, 25, 5)
+    with pytest.raises(ValueError):
+        first.update(NumericDistribution())
+    with pytest.raises(ValueError):
+        first.update(NumericDistribution(bin_width=10, bin_range=(0, 30)))
+
+
+def test_numeric_distribution_fixed_bins_are_bounded():
+    distribution = NumericDistribution(bin_width=1, bin_range=(0, 5))
+    for value in [-1e12, -0.5, 0, 2.5, 4.999, 5, 1e12, 3e12]:
+        distribution.add(value)
+
+    assert distribution.get_histogram() == [
+        ("< 0", 2),
+        ("[0, 1)", 1),
+        ("[2, 3)", 1),
+        ("[4, 5)", 1),
+        (">= 5", 3),
+    ]
+    assert distribution.summarise()["max"] == 3e12
+    with pytest.raises(ValueError):
+        NumericDistribution(bin_width=10)
+    with pytest.raises(ValueError):
+        NumericDistribution(bin_width=1, bin_range=(0, 1e6))
+
+
+def test_heavy_hitters_error_bound():
+    values = make_skewed_values(50000, seed=1)
+    exact_counts = Counter(values)
+    heavy_hitters = HeavyHitters(capacity=200)
+    for value in values:
+        heavy_hitters.add(value)
+
+    assert len(heavy_hitters.counts) == 200
+    assert heavy_hitters.total == len(values)
+    for value, count, error in heavy_hitters.most_common():
+        assert count - error <= exact_counts[value] <= count
+        assert error <= len(values) / 200
+    assert [x for x, _, _ in heavy_hitters.most_common(5)] == [
+        x for x, _ in exact_counts.most_common(5)
+    ]
+
+
+def test_heavy_hitters_merge_keeps_error_bound():
+    values = make_skewed_values(50000, seed=2)
+    exact_counts = Counter(values)
+    first, second = HeavyHitters(capacity=200), HeavyHitters(capacity=200)
+    for i, value in enumerate(values):
+        (first if i < 20000 else second).add(value)
+    first.update(second)
+
+    assert first.total == len(values)
+    assert len(first.counts) == 200
+    for value, count, error in first.most_common():
+        assert count - error <= exact_counts[value] <= count
+    assert [x for x, _, _ in first.most_common(5)] == [x for x, _ in exact_counts.most_common(5)]
+    with pytest.raises(ValueError):
+        first.update(HeavyHitters(capacity=10))
+
+
+def test_distinct_counter():
+    values = make_skewed_values(50000, seed=3)
+    n_distinct = len(set(values))
+    first, second = DistinctCounter(error=0.01), DistinctCounter(error=0.01)
+    for i, value in enumerate(values):
+        (first if i % 2 == 0 else second).add(value)
+    first.update(second)
+
+    assert first.precision == 14
+    assert first.estimate() == pytest.approx(n_distinct, rel=0.03)
+    assert DistinctCounter().estimate() == 0
+
+
+def test_approximate_distribution():
+    distribution = ApproximateDistribution(top_k=3, count_error=0.5)
+    for value in ["CSV", "CSV", "XLSX", "CSV", "PDF", "XLSX", 1]:
+        distribution.add(value)
+
+    assert distribution.total == 7
+    assert distribution.estimate_distinct() == 4
+    assert distribution.most_common()[0] == ("CSV", 3, 0)
+    with pytest.raises(ValueError):
+        ApproximateDistribution(count_error=0)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import copy
+import glob
+import json
+import os
+import tracemalloc
+import types
+
+from hdx_cli_toolkit.ckan_utilities import scan_survey
+from hdx_cli_toolkit.snapshot_utilities import (
+    read_snapshot,
+    write_snapshot,
+    stream_to_snapshot,
+    write_to_store,
+    read_store_manifest,
+    IndexedSnapshot,
+    select_from_snapshot,
+    read_offset_index,
+    CompactSnapshot,
+    load_compact_snapshot,
+)
+
+
+def test_line_delimited_snapshot_round_trip(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    snapshot_path = str(tmp_path / "snapshot.ndjson")
+
+    n_datasets = write_snapshot(datasets, snapshot_path)
+
+    with open(snapshot_path, encoding="utf-8") as snapshot_file:
+        lines = snapshot_file.readlines()
+    assert n_datasets == len(datasets)
+    assert len(lines) == len(datasets)
+
+    snapshot = read_snapshot(snapshot_path)
+    assert isinstance(snapshot, types.GeneratorType)
+    assert list(snapshot) == datasets
+
+
+def test_legacy_snapshot_round_trip(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    snapshot_path = str(tmp_path / "snapshot.json")
+
+    _ = write_snapshot(datasets, snapshot_path)
+
+    with open(snapshot_path, encoding="utf-8") as snapshot_file:
+        response = json.load(snapshot_file)
+    assert response["result"]["count"] == len(datasets)
+    assert list(read_snapshot(snapshot_path)) == datasets
+
+    # Without an offset index the snapshot is loaded in full
+    os.remove(f"{snapshot_path}.idx")
+    assert list(read_snapshot(snapshot_path)) == datasets
+
+
+def test_scan_survey_from_streamed_snapshot(json_fixture, tmp_path):
+    key = "resources._csrf_token,resources.in_quarantine"
+    response = json_fixture("2024-08-24-hdx-snapshot-filtered.json")
+    snapshot_path = str(tmp_path / "snapshot.ndjson")
+
+    key_occurence_counter = scan_survey(
+        stream_to_snapshot(response["result"]["results"], snapshot_path), key
+    )
+    assert key_occurence_counter == {"resources._csrf_token": 3, "resources.in_quarantine": 136}
+
+    key_occurence_counter = scan_survey(read_snapshot(snapshot_path), key)
+    assert key_occurence_counter == {"resources._csrf_token": 3, "resources.in_quarantine": 136}
+
+
+def test_snapshot_store_round_trip(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    store_directory = str(tmp_path / "store")
+
+    first_manifest_path = write_to_store(datasets, store_directory, label="2026-10-16")
+    object_paths = glob.glob(os.path.join(store_directory, "objects", "*", "*.json.gz"))
+    assert len(object_paths) == len(datasets)
+
+    # Only the modified dataset is added to the store the next day
+    next_datasets = copy.deepcopy(datasets)
+    next_datasets[0]["notes"] = "changed"
+    second_manifest_path = write_to_store(next_datasets, store_directory, label="2026-10-17")
+    object_paths = glob.glob(os.path.join(store_directory, "objects", "*", "*.json.gz"))
+    assert len(object_paths) == len(datasets) + 1
+
+    assert list(read_snapshot(first_manifest_path)) == datasets
+    assert list(read_snapshot(second_manifest_path)) == next_datasets
+    assert [x["name"] for x in read_store_manifest(second_manifest_path)] == [
+        x["name"] for x in datasets
+    ]
+
+    repeated_manifest_path = write_to_store(datasets, store_directory, label="2026-10-16")
+    assert os.path.basename(repeated_manifest_path) == "2026-10-16-1.manifest"
+
+
+def test_indexed_snapshot(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    for filename in ["snapshot.ndjson", "snapshot.json"]:
+        snapshot_path = str(tmp_path / filename)
+        write_snapshot(datasets, snapshot_path)
+
+        with IndexedSnapshot(snapshot_path) as indexed_snapshot:
+            assert indexed_snapshot.get(datasets[3]["name"]) == datasets[3]
+            assert indexed_snapshot.get(datasets[4]["id"]) == datasets[4]
+            assert indexed_snapshot.get("not-a-dataset") is None
+            assert list(indexed_snapshot.select()) == datasets
+
+        organization = datasets[0]["organization"]["name"]
+        assert select_from_snapshot(snapshot_path, organization=organization) == [
+            x for x in datasets if x["organization"]["name"] == organization
+        ]
+
+
+def test_stream_to_snapshot_does_not_hold_datasets(tmp_path):
+    # Each dataset is 100kB, so holding all 200 until the offset index is written would take 20MB
+    datasets = (
+        {"id": f"id-{i}", "name": f"dataset-{i}", "notes": "x" * 100_000} for i in range(200)
+    )
+    snapshot_path = str(tmp_path / "snapshot.ndjson")
+
+    tracemalloc.start()
+    try:
+        n_datasets = write_snapshot(datasets, snapshot_path)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert n_datasets == 200
+    assert len(read_offset_index(snapshot_path)) == 200
+    assert peak_memory < 2_000_000
+
+
+def test_select_from_snapshot_builds_offset_index(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    snapshot_path = str(tmp_path / "snapshot.ndjson")
+    with open(snapshot_path, "w", encoding="utf-8") as snapshot_file:
+        for dataset in datasets:
+            snapshot_file.write(json.dumps(dataset, ensure_ascii=False) + "\n")
+    assert read_offset_index(snapshot_path) is None
+
+    assert select_from_snapshot(snapshot_path, dataset_filter="cod-ps-*") == [
+        x for x in datasets if x["name"].startswith("cod-ps-")
+    ]
+    assert len(read_offset_index(snapshot_path)) == len(datasets)
+
+    # An index for a snapshot which has since changed is ignored
+    with open(snapshot_path, "a", encoding="utf-8") as snapshot_file:
+        snapshot_file.write(json.dumps(datasets[0]) + "\n")
+    assert read_offset_index(snapshot_path) is None
+
+
+def test_compact_snapshot(json_fixture, tmp_path):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    snapshot_path = str(tmp_path / "snapshot.ndjson")
+    _ = write_snapshot(datasets, snapshot_path)
+
+    compact_snapshot = load_compact_snapshot(snapshot_path)
+
+    assert len(compact_snapshot) == len(datasets)
+    assert list(compact_snapshot) == datasets
+    assert compact_snapshot[1] == datasets[1]
+    assert scan_survey(compact_snapshot, "resources.format") == scan_survey(
+        datasets, "resources.format"
+    )
+
+    # Repeated strings and keys are stored once
+    records = compact_snapshot._records
+    first_resource, second_resource = records[2].values[records[2].keys.index("resources")][0:2]
+    assert first_resource.keys is second_resource.keys
+    formats = [x.values[x.keys.index("format")] for x in (first_resource, second_resource)]
+    assert formats[0] == formats[1] and formats[0] is formats[1]
+
+
+def test_compact_snapshot_is_independent_of_datasets():
+    dataset = {"name": "a", "tags": [{"name": "x"}], "count": 2, "private": False, "extra": None}
+    compact_snapshot = CompactSnapshot([dataset])
+
+    loaded_dataset = compact_snapshot[0]
+    loaded_dataset["tags"].append({"name": "y"})
+
+    assert compact_snapshot[0] == dataset
+    assert isinstance(compact_snapshot[0]["tags"], list)
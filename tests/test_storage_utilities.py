@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from collections import Counter
+
+from hdx_cli_toolkit.ckan_utilities import scan_actions, scan_in_parallel
+from hdx_cli_toolkit.storage_utilities import add_dataset_storage, make_storage_table
+
+
+def test_add_dataset_storage():
+    dataset = {
+        "organization": {"name": "org-a"},
+        "resources": [
+            {"format": "CSV", "url_type": "upload", "size": 2 * 10**6},
+            {"format": "CSV", "url_type": None, "size": "500"},
+            {"format": "XLSX", "url_type": "upload", "size": None},
+            {"format": "", "size": True},
+            "not a resource",
+        ],
+    }
+    totals = Counter()
+
+    add_dataset_storage(totals, dataset)
+
+    assert totals[("total", "", "n_resources")] == 4
+    assert totals[("total", "", "n_unknown_size")] == 2
+    assert totals[("total", "", "total_bytes")] == 2 * 10**6 + 500
+    assert totals[("total", "", "n_over_1MB")] == 1
+    assert totals[("organization", "org-a", "total_bytes")] == 2 * 10**6 + 500
+    assert totals[("format", "CSV", "n_resources")] == 2
+    assert totals[("url_type", "", "n_resources")] == 2
+    assert totals[("format", "XLSX", "total_bytes")] == 0
+
+
+def test_make_storage_table():
+    totals = Counter()
+    add_dataset_storage(totals, {"organization": None, "resources": [{"format": "PDF", "size": 5}]})
+    add_dataset_storage(
+        totals, {"organization": {"name": "org-b"}, "resources": [{"format": "CSV", "size": 50}]}
+    )
+
+    rows = make_storage_table(totals)
+
+    assert [(x["dimension"], x["value"]) for x in rows] == [
+        ("total", ""),
+        ("organization", "org-b"),
+        ("organization", ""),
+        ("format", "CSV"),
+        ("format", "PDF"),
+        ("url_type", ""),
+    ]
+    assert rows[0]["total_bytes"] == 55
+    assert rows[0]["n_over_1GB"] == 0
+
+
+def test_storage_action_in_parallel(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    actions = [("storage", "private"), ("survey", "private")]
+
+    results = scan_actions(datasets, actions)
+
+    assert scan_in_parallel(datasets, actions, 2, shard_size=5) == results
+    rows = make_storage_table(results[0])
+    assert rows[0]["n_resources"] == sum(len(x["resources"]) for x in datasets)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from hdx_cli_toolkit.ckan_utilities import scan_distribution, scan_survey
+from hdx_cli_toolkit.hdx_utilities import list_from_datasets
+from hdx_cli_toolkit.table_utilities import (
+    build_snapshot_tables,
+    survey_from_tables,
+    distribution_from_tables,
+    list_from_tables,
+)
+
+
+def test_build_snapshot_tables(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+
+    tables = build_snapshot_tables(datasets)
+
+    assert tables.datasets.n_rows == len(datasets)
+    assert tables.resources.n_rows == sum(len(x["resources"]) for x in datasets)
+    assert all(len(x.codes) == tables.datasets.n_rows for x in tables.datasets.columns.values())
+    names = tables.datasets.columns["name"]
+    assert [names.values[x] for x in names.codes] == [x["name"] for x in datasets]
+
+
+def test_survey_from_tables(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    tables = build_snapshot_tables(datasets)
+
+    for key in [
+        "resources._csrf_token,resources.in_quarantine",
+        "private,archived,extras",
+        "organization.name,not_a_key",
+        "private,resources.name",
+    ]:
+        survey = survey_from_tables(tables, key)
+        assert survey == scan_survey(datasets, key)
+        assert list(survey) == list(scan_survey(datasets, key))
+    assert survey_from_tables(tables, "tags.name") is None
+
+
+def test_distribution_from_tables(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    tables = build_snapshot_tables(datasets)
+
+    for key in ["data_update_frequency", "private", "resources.format", "organization.name"]:
+        value_occurence_counter = distribution_from_tables(tables, key)
+        expected_counter = scan_distribution(datasets, key)
+        assert value_occurence_counter == expected_counter
+        assert value_occurence_counter.most_common() == expected_counter.most_common()
+    assert distribution_from_tables(tables, "tags") is None
+
+
+def test_list_from_tables(json_fixture):
+    datasets = json_fixture("2024-08-24-hdx-snapshot-filtered.json")["result"]["results"]
+    tables = build_snapshot_tables(datasets)
+
+    for key in [
+        "private,data_update_frequency,not_a_key",
+        "organization.name,organization.not_a_key",
+        "private,resources.format,resources.not_a_key",
+    ]:
+        assert list_from_tables(tables, key) == list_from_datasets(datasets, key)
+    assert list_from_tables(tables, "tags.name") is None
+
+
+def test_tables_fall_back_for_irregular_structure():
+    datasets = [
+        {"name": "a", "organization": {"name": "org"}, "resources": [{"format": "CSV"}]},
+        {"name": "b", "organization": None, "resources": ["not a resource"], "flag": True},
+        {"name": "c", "resources": [], "flag": 1},
+    ]
+    tables = build_snapshot_tables(datasets)
+
+    assert survey_from_tables(tables, "organization.name") is None
+    assert distribution_from_tables(tables, "resources.format") is None
+    assert list_from_tables(tables, "flag") == list_from_datasets(datasets, "flag")
+    assert list_from_tables(tables, "flag")[1]["flag"] is True
+    assert distribution_from_tables(tables, "flag") == scan_distribution(datasets, "flag")
@@ -14,6 +14,7 @@ from hdx_cli_toolkit.utilities import (
     make_conversion_func,
     make_path_unique,
     query_dict,
+    compile_query,
     traverse,
 )
 
@@ -269,6 +270,57 @@ def test_query_dict_list_list(json_fixture):
     assert len(output) == 5
 
 
+def test_compile_query_matches_query_dict(json_fixture):
+    dataset_dict = json_fixture("gibraltar_with_extras.json")[0]
+    for keys in [
+        ["archived", "batch"],
+        ["organization.name"],
+        ["resources.name", "resources.format"],
+        ["resources.name", "resources.format", "tags.display_name", "organization.name"],
+        ["resources.fs_check_info", "private"],
+    ]:
+        output_row = {"dataset_name": "test"}
+        for key_ in keys:
+            output_row[key_] = ""
+        query = compile_query(keys)
+        output = query(dataset_dict, output_row.copy())
+        expected = query_dict(keys, dataset_dict, output_row.copy())
+
+        assert len(output) == len(expected)
+        assert all(row in expected for row in output)
+
+
+def test_compile_query_three_keys_deep(json_fixture):
+    keys = ["name", "resources.fs_check_info.state"]  # list.list.key
+    dataset_dict = json_fixture("gibraltar_with_extras.json")[0]
+    query = compile_query(keys)
+    output = query(dataset_dict, {"dataset_name": "test", "name": "", keys[1]: ""})
+
+    # Resources without fs_check_info keep the value from the output row
+    states = [x[keys[1]] for x in output]
+    assert states == ["processing", "success", "", "", "", "processing", "success"]
+    assert output[0]["name"] == dataset_dict["name"]
+
+
+def test_compile_query_list_dict_list():
+    keys = ["resources.check.sheets.name", "organization.title"]
+    dataset_dict = {
+        "organization": {"title": "Org"},
+        "resources": [
+            {"check": {"sheets": [{"name": "a"}, {"name": "b"}]}},
+            {"check": [{"sheets": [{"name": "c"}]}, {"sheets": [[{"name": "d"}]]}]},
+            {"check": {"sheets": []}},
+            {"check": {}},
+            {"check": {"sheets": [{}]}},
+        ],
+    }
+    output_row = {keys[0]: "", keys[1]: ""}
+    output = compile_query(keys)(dataset_dict, output_row)
+
+    assert [x[keys[0]] for x in output] == ["a", "b", "c", "d", "", "'name' key absent"]
+    assert all(x[keys[1]] == "Org" for x in output)
+
+
 def test_traverse_simple(json_fixture):
     keys = "archived".split(".")
     dataset_dict = json_fixture("gibraltar_with_extras.json")[0]